@@ -10,9 +10,15 @@ from hanabi.live import check_game
 from hanabi.live import download_data
 from hanabi.live import compress
 from hanabi.live import instance_finder
+from hanabi.live import solve_jobs
+from hanabi.live import scheduling
+from hanabi.live import solve_metrics
+from hanabi.solvers import greedy_tuning
+from hanabi.solvers import deck_analyzer
 from hanabi.hanab_game import GameState
 from hanabi.database import init_database, cur, conn
 from hanabi.database import global_db_connection_manager
+from hanabi.database import sharding
 from hanabi.database.games_db_interface import load_instance, store_actions
 
 """
@@ -85,6 +91,8 @@ def subcommand_download(
         , variant_id: Optional[int]
         , export_all: bool = False
         , all_variants: bool = False
+        , missing: bool = False
+        , bulk: bool = False
 ):
     if game_id is not None:
         download_data.detailed_export_game(game_id)
@@ -93,13 +101,46 @@ def subcommand_download(
         download_data.download_games(variant_id, export_all)
         logger.info("Successfully exported games for variant id {}".format(variant_id))
     if all_variants:
-        for variant in variants.get_all_variant_ids():
-            download_data.download_games(variant, export_all)
+        download_data.download_variants(variants.get_all_variant_ids(), export_all)
         logger.info("Successfully exported games for all variants")
+    if missing:
+        download_data.download_all_games_not_in_db(bulk=bulk)
 
 
-def subcommand_solve(var_id: int, seed_class: int, num_players: Optional[int], list_all_pace_cuts: bool, timeout: int, num_threads: int):
-    instance_finder.solve_unknown_seeds(var_id, seed_class, num_players, list_all_pace_cuts, timeout, num_threads)
+def subcommand_solve(var_id: int, seed_class: int, num_players: Optional[int], list_all_pace_cuts: bool, timeout: int, num_threads: int, policy: str, shard: sharding.Shard):
+    instance_finder.solve_unknown_seeds(var_id, seed_class, num_players, list_all_pace_cuts, timeout, num_threads, policy, shard)
+
+
+def subcommand_solve_tiered(var_id: int, seed_class: int, num_players: Optional[int], list_all_pace_cuts: bool, base_timeout: int, num_tiers: int, tier_factor: int, num_threads: int, policy: str, shard: sharding.Shard):
+    instance_finder.solve_tiered(var_id, seed_class, num_players, list_all_pace_cuts, base_timeout, num_tiers, tier_factor, num_threads, policy, shard)
+
+
+def subcommand_simulate_scheduling(var_id: int, seed_class: int, num_threads: int, timeout: int, hours: float):
+    scheduling.simulate_policies(var_id, seed_class, num_threads, timeout, hours)
+
+
+def subcommand_enqueue_solve(var_id: int, seed_class: int, num_players: Optional[int], timeout: int):
+    solve_jobs.enqueue_solve_jobs(var_id, seed_class, num_players, timeout)
+
+
+def subcommand_solve_worker(list_all_pace_cuts: bool, num_threads: int):
+    solve_jobs.run_solve_worker(list_all_pace_cuts, num_threads)
+
+
+def subcommand_status():
+    solve_metrics.print_status()
+
+
+def subcommand_tune_greedy(var_id: int, num_players: int, seed_class: int, sample_size: int, iterations: int, num_threads: int):
+    greedy_tuning.tune_greedy_weights(var_id, num_players, seed_class, sample_size, iterations, num_threads)
+
+
+def subcommand_analyze_decks(var_id: int, list_all_pace_cuts: bool, num_threads: int, restart: bool, shard: sharding.Shard):
+    deck_analyzer.run_on_database(var_id, list_all_pace_cuts, num_threads, restart, shard)
+
+
+def subcommand_bound_scores(var_id: int, seed_class: int, num_players: Optional[int], num_threads: int, shard: sharding.Shard):
+    instance_finder.bound_unknown_seeds(var_id, seed_class, num_players, num_threads, shard)
 
 
 def subcommand_gen_config():
@@ -189,12 +230,25 @@ def add_download_subparser(subparsers):
         dest='all_variants',
         help='Download information from games on all variants (but not necessarily export all of them)'
     )
+    group.add_argument(
+        '--missing', '-m',
+        action='store_true',
+        dest='missing',
+        help='Export all games with ids up to the largest known one that are not in the database yet'
+    )
     parser.add_argument(
         '--export-all', '-e',
         action='store_true',
         dest='export_all',
         help='Export all games specified in full detail (i.e. also actions and game options)'
     )
+    parser.add_argument(
+        '--bulk', '-b',
+        action='store_true',
+        dest='bulk',
+        help='Write exported games in batches using COPY, which is faster for large backfills. '
+             'Applies to --missing.'
+    )
 
 
 def add_analyze_subparser(subparsers):
@@ -210,11 +264,74 @@ def add_config_gen_subparser(subparsers):
 def add_solve_subparser(subparsers):
     parser = subparsers.add_parser('solve', help='Seed solving')
     parser.add_argument('var_id', type=int, help='Variant id to solve instances from.', default=0)
-    parser.add_argument('--timeout', '-t', type=int, help='Timeout [s] for individual seeds.', default=3600)
+    parser.add_argument('--timeout', '-t', type=int, help='Timeout [s] for individual seeds.', default=instance_finder.SOLVE_TIMEOUT_SECONDS)
     parser.add_argument('--class', '-c', type=int, dest='seed_class', help='Class of seed to analyze. 0 stands for hanab.live seeds', default=0)
     parser.add_argument('--num_players', '-n', type=int, help='Restrict to number of players. If not specified, all player counts are analyzed.', default = None)
     parser.add_argument('--num_threads', '-p', type=int, help='Number of threads to solve with.', default=4)
     parser.add_argument('--list_all_pace_cuts', '-l', help='List all pace cuts for each deck', action='store_true')
+    parser.add_argument('--policy', type=str, choices=scheduling.POLICIES, help='Order in which seeds are solved.', default=scheduling.DEFAULT_POLICY)
+    parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i/n of the seeds, selected by a hash of their names.', default=sharding.ALL_SEEDS)
+
+def add_solve_tiered_subparser(subparsers):
+    parser = subparsers.add_parser('solve-tiered', help='Seed solving with growing timeouts for seeds that timed out')
+    parser.add_argument('var_id', type=int, help='Variant id to solve instances from.', default=0)
+    parser.add_argument('--base_timeout', '-t', type=int, help='Timeout [s] of the first tier.', default=10)
+    parser.add_argument('--num_tiers', type=int, help='Number of tiers.', default=4)
+    parser.add_argument('--tier_factor', type=int, help='Factor by which the timeout grows from tier to tier.', default=instance_finder.DEFAULT_TIER_FACTOR)
+    parser.add_argument('--class', '-c', type=int, dest='seed_class', help='Class of seed to analyze. 0 stands for hanab.live seeds', default=0)
+    parser.add_argument('--num_players', '-n', type=int, help='Restrict to number of players. If not specified, all player counts are analyzed.', default=None)
+    parser.add_argument('--num_threads', '-p', type=int, help='Number of threads to solve with.', default=4)
+    parser.add_argument('--list_all_pace_cuts', '-l', help='List all pace cuts for each deck', action='store_true')
+    parser.add_argument('--policy', type=str, choices=scheduling.POLICIES, help='Order in which seeds are solved within a tier.', default=scheduling.DEFAULT_POLICY)
+    parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i/n of the seeds, selected by a hash of their names.', default=sharding.ALL_SEEDS)
+
+def add_simulate_scheduling_subparser(subparsers):
+    parser = subparsers.add_parser('simulate-scheduling', help='Compare orders of solving seeds on past solve times')
+    parser.add_argument('var_id', type=int, help='Variant id to take solve times from.', default=0)
+    parser.add_argument('--class', '-c', type=int, dest='seed_class', help='Class of seeds to simulate on. 0 stands for hanab.live seeds', default=0)
+    parser.add_argument('--num_threads', '-p', type=int, help='Number of simulated solving threads.', default=4)
+    parser.add_argument('--timeout', '-t', type=int, help='Timeout [s] for individual seeds.', default=150)
+    parser.add_argument('--hours', type=float, help='Simulated duration of solving.', default=1)
+
+def add_enqueue_solve_subparser(subparsers):
+    parser = subparsers.add_parser('enqueue-solve', help='Add unsolved seeds to the queue of solve workers')
+    parser.add_argument('var_id', type=int, help='Variant id to solve instances from.', default=0)
+    parser.add_argument('--timeout', '-t', type=int, help='Timeout [s] for individual seeds.', default=instance_finder.SOLVE_TIMEOUT_SECONDS)
+    parser.add_argument('--class', '-c', type=int, dest='seed_class', help='Class of seed to analyze. 0 stands for hanab.live seeds', default=0)
+    parser.add_argument('--num_players', '-n', type=int, help='Restrict to number of players. If not specified, all player counts are added.', default=None)
+
+def add_solve_worker_subparser(subparsers):
+    parser = subparsers.add_parser('solve-worker', help='Solve seeds from the queue until it is empty')
+    parser.add_argument('--num_threads', '-p', type=int, help='Number of threads to solve with.', default=4)
+    parser.add_argument('--list_all_pace_cuts', '-l', help='List all pace cuts for each deck', action='store_true')
+
+def add_status_subparser(subparsers):
+    parser = subparsers.add_parser('status', help='Show metrics of the current or last solving run on this host')
+
+def add_tune_greedy_subparser(subparsers):
+    parser = subparsers.add_parser('tune-greedy', help='Tune weights of greedy strategy used before SAT solving')
+    parser.add_argument('var_id', type=int, help='Variant id to take sample seeds from.', default=0)
+    parser.add_argument('--num_players', '-n', type=int, help='Number of players to tune weights for.', required=True)
+    parser.add_argument('--class', '-c', type=int, dest='seed_class', help='Class of seeds to sample. 0 stands for hanab.live seeds', default=0)
+    parser.add_argument('--sample_size', '-s', type=int, help='Number of seeds to evaluate weights on.', default=1000)
+    parser.add_argument('--iterations', '-i', type=int, help='Number of search iterations.', default=50)
+    parser.add_argument('--num_threads', '-p', type=int, help='Number of threads to evaluate weights with.', default=4)
+
+def add_analyze_decks_subparser(subparsers):
+    parser = subparsers.add_parser('analyze-decks', help='Check all seeds of a variant for infeasibility reasons')
+    parser.add_argument('var_id', type=int, help='Variant id to analyze seeds from.', default=0)
+    parser.add_argument('--num_threads', '-p', type=int, help='Number of threads to analyze with.', default=4)
+    parser.add_argument('--list_all_pace_cuts', '-l', help='List all pace cuts for each deck', action='store_true')
+    parser.add_argument('--restart', '-r', help='Analyze all seeds again instead of resuming the last run', action='store_true')
+    parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i/n of the seeds, selected by a hash of their names.', default=sharding.ALL_SEEDS)
+
+def add_bound_scores_subparser(subparsers):
+    parser = subparsers.add_parser('bound-scores', help='Compute lower and upper bounds on the maximum score of unsolved seeds')
+    parser.add_argument('var_id', type=int, help='Variant id to bound seeds from.', default=0)
+    parser.add_argument('--class', '-c', type=int, dest='seed_class', help='Class of seed to bound. 0 stands for hanab.live seeds', default=0)
+    parser.add_argument('--num_players', '-n', type=int, help='Restrict to number of players. If not specified, all player counts are bounded.', default=None)
+    parser.add_argument('--num_threads', '-p', type=int, help='Number of threads to compute bounds with.', default=4)
+    parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i/n of the seeds, selected by a hash of their names.', default=sharding.ALL_SEEDS)
 
 def add_decompress_subparser(subparsers):
     parser = subparsers.add_parser('decompress', help='Decompress a hanab.live JSON-encoded replay link')
@@ -238,6 +355,14 @@ def main_parser() -> argparse.ArgumentParser:
     add_download_subparser(subparsers)
     add_config_gen_subparser(subparsers)
     add_solve_subparser(subparsers)
+    add_solve_tiered_subparser(subparsers)
+    add_simulate_scheduling_subparser(subparsers)
+    add_enqueue_solve_subparser(subparsers)
+    add_solve_worker_subparser(subparsers)
+    add_status_subparser(subparsers)
+    add_tune_greedy_subparser(subparsers)
+    add_analyze_decks_subparser(subparsers)
+    add_bound_scores_subparser(subparsers)
     add_decompress_subparser(subparsers)
     add_show_seed_subparser(subparsers)
     add_store_solution_subparser(subparsers)
@@ -253,12 +378,20 @@ def hanabi_cli():
         'download': subcommand_download,
         'gen-config': subcommand_gen_config,
         'solve': subcommand_solve,
+        'solve-tiered': subcommand_solve_tiered,
+        'simulate-scheduling': subcommand_simulate_scheduling,
+        'enqueue-solve': subcommand_enqueue_solve,
+        'solve-worker': subcommand_solve_worker,
+        'status': subcommand_status,
+        'tune-greedy': subcommand_tune_greedy,
+        'analyze-decks': subcommand_analyze_decks,
+        'bound-scores': subcommand_bound_scores,
         'decompress': subcommand_decompress,
         'show': subcommand_show,
         'store-solution': subcommand_store_solution,
     }[args.command]
 
-    if args.command != 'gen-config':
+    if args.command not in ['gen-config', 'status']:
         global_db_connection_manager.read_config()
         global_db_connection_manager.connect()
 
@@ -11,6 +11,7 @@ PLAYER_NAMES = ["Alice", "Bob", "Cathy", "Donald", "Emily", "Frank"]
 # DB connection parameters
 DEFAULT_DB_NAME = 'hanab-live'
 DEFAULT_DB_USER = 'hanabi'
+DEFAULT_DB_HOST = 'localhost'
 
 
 # hanab.live stuff
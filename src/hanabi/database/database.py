@@ -47,6 +47,7 @@ class DBConnectionManager:
         self.db_name: str = constants.DEFAULT_DB_NAME
         self.db_user: str = constants.DEFAULT_DB_USER
         self.db_pass: Optional[str] = None
+        self.db_host: str = constants.DEFAULT_DB_HOST
 
     def read_config(self):
         logger.debug("DB connection configuration read from {}".format(self.config_file))
@@ -56,6 +57,8 @@ class DBConnectionManager:
             self.db_name = config.get('dbname', None)
             self.db_user = config.get('dbuser', None)
             self.db_pass = config.get('dbpass', None)
+            # Only needed when workers on several hosts share one database
+            self.db_host = config.get('dbhost', constants.DEFAULT_DB_HOST)
             if self.db_name is None:
                 logger.verbose("Falling back to default database name {}".format(constants.DEFAULT_DB_NAME))
                 self.db_name = constants.DEFAULT_DB_NAME
@@ -79,17 +82,25 @@ class DBConnectionManager:
         self.config_file.write_text(
             "dbname: {}\n"
             "dbuser: {}\n"
-            "dbpass: null".format(
+            "dbpass: null\n"
+            "dbhost: {}".format(
                 constants.DEFAULT_DB_NAME,
-                constants.DEFAULT_DB_USER
+                constants.DEFAULT_DB_USER,
+                constants.DEFAULT_DB_HOST
             )
         )
         logger.info("Initialised default config file {}".format(self.config_file))
 
-    def connect(self):
-        conn = psycopg2.connect("dbname='{}' user='{}' password='{}' host='localhost' sslmode='disable'".format(
-            self.db_name, self.db_user, self.db_pass),
+    def new_connection(self):
+        """
+        Opens a connection that is independent of the global one, e.g. for use in another thread.
+        """
+        return psycopg2.connect("dbname='{}' user='{}' password='{}' host='{}' sslmode='disable'".format(
+            self.db_name, self.db_user, self.db_pass, self.db_host),
         )
+
+    def connect(self):
+        conn = self.new_connection()
         cur = conn.cursor()
         self.lazy_conn.set_conn(conn)
         self.lazy_cur.set_cur(cur)
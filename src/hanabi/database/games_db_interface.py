@@ -1,4 +1,5 @@
-from typing import List, Tuple, Optional
+import io
+from typing import List, Tuple, Optional, Dict
 
 import psycopg2.extras
 
@@ -28,6 +29,22 @@ def store_actions(game_id: int, actions: List[hanabi.hanab_game.Action], cert_ga
     conn.commit()
 
 
+def copy_actions(actions_by_game: Dict[int, List[hanabi.hanab_game.Action]], cert_game: bool = False, conn=default_conn):
+    """
+    Stores actions of several games at once with COPY. Does not commit, so that this can be part of a larger transaction.
+    Since COPY cannot skip existing rows, this is only meant for freshly created games.
+    """
+    buffer = io.StringIO()
+    for game_id, actions in actions_by_game.items():
+        for turn, action in enumerate(actions):
+            buffer.write("{}\t{}\t{}\t{}\t{}\n".format(game_id, turn, action.type.value, action.target, action.value or 0))
+    buffer.seek(0)
+    conn.cursor().copy_expert(
+        "COPY {} (game_id, turn, type, target, value) FROM STDIN".format(get_actions_table_name(cert_game)),
+        buffer
+    )
+
+
 def store_deck_for_seed(seed: str, deck: List[hanabi.hanab_game.DeckCard], conn=default_conn):
     vals = []
     for index, card in enumerate(deck):
@@ -184,4 +184,92 @@ CREATE TABLE infeasibility_reasons (
     */
     value             SMALLINT NOT NULL DEFAULT 0,
     PRIMARY KEY (seed, reason, index)
-);
\ No newline at end of file
+);
+
+/* Seeds of each variant have been checked by the deck analyzer in order of their names up to last_seed */
+DROP TABLE IF EXISTS deck_analysis_progress CASCADE;
+CREATE TABLE deck_analysis_progress (
+    variant_id  SMALLINT NOT NULL,
+    /* Shard of the seeds that was analyzed, see database/sharding.py */
+    shard       SMALLINT NOT NULL DEFAULT 0,
+    num_shards  SMALLINT NOT NULL DEFAULT 1,
+    last_seed   TEXT     NOT NULL,
+    PRIMARY KEY (variant_id, shard, num_shards)
+);
+
+/*
+    Lower bounds on the maximum score achievable on a seed.
+    game_id refers to a game from hanab.live achieving this score, if any.
+*/
+DROP TABLE IF EXISTS score_lower_bounds CASCADE;
+CREATE TABLE score_lower_bounds (
+    seed                TEXT     NOT NULL PRIMARY KEY REFERENCES seeds (seed) ON DELETE CASCADE,
+    score_lower_bound   SMALLINT NOT NULL,
+    game_id             INT      REFERENCES games (id) ON DELETE CASCADE
+);
+
+/* Upper bounds on the maximum score achievable on a seed, as computed by relaxations of the game */
+DROP TABLE IF EXISTS score_upper_bounds CASCADE;
+CREATE TABLE score_upper_bounds (
+    seed                TEXT     NOT NULL PRIMARY KEY REFERENCES seeds (seed) ON DELETE CASCADE,
+    score_upper_bound   SMALLINT NOT NULL
+);
+
+/*
+    Queue of seeds to be solved, shared by workers on possibly several hosts.
+    A job is leased by a worker until lease_expires_at, the worker renews this while solving.
+    Jobs are removed once their result is stored.
+*/
+DROP TABLE IF EXISTS solve_jobs CASCADE;
+CREATE TABLE solve_jobs (
+    seed                TEXT        NOT NULL PRIMARY KEY REFERENCES seeds (seed) ON DELETE CASCADE,
+    /* Timeout for solving in seconds */
+    timeout             INT         NOT NULL,
+    /* Host and process id of the worker holding the lease, NULL if the job is free */
+    worker              TEXT,
+    lease_expires_at    TIMESTAMPTZ,
+    /* Number of times this job has been leased */
+    attempts            SMALLINT    NOT NULL DEFAULT 0
+);
+CREATE INDEX solve_jobs_worker_idx ON solve_jobs (worker);
+
+/*
+    Finished tiers of tiered solving, i.e. runs over all unsolved seeds with the given timeout (in seconds).
+    num_players is 0 if all player counts were solved.
+*/
+DROP TABLE IF EXISTS solve_tiers CASCADE;
+CREATE TABLE solve_tiers (
+    variant_id  SMALLINT NOT NULL,
+    class       SMALLINT NOT NULL,
+    num_players SMALLINT NOT NULL,
+    timeout     INT      NOT NULL,
+    shard       SMALLINT NOT NULL DEFAULT 0,
+    num_shards  SMALLINT NOT NULL DEFAULT 1,
+    num_seeds   INT      NOT NULL,
+    num_solved  INT      NOT NULL,
+    PRIMARY KEY (variant_id, class, num_players, timeout, shard, num_shards)
+);
+
+
+/*
+    Instances that have been solved, in their canonical form (see live/canonical_instances.py).
+    Seeds that are equal up to relabeling of suits and rotation of players share a key,
+    so results for new seeds can be taken from the representative seed stored here.
+*/
+DROP TABLE IF EXISTS canonical_instances CASCADE;
+CREATE TABLE canonical_instances (
+    key                 TEXT    PRIMARY KEY,
+    seed                TEXT    NOT NULL REFERENCES seeds ON DELETE CASCADE,
+    feasible            BOOLEAN NOT NULL,
+    certificate_game_id INT     REFERENCES certificate_games (id) ON DELETE SET NULL
+);
+
+
+/*
+    Game ids for which hanab.live reported that there is no game (e.g. because the game was deleted),
+    so that they are skipped when looking for games that are missing in the database.
+*/
+DROP TABLE IF EXISTS missing_game_ids CASCADE;
+CREATE TABLE missing_game_ids (
+    id                  INT     PRIMARY KEY
+);
@@ -0,0 +1,47 @@
+import argparse
+import hashlib
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    Part of the seeds of a run, so that runs can be split across hosts by hand without any coordination.
+    Seeds are assigned by a hash of their name, so the split is stable and does not depend on which seeds exist.
+    Shard i of n contains the seeds whose hash is congruent to i modulo n.
+    """
+    index: int = 0
+    count: int = 1
+
+    def sql_condition(self, column: str = 'seeds.seed') -> str:
+        """
+        :return: SQL condition selecting the seeds in this shard, matching contains()
+        """
+        if self.count == 1:
+            return "TRUE"
+        # First 32 bits of the md5 hash, padded so that the cast yields a non-negative number
+        return "(('x' || lpad(substr(md5({}), 1, 8), 16, '0'))::bit(64)::bigint % {}) = {}".format(
+            column, self.count, self.index
+        )
+
+    def contains(self, seed: str) -> bool:
+        return int(hashlib.md5(seed.encode()).hexdigest()[:8], 16) % self.count == self.index
+
+    def __str__(self):
+        return "{}/{}".format(self.index, self.count)
+
+
+ALL_SEEDS = Shard()
+
+
+def parse_shard(shard: str) -> Shard:
+    """
+    Parses shards of the form 'i/n' with 0 <= i < n, as used on the command line
+    """
+    try:
+        index, count = map(int, shard.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard has to be of the form i/n, found {}".format(shard))
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError("Shard index has to be between 0 and {}, found {}".format(count - 1, index))
+    return Shard(index, count)
@@ -145,7 +145,7 @@ class HanabiInstance:
         self.num_strikes = num_strikes or constants.NUM_STRIKES
         self.clue_starved = clue_starved
         self.fives_give_clue = fives_give_clue
-        self.deck_plays = deck_plays,
+        self.deck_plays = deck_plays
         self.all_or_nothing = all_or_nothing
         assert not self.all_or_nothing, "All or nothing not implemented"
         self.starting_player = starting_player
@@ -0,0 +1,292 @@
+import asyncio
+import collections
+import queue
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Dict, Callable, Coroutine, Hashable, List
+
+import httpx
+import platformdirs
+
+from hanabi import logger
+from hanabi import constants
+from hanabi.live import site_api
+
+# Maximum number of exports downloaded at the same time
+EXPORT_CONCURRENCY = 16
+# Maximum number of requests sent to the site per second, over all concurrent downloads
+EXPORT_REQUESTS_PER_SECOND = 20
+# Maximum number of downloaded exports waiting to be written to the database
+EXPORT_QUEUE_SIZE = 256
+REQUEST_TIMEOUT_SECONDS = 30
+MAX_ATTEMPTS = 4
+# Maximum number of API pages downloaded at the same time, over all streams of pages
+PAGE_CONCURRENCY = 16
+# Maximum number of pages of a single stream downloaded ahead of the page that is processed
+PAGE_WINDOW = 8
+
+
+class NotFoundError(Exception):
+    """
+    The site reported that the requested resource (e.g. a game) does not exist
+    """
+    def __init__(self, url: str):
+        super().__init__("{} does not exist on the site".format(url))
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that at most the given number of requests per second are started, shared by all tasks
+    """
+    def __init__(self, requests_per_second: float):
+        self.interval = 1 / requests_per_second
+        self.next_slot = 0
+
+    async def wait(self):
+        # No lock needed, since there is no await between reading and updating the next slot
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+class ResponseCache:
+    """
+    Successful responses downloaded by the exporter, kept apart from the cache of the session of site_api.
+    Entries never expire, requests for resources that can still change have to bypass the cache.
+    Safe to use from several threads.
+    """
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, content TEXT NOT NULL, content_type TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, url: str) -> Optional[Dict | str]:
+        with self.lock:
+            row = self.conn.execute("SELECT content, content_type FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return site_api.parse_response(*row)
+
+    def store(self, url: str, content: str, content_type: str) -> Dict | str:
+        """
+        :return: The parsed response
+        """
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, content, content_type) VALUES (?, ?, ?)",
+                (url, content, content_type)
+            )
+            self.conn.commit()
+        return site_api.parse_response(content, content_type)
+
+
+# Cache of this process, opened on first use
+_response_cache: Optional[ResponseCache] = None
+
+
+def response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            platformdirs.user_cache_dir(constants.APP_NAME, ensure_exists=True) + '/hanab.live-export.sqlite'
+        )
+    return _response_cache
+
+
+async def _fetch(
+        client: httpx.AsyncClient, limiter: RateLimiter, url: str, refresh: bool = False
+) -> Optional[Dict | str]:
+    """
+    :param refresh: Whether to ignore a cached response
+    :raises NotFoundError: If the site responds with 404
+    """
+    # The cache is backed by SQLite, so it is accessed in a worker thread to not block the event loop
+    loop = asyncio.get_running_loop()
+    cache = response_cache()
+    if not refresh:
+        cached = await loop.run_in_executor(None, cache.get, url)
+        if cached is not None:
+            return cached
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.wait()
+        try:
+            response = await client.get(site_api.SITE_URL + url)
+        except httpx.TransportError as e:
+            logger.debug("Request {} failed: {}".format(url, e))
+        else:
+            if response.status_code == 200:
+                return await loop.run_in_executor(
+                    None, cache.store, url, response.text, response.headers.get('content-type', '')
+                )
+            if response.status_code == 404:
+                raise NotFoundError(url)
+            # Retry only if the site is overloaded, other errors will not go away by retrying
+            if response.status_code != 429 and response.status_code < 500:
+                logger.debug("Request {} produced status code {}".format(url, response.status_code))
+                return None
+        await asyncio.sleep(2 ** attempt)
+    logger.warning("Giving up on request {} after {} attempts".format(url, MAX_ATTEMPTS))
+    return None
+
+
+async def _fetch_exports(
+        game_ids: Iterable[int], exports: queue.Queue, concurrency: int, requests_per_second: float
+):
+    limiter = RateLimiter(requests_per_second)
+    slots = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT_SECONDS) as client:
+        async def fetch(game_id: int):
+            not_found = False
+            try:
+                game_json = await _fetch(client, limiter, "export/{}".format(game_id))
+            except NotFoundError as e:
+                logger.debug(e)
+                game_json = None
+                not_found = True
+            except Exception as e:
+                logger.error("Failed to download game {}: {}".format(game_id, e))
+                game_json = None
+            try:
+                # Blocks while the queue is full, i.e. while database writes lag behind
+                await asyncio.to_thread(exports.put, (game_id, game_json, not_found))
+            finally:
+                slots.release()
+
+        tasks = set()
+        for game_id in game_ids:
+            # Only create tasks for downloads that can start, so that long lists of games do not pile up
+            await slots.acquire()
+            task = asyncio.create_task(fetch(game_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+
+def _consume(fetch: Callable[[queue.Queue], Coroutine], handle: Callable):
+    """
+    Runs fetch on an event loop in a background thread and calls handle in the calling thread on each result
+    that fetch puts into the queue, so that the database connection is only used by the calling thread.
+    The queue is bounded, so downloads wait while handling the results lags behind.
+    """
+    results = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(fetch(results))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            results.put(None)
+
+    # The thread is a daemon, so that an interrupt while handling results does not wait for the remaining downloads
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while (result := results.get()) is not None:
+        handle(*result)
+    thread.join()
+    if len(errors) != 0:
+        raise errors[0]
+
+
+def export_games(
+        game_ids: Iterable[int],
+        process: Callable[[int, Optional[Dict]], None],
+        concurrency: int = EXPORT_CONCURRENCY,
+        requests_per_second: float = EXPORT_REQUESTS_PER_SECOND,
+        on_not_found: Optional[Callable[[int], None]] = None
+):
+    """
+    Downloads the exports of the given games concurrently and calls process on each export in the calling thread,
+    in the order the downloads finish.
+    :param process: Called with the game id and the export, which is None if the site did not return one
+    :param on_not_found: If given, additionally called (before process) with the id of each game
+        that the site reported as nonexistent, as opposed to downloads that failed
+    """
+    def handle(game_id: int, game_json: Optional[Dict], not_found: bool):
+        if not_found and on_not_found is not None:
+            on_not_found(game_id)
+        process(game_id, game_json)
+
+    _consume(lambda exports: _fetch_exports(game_ids, exports, concurrency, requests_per_second), handle)
+
+
+async def _fetch_page(
+        client: httpx.AsyncClient, limiter: RateLimiter, slots: asyncio.Semaphore,
+        url: str, last: bool, page_size: int
+) -> Optional[Dict]:
+    async with slots:
+        # The last page is still filling up, so it is always downloaded again
+        page = await _fetch(client, limiter, url, refresh=last)
+        if last or page is None or len(page.get('rows', [])) == page_size:
+            return page
+        # Row count does not match, maybe this is due to an old cached version of the page,
+        # try again with a forced refresh
+        logger.verbose("Refreshing {} due to unexpected row count".format(url))
+        return await _fetch(client, limiter, url, refresh=True)
+
+
+async def _fetch_page_stream(
+        client: httpx.AsyncClient, limiter: RateLimiter, slots: asyncio.Semaphore,
+        key: Hashable, urls: List[str], pages: queue.Queue, page_size: int, window: int
+):
+    # Downloads of the upcoming pages, in page order
+    pending = collections.deque()
+    next_index = 0
+    try:
+        for index in range(len(urls)):
+            while next_index < len(urls) and len(pending) < window:
+                last = next_index == len(urls) - 1
+                pending.append(asyncio.create_task(
+                    _fetch_page(client, limiter, slots, urls[next_index], last, page_size)
+                ))
+                next_index += 1
+            page = await pending.popleft()
+            await asyncio.to_thread(pages.put, (key, index, page))
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _fetch_page_streams(
+        streams: Dict[Hashable, List[str]], pages: queue.Queue,
+        page_size: int, window: int, concurrency: int, requests_per_second: float
+):
+    limiter = RateLimiter(requests_per_second)
+    slots = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT_SECONDS) as client:
+        await asyncio.gather(*(
+            _fetch_page_stream(client, limiter, slots, key, urls, pages, page_size, window)
+            for key, urls in streams.items()
+        ))
+
+
+def fetch_pages(
+        streams: Dict[Hashable, List[str]],
+        process: Callable[[Hashable, int, Optional[Dict]], None],
+        page_size: int,
+        window: int = PAGE_WINDOW,
+        concurrency: int = PAGE_CONCURRENCY,
+        requests_per_second: float = EXPORT_REQUESTS_PER_SECOND
+):
+    """
+    Downloads several sequences of API pages at once (e.g. the game listings of several variants) and calls process
+    on each page in the calling thread. All streams share the rate limit and the number of concurrent requests.
+    Pages of different streams are interleaved, but the pages of each stream are processed in order,
+    while up to window pages of each stream are downloaded ahead of the one being processed.
+    Pages other than the last one of a stream are taken from the cache, unless they do not have page_size rows.
+    If they still do not have page_size rows after downloading them again, they are processed anyway.
+    :param streams: Maps a key to the urls of the pages of that stream
+    :param process: Called with the key of the stream, the index of the page in its stream and the page,
+        which is None if the site did not return it
+    """
+    _consume(
+        lambda pages: _fetch_page_streams(streams, pages, page_size, window, concurrency, requests_per_second),
+        process
+    )
@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from typing import List
+
+from hanabi import hanab_game
+
+
+@dataclass
+class CanonicalForm:
+    """
+    Normal form of an instance as seen by the solvers, shared by all instances that are equal up to
+    relabeling of suits (of the same kind, i.e. dark or not) and rotation of the players.
+    The canonical instance is dealt such that player 0 starts, and suits are numbered in order of first appearance.
+    """
+    key: str
+    instance: hanab_game.HanabiInstance
+    # canonical deck index -> deck index in the original instance
+    deck_indices: List[int]
+    # suit index in the original instance -> canonical suit index
+    suit_map: List[int]
+    # Original player that becomes player 0
+    starting_player: int
+
+    def to_canonical(self, actions: List[hanab_game.Action]) -> List[hanab_game.Action]:
+        positions = {original: canonical for (canonical, original) in enumerate(self.deck_indices)}
+        return self._translate(actions, positions, self.suit_map, -self.starting_player)
+
+    def from_canonical(self, actions: List[hanab_game.Action]) -> List[hanab_game.Action]:
+        inverse_suit_map = [0] * len(self.suit_map)
+        for (suit, canonical_suit) in enumerate(self.suit_map):
+            inverse_suit_map[canonical_suit] = suit
+        return self._translate(actions, dict(enumerate(self.deck_indices)), inverse_suit_map, self.starting_player)
+
+    def _translate(self, actions, deck_map, suit_map, player_shift) -> List[hanab_game.Action]:
+        num_players = self.instance.num_players
+        translated = []
+        for action in actions:
+            match action.type:
+                case hanab_game.ActionType.Play | hanab_game.ActionType.Discard:
+                    translated.append(hanab_game.Action(action.type, deck_map[action.target], action.value))
+                case hanab_game.ActionType.ColorClue:
+                    # Color clues are only meaningful if colors correspond to suits
+                    value = suit_map[action.value] if action.value < len(suit_map) else action.value
+                    translated.append(hanab_game.Action(
+                        action.type, (action.target + player_shift) % num_players, value
+                    ))
+                case hanab_game.ActionType.RankClue:
+                    translated.append(hanab_game.Action(
+                        action.type, (action.target + player_shift) % num_players, action.value
+                    ))
+                case _:
+                    translated.append(action)
+        return translated
+
+    def replay(self, original: hanab_game.HanabiInstance, canonical_game: hanab_game.GameState) -> hanab_game.GameState:
+        """
+        Replays a game of the canonical instance on the original one
+        """
+        game = hanab_game.GameState(original)
+        for action in self.from_canonical(canonical_game.actions):
+            game.make_action(action)
+        return game
+
+
+def canonical_form(instance: hanab_game.HanabiInstance) -> CanonicalForm:
+    num_players = instance.num_players
+    hand_size = instance.hand_size
+    # Rotate the starting hands, so that the starting player becomes player 0
+    deck_indices = [
+        ((instance.starting_player + player) % num_players) * hand_size + index
+        for player in range(num_players) for index in range(hand_size)
+    ] + list(range(instance.num_dealt_cards, instance.deck_size))
+
+    # Number suits of each kind in order of first appearance
+    suit_map = [-1] * instance.num_suits
+    next_suit = {False: 0, True: instance.num_suits - instance.num_dark_suits}
+    for deck_index in deck_indices:
+        suit = instance.deck[deck_index].suitIndex
+        if suit_map[suit] == -1:
+            dark = suit in instance.dark_suits
+            suit_map[suit] = next_suit[dark]
+            next_suit[dark] += 1
+
+    deck = [
+        hanab_game.DeckCard(suit_map[instance.deck[deck_index].suitIndex], instance.deck[deck_index].rank)
+        for deck_index in deck_indices
+    ]
+    canonical_instance = hanab_game.HanabiInstance(
+        deck,
+        num_players,
+        hand_size=hand_size,
+        num_strikes=instance.num_strikes,
+        clue_starved=instance.clue_starved,
+        fives_give_clue=instance.fives_give_clue,
+        deck_plays=instance.deck_plays
+    )
+    key = "{}p{}h{}s{}{}{}:{}".format(
+        num_players, hand_size, instance.num_strikes,
+        int(instance.clue_starved), int(instance.fives_give_clue), int(instance.deck_plays),
+        "".join("{}{}".format(card.suitIndex, card.rank) for card in deck)
+    )
+    return CanonicalForm(key, canonical_instance, deck_indices, suit_map, instance.starting_player)
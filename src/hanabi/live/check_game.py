@@ -7,6 +7,7 @@ from hanabi import hanab_game
 from hanabi.live import hanab_live
 from hanabi.live import compress
 from hanabi.solvers import sat
+from hanabi.solvers import deck_analyzer
 
 from hanabi.database import games_db_interface
 
@@ -41,6 +42,8 @@ def check_game(game_id: int) -> Tuple[int, hanab_game.GameState]:
 
         # first, check if the instance itself is feasible:
         game = hanab_live.HanabLiveGameState(instance)
+        if len(deck_analyzer.analyze(instance).infeasibility_reasons) != 0:
+            return 0, None
         solvable, solution = sat.solve_sat(game)
         if not solvable:
             return 0, solution
@@ -57,7 +60,13 @@ def check_game(game_id: int) -> Tuple[int, hanab_game.GameState]:
             for a in range(solvable_turn, try_turn):
                 try_game.make_action(actions[a])
             logger.debug("Checking if instance {} is feasible after {} turns.".format(game_id, try_turn))
-            solvable, potential_sol = sat.solve_sat(try_game)
+            # Many lost states can be recognized without calling SAT
+            reasons = deck_analyzer.analyze_state(try_game).infeasibility_reasons
+            if len(reasons) != 0:
+                logger.debug("Analyzer found game state infeasible: {}".format(reasons))
+                solvable, potential_sol = False, None
+            else:
+                solvable, potential_sol = sat.solve_sat(try_game)
             if solvable:
                 solution = potential_sol
                 game = try_game
@@ -0,0 +1,108 @@
+from multiprocessing import shared_memory
+from typing import Iterable, Tuple, List, Optional
+
+import numpy
+
+from hanabi import hanab_game
+
+# Cards are packed into a single byte as suit_index * RANK_FACTOR + rank
+RANK_FACTOR = 8
+
+
+class DeckCorpus:
+    """
+    Decks of many seeds stored contiguously in a shared memory block, so that solving processes can read them
+    without the decks being pickled for each task.
+    The block consists of
+        - offsets (int64, one more than there are decks): deck i consists of the cards offsets[i] to offsets[i+1]
+        - number of players (uint8, one per deck)
+        - starting player (uint8, one per deck)
+        - cards (uint8, one per card, packed as described above)
+    The process creating the corpus owns the block and has to unlink it, other processes only attach to it.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, num_decks: int, num_cards: int, owner: bool):
+        self.shm = shm
+        self.num_decks = num_decks
+        self.num_cards = num_cards
+        self.owner = owner
+        offset = 0
+        self.offsets = numpy.ndarray((num_decks + 1,), dtype=numpy.int64, buffer=shm.buf, offset=offset)
+        offset += self.offsets.nbytes
+        self.num_players = numpy.ndarray((num_decks,), dtype=numpy.uint8, buffer=shm.buf, offset=offset)
+        offset += num_decks
+        self.starting_players = numpy.ndarray((num_decks,), dtype=numpy.uint8, buffer=shm.buf, offset=offset)
+        offset += num_decks
+        self.cards = numpy.ndarray((num_cards,), dtype=numpy.uint8, buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def size(num_decks: int, num_cards: int) -> int:
+        return 8 * (num_decks + 1) + 2 * num_decks + num_cards
+
+    @staticmethod
+    def create(decks: Iterable[Tuple[int, int, List[int], List[int]]]) -> 'DeckCorpus':
+        """
+        :param decks: Number of players, starting player, suits and ranks of each deck.
+        Only the packed representation is kept while reading, so this can be fed from a server-side cursor.
+        """
+        offsets = [0]
+        num_players = bytearray()
+        starting_players = bytearray()
+        cards = bytearray()
+        for (deck_num_players, starting_player, suits, ranks) in decks:
+            num_players.append(deck_num_players)
+            starting_players.append(starting_player)
+            cards.extend(suit * RANK_FACTOR + rank for (suit, rank) in zip(suits, ranks))
+            offsets.append(len(cards))
+
+        num_decks = len(num_players)
+        # Shared memory blocks cannot be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(DeckCorpus.size(num_decks, len(cards)), 1))
+        corpus = DeckCorpus(shm, num_decks, len(cards), owner=True)
+        corpus.offsets[:] = offsets
+        corpus.num_players[:] = numpy.frombuffer(num_players, dtype=numpy.uint8)
+        corpus.starting_players[:] = numpy.frombuffer(starting_players, dtype=numpy.uint8)
+        corpus.cards[:] = numpy.frombuffer(cards, dtype=numpy.uint8)
+        return corpus
+
+    @staticmethod
+    def attach(name: str, num_decks: int, num_cards: int) -> 'DeckCorpus':
+        return DeckCorpus(shared_memory.SharedMemory(name=name), num_decks, num_cards, owner=False)
+
+    def handle(self) -> Tuple[str, int, int]:
+        """
+        :return: Arguments of attach to access this corpus from another process
+        """
+        return self.shm.name, self.num_decks, self.num_cards
+
+    def __len__(self):
+        return self.num_decks
+
+    def deck(self, index: int) -> List[hanab_game.DeckCard]:
+        packed = self.cards[self.offsets[index]:self.offsets[index + 1]].tolist()
+        return [hanab_game.DeckCard(card // RANK_FACTOR, card % RANK_FACTOR) for card in packed]
+
+    def instance(self, index: int) -> hanab_game.HanabiInstance:
+        return hanab_game.HanabiInstance(
+            self.deck(index), int(self.num_players[index]), starting_player=int(self.starting_players[index])
+        )
+
+    def close(self):
+        # Views into the buffer have to be released before the block can be closed
+        del self.offsets, self.num_players, self.starting_players, self.cards
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Corpus attached by a solving process, set up once by the initializer of the process
+_attached_corpus: Optional[DeckCorpus] = None
+
+
+def attach_corpus(name: str, num_decks: int, num_cards: int):
+    global _attached_corpus
+    _attached_corpus = DeckCorpus.attach(name, num_decks, num_cards)
+
+
+def attached_corpus() -> DeckCorpus:
+    assert _attached_corpus is not None, "No deck corpus attached to this process"
+    return _attached_corpus
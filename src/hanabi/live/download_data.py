@@ -1,5 +1,10 @@
+import collections
+import io
+import time
+from dataclasses import dataclass
+
 import alive_progress
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Callable, Tuple, Iterable
 
 import psycopg2.errors
 import psycopg2.extras
@@ -11,6 +16,7 @@ from hanabi import constants
 from hanabi import logger
 from hanabi import database
 from hanabi.live import site_api
+from hanabi.live import async_export
 from hanabi.live import variants
 from hanabi.live import hanab_live
 
@@ -52,55 +58,120 @@ class GameExportInvalidNumberOfPlayersError(GameExportInvalidFormatError):
         )
 
 
-def ensure_users_in_db_and_get_ids(usernames: List[str]):
-    normalized_usernames = [unidecode.unidecode(username) for username in usernames]
-    psycopg2.extras.execute_values(
-        database.cur,
-        "INSERT INTO users (username, normalized_username)"
-        "VALUES %s "
-        "ON CONFLICT (username) DO NOTHING ",
-        zip(usernames, normalized_usernames)
-    )
+# Maximum number of user ids kept in memory, see ensure_users_in_db_and_get_ids
+USER_ID_CACHE_SIZE = 100000
 
-    # To only do one DB query, we sort by the normalized username.
-    ids = []
-    for username in usernames:
+# Ids of recently seen users by username, shared by all game importers of this process.
+# Entries are ordered by their last use, so that the least recently used ones are evicted first.
+_user_ids: collections.OrderedDict[str, int] = collections.OrderedDict()
+# Ids looked up by the current transaction. They are only moved to _user_ids once the transaction is committed,
+# since the users might have been inserted by it and vanish again on a rollback.
+_pending_user_ids: Dict[str, int] = {}
+
+
+def _promote_pending_user_ids():
+    """
+    Moves the ids looked up by the current transaction into the cache, has to be called after it was committed
+    """
+    for username, user_id in _pending_user_ids.items():
+        _user_ids[username] = user_id
+        _user_ids.move_to_end(username)
+    _pending_user_ids.clear()
+    while len(_user_ids) > USER_ID_CACHE_SIZE:
+        _user_ids.popitem(last=False)
+
+
+def _commit():
+    database.conn.commit()
+    _promote_pending_user_ids()
+
+
+def _rollback():
+    database.conn.rollback()
+    _pending_user_ids.clear()
+
+
+def ensure_users_in_db_and_get_ids(usernames: List[str]) -> List[int]:
+    """
+    Looks up the ids of the given users, inserting unknown users into the database.
+    Users not in the cache are resolved with a single query.
+    The ids are only cached for later transactions once the current one is committed with _commit.
+    """
+    missing = [
+        username for username in dict.fromkeys(usernames)
+        if username not in _user_ids and username not in _pending_user_ids
+    ]
+    if len(missing) != 0:
+        # The select does not see rows inserted in the same statement, so we combine it with the inserted rows
         database.cur.execute(
-            "SELECT id FROM users "
-            "WHERE username = %s",
-            (username,)
+            "WITH inserted AS ("
+            "  INSERT INTO users (username, normalized_username) "
+            "  SELECT * FROM unnest(%s::text[], %s::text[]) "
+            "  ON CONFLICT (username) DO NOTHING "
+            "  RETURNING id, username"
+            ") "
+            "SELECT id, username FROM inserted "
+            "UNION ALL "
+            "SELECT id, username FROM users WHERE username = ANY(%s)",
+            (missing, [unidecode.unidecode(username) for username in missing], missing)
         )
-        (id, ) = database.cur.fetchone()
-        ids.append(id)
+        for (user_id, username) in database.cur.fetchall():
+            _pending_user_ids[username] = user_id
 
+    ids = []
+    for username in usernames:
+        if username in _pending_user_ids:
+            ids.append(_pending_user_ids[username])
+        else:
+            _user_ids.move_to_end(username)
+            ids.append(_user_ids[username])
     return ids
 
-#
-def detailed_export_game(
+# Columns of the games table holding the options of a game, in the order of ExportedGame.options
+GAME_OPTION_COLUMNS = [
+    'timed', 'time_base', 'time_per_turn', 'speedrun', 'card_cycle', 'deck_plays', 'empty_clues',
+    'one_extra_card', 'one_less_card', 'all_or_nothing', 'detrimental_characters'
+]
+# Updates the options of games that are already present, used by all paths inserting games
+GAME_CONFLICT_CLAUSE = "ON CONFLICT (id) DO UPDATE SET ({}) = ({})".format(
+    ", ".join(GAME_OPTION_COLUMNS), ", ".join("EXCLUDED." + column for column in GAME_OPTION_COLUMNS)
+)
+
+
+@dataclass
+class ExportedGame:
+    """
+    Export of a game from hanab.live, parsed into what is stored in the database
+    """
+    game_id: int
+    seed: str
+    num_players: int
+    starting_player: int
+    var_id: int
+    score: int
+    options: Tuple
+    players: List[str]
+    deck: List[hanab_game.DeckCard]
+    actions: List[hanab_game.Action]
+
+    def num_rows(self) -> int:
+        """
+        :return: Number of rows written when storing this game (seed, deck, game, participants and actions)
+        """
+        return 2 + len(self.deck) + len(self.players) + len(self.actions)
+
+
+def parse_game_export(
           game_id: int
+        , game_json: Dict
         , score: Optional[int] = None
         , var_id: Optional[int] = None
-        , seed_exists: bool = False
-) -> None:
+) -> ExportedGame:
     """
-    Downloads full details of game from hanab.live, inserts seed and game into DB
-    If seed is already present, it is left as is
-    If game is already present, game details will be updated
-
-    :param game_id: id of game to export
-    :param score: If given, this will be inserted as score of the game. If not given, score is calculated
-    :param var_id: If given, this will be inserted as variant id of the game. If not given, this is looked up
-    :param seed_exists: If specified and true, assumes that the seed is already present in database.
-        If this is not the case, call will raise a DB insertion error
-
+    :param score: If given, this is used as score of the game. If not given, score is calculated
+    :param var_id: If given, this is used as variant id of the game. If not given, this is looked up
     :raises GameExportError and its child classes
     """
-
-    logger.debug("Importing game {}".format(game_id))
-
-    game_json = site_api.get("export/{}".format(game_id))
-    if game_json is None:
-        raise GameExportNoResponseFromSiteError(game_id)
     if type(game_json) != dict:
         raise GameExportInvalidResponseTypeError(game_id, type(game_json))
 
@@ -164,44 +235,46 @@ def detailed_export_game(
             game.make_action(action)
         score = game.score
 
+    return ExportedGame(
+        game_id, seed, num_players, starting_player, var_id, score,
+        (
+            timed, time_base, time_per_turn, speedrun, card_cycle, deck_plays, empty_clues, one_extra_card,
+            one_less_card, all_or_nothing, detrimental_characters
+        ),
+        players, deck, actions
+    )
+
+
+def store_exported_game(game: ExportedGame, seed_exists: bool = False):
+    """
+    Inserts seed and game into DB. If seed is already present, it is left as is.
+    If game is already present, game details will be updated
+    """
     if not seed_exists:
         database.cur.execute(
             "INSERT INTO seeds (seed, num_players, starting_player, variant_id)"
             "VALUES (%s, %s, %s, %s)"
             "ON CONFLICT (seed) DO NOTHING",
-            (seed, num_players, starting_player, var_id)
+            (game.seed, game.num_players, game.starting_player, game.var_id)
         )
-        logger.debug("New seed {} imported.".format(seed))
+        logger.debug("New seed {} imported.".format(game.seed))
 
-        games_db_interface.store_deck_for_seed(seed, deck)
+        games_db_interface.store_deck_for_seed(game.seed, game.deck)
 
     database.cur.execute(
         "INSERT INTO games ("
-        "id, num_players, starting_player, variant_id, timed, time_base, time_per_turn, speedrun, card_cycle, "
-        "deck_plays, empty_clues, one_extra_card, one_less_card,"
-        "all_or_nothing, detrimental_characters, seed, score"
+        "id, num_players, starting_player, variant_id, {}, seed, score"
         ")"
         "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        "ON CONFLICT (id) DO UPDATE SET ("
-        "timed, time_base, time_per_turn, speedrun, card_cycle, deck_plays, empty_clues, one_extra_card,"
-        "all_or_nothing, detrimental_characters"
-        ") = ("
-        "EXCLUDED.timed, EXCLUDED.time_base, EXCLUDED.time_per_turn, EXCLUDED.speedrun, EXCLUDED.card_cycle, "
-        "EXCLUDED.deck_plays, EXCLUDED.empty_clues, EXCLUDED.one_extra_card,"
-        "EXCLUDED.all_or_nothing, EXCLUDED.detrimental_characters"
-        ")",
-        (
-            game_id, num_players, starting_player, var_id, timed, time_base, time_per_turn, speedrun, card_cycle,
-            deck_plays, empty_clues, one_extra_card, one_less_card,
-            all_or_nothing, detrimental_characters, seed, score
-        )
+        "{}".format(", ".join(GAME_OPTION_COLUMNS), GAME_CONFLICT_CLAUSE),
+        (game.game_id, game.num_players, game.starting_player, game.var_id, *game.options, game.seed, game.score)
     )
 
     # Insert participants into database
-    ids = ensure_users_in_db_and_get_ids(players)
+    ids = ensure_users_in_db_and_get_ids(game.players)
     game_participant_values = []
     for index, user_id in enumerate(ids):
-        game_participant_values.append((game_id, user_id, index))
+        game_participant_values.append((game.game_id, user_id, index))
     psycopg2.extras.execute_values(
         database.cur,
         "INSERT INTO game_participants (game_id, user_id, seat) VALUES %s "
@@ -209,11 +282,243 @@ def detailed_export_game(
         game_participant_values
     )
 
-    games_db_interface.store_actions(game_id, actions)
+    # This commits the transaction
+    games_db_interface.store_actions(game.game_id, game.actions)
+    _promote_pending_user_ids()
+
+
+#
+def detailed_export_game(
+          game_id: int
+        , score: Optional[int] = None
+        , var_id: Optional[int] = None
+        , seed_exists: bool = False
+        , game_json: Optional[Dict] = None
+) -> None:
+    """
+    Downloads full details of game from hanab.live, inserts seed and game into DB
+    If seed is already present, it is left as is
+    If game is already present, game details will be updated
+
+    :param game_id: id of game to export
+    :param score: If given, this will be inserted as score of the game. If not given, score is calculated
+    :param var_id: If given, this will be inserted as variant id of the game. If not given, this is looked up
+    :param seed_exists: If specified and true, assumes that the seed is already present in database.
+        If this is not the case, call will raise a DB insertion error
+    :param game_json: If given, this is used as export of the game instead of downloading it
+
+    :raises GameExportError and its child classes
+    """
+
+    logger.debug("Importing game {}".format(game_id))
+
+    if game_json is None:
+        game_json = site_api.get("export/{}".format(game_id))
+    if game_json is None:
+        raise GameExportNoResponseFromSiteError(game_id)
+
+    store_exported_game(parse_game_export(game_id, game_json, score, var_id), seed_exists)
 
     logger.debug("Imported game {}".format(game_id))
 
 
+# Number of games collected by BulkGameImporter before they are written to the database
+BULK_IMPORT_BATCH_SIZE = 1000
+
+
+def _copy_value(value) -> str:
+    """
+    Formats a value for the text format of COPY
+    """
+    if value is None:
+        return "\\N"
+    if type(value) == bool:
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_rows(table: str, columns: List[str], rows: Iterable[Tuple]):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(value) for value in row) + "\n")
+    buffer.seek(0)
+    database.cur.copy_expert("COPY {} ({}) FROM STDIN".format(table, ", ".join(columns)), buffer)
+
+
+class BulkGameImporter:
+    """
+    Stores exported games in batches, which is much faster than store_exported_game for large numbers of games:
+    The games of a batch are copied into temporary staging tables with COPY and then merged into the actual tables
+    with one INSERT ... SELECT per table. Existing rows are handled as by store_exported_game.
+    Each batch is written in a single transaction, which is committed.
+    """
+    def __init__(self, batch_size: int = BULK_IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.games: Dict[int, ExportedGame] = {}
+        self.num_rows = 0
+
+    def add(self, game: ExportedGame):
+        self.games[game.game_id] = game
+        if len(self.games) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.games) == 0:
+            return
+        games = list(self.games.values())
+        self.games = {}
+        try:
+            self._write(games)
+        except Exception:
+            _rollback()
+            raise
+        _commit()
+        self.num_rows += sum(game.num_rows() for game in games)
+
+    @staticmethod
+    def _write(games: List[ExportedGame]):
+        # Staging tables are emptied on commit, they have to be created in each transaction in case of a rollback
+        database.cur.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS staging_seeds ("
+            "  seed TEXT, num_players SMALLINT, starting_player SMALLINT, variant_id SMALLINT"
+            ") ON COMMIT DELETE ROWS;"
+            "CREATE TEMPORARY TABLE IF NOT EXISTS staging_decks ("
+            "  seed TEXT, deck_index SMALLINT, suit_index SMALLINT, rank SMALLINT"
+            ") ON COMMIT DELETE ROWS;"
+            "CREATE TEMPORARY TABLE IF NOT EXISTS staging_games ("
+            "  id INT, num_players SMALLINT, starting_player SMALLINT, variant_id SMALLINT, "
+            "  timed BOOLEAN, time_base INTEGER, time_per_turn INTEGER, speedrun BOOLEAN, card_cycle BOOLEAN, "
+            "  deck_plays BOOLEAN, empty_clues BOOLEAN, one_extra_card BOOLEAN, one_less_card BOOLEAN, "
+            "  all_or_nothing BOOLEAN, detrimental_characters BOOLEAN, seed TEXT, score SMALLINT"
+            ") ON COMMIT DELETE ROWS;"
+            "CREATE TEMPORARY TABLE IF NOT EXISTS staging_game_participants ("
+            "  game_id INT, user_id INT, seat SMALLINT"
+            ") ON COMMIT DELETE ROWS;"
+            "CREATE TEMPORARY TABLE IF NOT EXISTS staging_game_actions ("
+            "  game_id INT, turn SMALLINT, type SMALLINT, target SMALLINT, value SMALLINT"
+            ") ON COMMIT DELETE ROWS;"
+        )
+
+        # Several games of a batch can share their seed
+        seeds = {game.seed: game for game in games}
+        _copy_rows(
+            'staging_seeds', ['seed', 'num_players', 'starting_player', 'variant_id'],
+            ((seed, game.num_players, game.starting_player, game.var_id) for seed, game in seeds.items())
+        )
+        _copy_rows(
+            'staging_decks', ['seed', 'deck_index', 'suit_index', 'rank'],
+            (
+                (seed, index, card.suitIndex, card.rank)
+                for seed, game in seeds.items() for (index, card) in enumerate(game.deck)
+            )
+        )
+        game_columns = ['id', 'num_players', 'starting_player', 'variant_id', *GAME_OPTION_COLUMNS, 'seed', 'score']
+        _copy_rows(
+            'staging_games', game_columns,
+            (
+                (game.game_id, game.num_players, game.starting_player, game.var_id, *game.options, game.seed, game.score)
+                for game in games
+            )
+        )
+        user_ids = iter(ensure_users_in_db_and_get_ids([player for game in games for player in game.players]))
+        _copy_rows(
+            'staging_game_participants', ['game_id', 'user_id', 'seat'],
+            [(game.game_id, next(user_ids), seat) for game in games for seat in range(game.num_players)]
+        )
+        _copy_rows(
+            'staging_game_actions', ['game_id', 'turn', 'type', 'target', 'value'],
+            (
+                (game.game_id, turn, action.type.value, action.target, action.value or 0)
+                for game in games for (turn, action) in enumerate(game.actions)
+            )
+        )
+
+        database.cur.execute(
+            "INSERT INTO seeds (seed, num_players, starting_player, variant_id) "
+            "SELECT seed, num_players, starting_player, variant_id FROM staging_seeds "
+            "ON CONFLICT (seed) DO NOTHING"
+        )
+        database.cur.execute(
+            "INSERT INTO decks (seed, deck_index, suit_index, rank) "
+            "SELECT seed, deck_index, suit_index, rank FROM staging_decks "
+            "ON CONFLICT (seed, deck_index) DO UPDATE SET "
+            "(suit_index, rank) = (excluded.suit_index, excluded.rank)"
+        )
+        database.cur.execute(
+            "INSERT INTO games ({0}) SELECT {0} FROM staging_games {1}".format(
+                ", ".join(game_columns), GAME_CONFLICT_CLAUSE
+            )
+        )
+        database.cur.execute(
+            "INSERT INTO game_participants (game_id, user_id, seat) "
+            "SELECT game_id, user_id, seat FROM staging_game_participants "
+            "ON CONFLICT (game_id, user_id) DO UPDATE SET seat = excluded.seat"
+        )
+        database.cur.execute(
+            "INSERT INTO game_actions (game_id, turn, type, target, value) "
+            "SELECT game_id, turn, type, target, value FROM staging_game_actions "
+            "ON CONFLICT (game_id, turn) DO NOTHING"
+        )
+
+
+def export_games_concurrently(
+        game_ids: List[int],
+        title: str,
+        concurrency: int = async_export.EXPORT_CONCURRENCY,
+        on_not_found: Optional[Callable[[int], None]] = None,
+        bulk: bool = False,
+        score: Optional[int] = None,
+        var_id: Optional[int] = None,
+        seed_exists: bool = False
+) -> int:
+    """
+    Exports the given games like detailed_export_game, where the downloads run concurrently
+    and the exports are written to the database by this thread as they arrive.
+    :param on_not_found: Called with the id of each game that does not exist on the site
+    :param bulk: Whether to write the games in batches with BulkGameImporter
+    :param score: If given, used as score of every game, see detailed_export_game
+    :param var_id: If given, used as variant id of every game, see detailed_export_game
+    :param seed_exists: Whether the seeds of all games are already present, ignored for bulk imports
+    :return: Number of games exported successfully
+    """
+    num_exported = 0
+    num_rows = 0
+    # Time spent on parsing and storing games, to compare the throughput of both ways of storing them
+    store_seconds = 0
+    importer = BulkGameImporter() if bulk else None
+    with alive_progress.alive_bar(total=len(game_ids), title=title) as bar:
+        def process(game_id: int, game_json: Optional[Dict]):
+            nonlocal num_exported, num_rows, store_seconds
+            start = time.perf_counter()
+            try:
+                if game_json is None:
+                    raise GameExportNoResponseFromSiteError(game_id)
+                game = parse_game_export(game_id, game_json, score, var_id)
+                if importer is not None:
+                    importer.add(game)
+                else:
+                    store_exported_game(game, seed_exists)
+                num_exported += 1
+                num_rows += game.num_rows()
+            except GameExportNoResponseFromSiteError as e:
+                logger.debug(e)
+            except GameExportError as e:
+                logger.warning("Failed to export game {}: {}".format(game_id, e))
+            store_seconds += time.perf_counter() - start
+            bar()
+
+        async_export.export_games(game_ids, process, concurrency, on_not_found=on_not_found)
+        if importer is not None:
+            start = time.perf_counter()
+            importer.flush()
+            store_seconds += time.perf_counter() - start
+    if store_seconds > 0:
+        logger.verbose("Stored {} rows of {} games in {:.1f}s ({:.0f} rows/s, {})".format(
+            num_rows, num_exported, store_seconds, num_rows / store_seconds, 'bulk' if bulk else 'per game'
+        ))
+    return num_exported
+
+
 def _process_game_row(game: Dict, var_id, export_all_games: bool = False):
     game_id = game.get('id', None)
     seed = game.get('seed', None)
@@ -254,6 +559,7 @@ def _process_game_row(game: Dict, var_id, export_all_games: bool = False):
     except psycopg2.errors.ForeignKeyViolation:
         # Sometimes, seed is not present in the database yet, then we will have to query the full game details
         # (including the seed) to export it accordingly
+        # The savepoint only covers the game row, so the pending user ids of this transaction stay valid
         database.cur.execute("ROLLBACK TO seed_insert")
         detailed_export_game(game_id, score=score, var_id=var_id)
 
@@ -273,91 +579,166 @@ def _process_game_row(game: Dict, var_id, export_all_games: bool = False):
     logger.debug("Imported game {}".format(game_id))
 
 
-def download_all_games_not_in_db(download_known_but_not_exported=True):
+# Number of game ids downloaded before the progress is committed, see download_all_games_not_in_db
+MISSING_GAME_IDS_CHUNK_SIZE = 10000
+
+
+def get_missing_game_id_ranges(download_known_but_not_exported: bool = True) -> List[Tuple[int, int]]:
+    """
+    Lists the ids up to the largest known game id that are neither in the database
+    nor known not to exist on the site, merged into ranges of consecutive ids.
+    :param download_known_but_not_exported: If true, games in the database without actions count as missing
+    :return: Inclusive ranges (first, last) of missing ids, in ascending order
+    """
     database.cur.execute(
-        "SELECT id FROM games "
-        + "WHERE actions is not null" if download_known_but_not_exported else ""
-        + "ORDER BY id"
+        "WITH missing AS ("
+        "  SELECT candidates.id FROM generate_series(1, (SELECT COALESCE(MAX(id), 0) FROM games)) AS candidates (id) "
+        "  WHERE NOT EXISTS ("
+        "    SELECT 1 FROM games WHERE games.id = candidates.id {}"
+        "  ) "
+        "  AND NOT EXISTS (SELECT 1 FROM missing_game_ids WHERE missing_game_ids.id = candidates.id)"
+        ") "
+        # Consecutive ids have the same difference to their row number, so this groups them into ranges
+        "SELECT MIN(id), MAX(id) FROM (SELECT id, id - ROW_NUMBER() OVER (ORDER BY id) AS island FROM missing) AS ids "
+        "GROUP BY island "
+        "ORDER BY MIN(id)".format(
+            "AND EXISTS (SELECT 1 FROM game_actions WHERE game_actions.game_id = games.id)"
+            if download_known_but_not_exported else ""
+        )
     )
-    game_ids = [game_id for (game_id,) in database.cur.fetchall()]
-    largest_game_id = game_ids[-1]
-    with alive_progress.alive_bar(
-            total=largest_game_id - len(game_ids),
-            title='Downloading all games not in database'
-    ) as bar:
-        for game_id in range(1, largest_game_id):
-            if game_id == game_ids[0]:
-                game_ids = game_ids[1:]
-                continue
-            try:
-                detailed_export_game(game_id)
-                logger.info("Found new game {} that was not in DB before".format(game_id))
-                bar()
-            except GameExportNoResponseFromSiteError:
-                bar()
-                continue
+    return database.cur.fetchall()
+
+
+def _chunk_ranges(ranges: List[Tuple[int, int]], chunk_size: int):
+    chunk = []
+    for (first, last) in ranges:
+        for game_id in range(first, last + 1):
+            chunk.append(game_id)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if len(chunk) != 0:
+        yield chunk
+
+
+def download_all_games_not_in_db(download_known_but_not_exported=True, bulk: bool = False):
+    """
+    Downloads all games with ids up to the largest known one that are not in the database yet.
+    Ids for which the site reports that there is no game are stored in missing_game_ids and not probed again.
+    :param bulk: Whether to write the games in batches with BulkGameImporter
+    """
+    ranges = get_missing_game_id_ranges(download_known_but_not_exported)
+    num_missing = sum(last - first + 1 for (first, last) in ranges)
+    logger.info("Found {} game ids not in database in {} ranges".format(num_missing, len(ranges)))
+
+    num_exported = 0
+    for chunk in _chunk_ranges(ranges, MISSING_GAME_IDS_CHUNK_SIZE):
+        nonexistent_ids = []
+        num_exported += export_games_concurrently(
+            chunk,
+            'Downloading games {} to {}'.format(chunk[0], chunk[-1]),
+            on_not_found=nonexistent_ids.append,
+            bulk=bulk
+        )
+        psycopg2.extras.execute_values(
+            database.cur,
+            "INSERT INTO missing_game_ids (id) VALUES %s ON CONFLICT (id) DO NOTHING",
+            [(game_id,) for game_id in nonexistent_ids]
+        )
+        # Commit after each chunk, so that an interrupted run does not probe the same ids again
+        _commit()
+    logger.info("Found {} new games that were not in DB before".format(num_exported))
 
 
 def download_games(var_id, export_all_games: bool = False):
-    name = variants.variant_name(var_id)
-    page_size = 100
-    if name is None:
-        raise ValueError("{} is not a known variant_id.".format(var_id))
-
-    url = "variants/{}".format(var_id)
-    r = site_api.api(url, refresh=True)
-    if not r:
-        raise RuntimeError("Failed to download request from hanab.live")
-
-    num_entries = r.get('total_rows', None)
-    if num_entries is None:
-        raise ValueError("Unknown response format on hanab.live")
+    download_variants([var_id], export_all_games)
 
-    database.cur.execute(
-        "SELECT COUNT(*) FROM games WHERE variant_id = %s AND id <= "
-        "(SELECT COALESCE (last_game_id, 0) FROM variant_game_downloads WHERE variant_id = %s)",
-        (var_id, var_id)
+
+def download_variants(var_ids: List[int], export_all_games: bool = False):
+    """
+    Downloads the games of the given variants that are not in the database yet.
+    The pages of the game listings are downloaded concurrently, also for several variants at once,
+    but the pages of each variant are written to the database in order and committed together with
+    the last game id written, so that variant_game_downloads stays correct if the download is interrupted.
+    """
+    page_size = site_api.API_PAGE_SIZE
+    names = {}
+    for var_id in var_ids:
+        name = variants.variant_name(var_id)
+        if name is None:
+            raise ValueError("{} is not a known variant_id.".format(var_id))
+        names[var_id] = name
+
+    # The first page of each variant tells us the total number of games
+    num_entries = {}
+
+    def process_first_page(var_id: int, index: int, r: Optional[Dict]):
+        if not r:
+            raise RuntimeError("Failed to download request from hanab.live")
+        num_entries[var_id] = r.get('total_rows', None)
+        if num_entries[var_id] is None:
+            raise ValueError("Unknown response format on hanab.live")
+
+    async_export.fetch_pages(
+        {var_id: [site_api.api_url("variants/{}".format(var_id))] for var_id in var_ids},
+        process_first_page, page_size
     )
-    num_already_downloaded_games = database.cur.fetchone()[0]
-    assert num_already_downloaded_games <= num_entries, "Database inconsistent, too many games present."
-    next_page = num_already_downloaded_games // page_size
-    last_page = (num_entries - 1) // page_size
 
-    if num_already_downloaded_games == num_entries:
-        logger.info("Already downloaded all games ({:6} many) for variant {:4} [{}]".format(num_entries, var_id, name))
+    page_urls = {}
+    # Number of rows to skip on the first page that is downloaded, since they are already in the database
+    num_skipped_rows = {}
+    num_remaining_games = 0
+    for var_id in var_ids:
+        database.cur.execute(
+            "SELECT COUNT(*) FROM games WHERE variant_id = %s AND id <= "
+            "(SELECT COALESCE (last_game_id, 0) FROM variant_game_downloads WHERE variant_id = %s)",
+            (var_id, var_id)
+        )
+        num_already_downloaded_games = database.cur.fetchone()[0]
+        assert num_already_downloaded_games <= num_entries[var_id], "Database inconsistent, too many games present."
+        if num_already_downloaded_games == num_entries[var_id]:
+            logger.info("Already downloaded all games ({:6} many) for variant {:4} [{}]".format(
+                num_entries[var_id], var_id, names[var_id])
+            )
+            continue
+        next_page = num_already_downloaded_games // page_size
+        last_page = (num_entries[var_id] - 1) // page_size
+        page_urls[var_id] = [
+            site_api.api_url("variants/{}?col[0]=0&page={}".format(var_id, page))
+            for page in range(next_page, last_page + 1)
+        ]
+        num_skipped_rows[var_id] = num_already_downloaded_games % page_size
+        num_remaining_games += num_entries[var_id] - num_already_downloaded_games
+
+    if len(page_urls) == 0:
         return
 
-    with alive_progress.alive_bar(
-            total=num_entries - num_already_downloaded_games,
-            title='Downloading remaining games for variant id {:4} [{}]'.format(var_id, name),
-            enrich_print=False
-    ) as bar:
-        for page in range(next_page, last_page + 1):
-            for refresh in [False, True]:
-                r = site_api.api(url + "?col[0]=0&page={}".format(page), refresh=(page == last_page) or refresh)
-                rows = r.get('rows', [])
-                if page == next_page:
-                    rows = rows[num_already_downloaded_games % 100:]
-                if not (page == last_page or len(rows) == page_size):
-                    if not refresh:
-                        # row count does not match, maybe this is due to an old cached version of the api query,
-                        # try again with a forced refresh of the query
-                        logger.verbose("refreshing page {} due to unexpected row count".format(page))
-                        continue
-                    # If refreshing did not fix the error, log a warning
-                    logger.warn('WARN: received unexpected row count ({}, expected {}) on page {}'.format(
-                        len(rows), page_size, page)
-                    )
-                for row in rows:
-                    _process_game_row(row, var_id, export_all_games)
-                    bar()
+    if len(var_ids) == 1:
+        title = 'Downloading remaining games for variant id {:4} [{}]'.format(var_ids[0], names[var_ids[0]])
+    else:
+        title = 'Downloading remaining games for {} variants'.format(len(page_urls))
+    with alive_progress.alive_bar(total=num_remaining_games, title=title, enrich_print=False) as bar:
+        def process_page(var_id: int, index: int, r: Optional[Dict]):
+            if not r:
+                raise RuntimeError("Failed to download request from hanab.live")
+            rows = r.get('rows', [])
+            if index != len(page_urls[var_id]) - 1 and len(rows) < page_size:
+                # Even a refresh did not give us a full page, so games of this variant might be missing
+                logger.warning("Received unexpected row count ({}, expected {}) for {}".format(
+                    len(rows), page_size, page_urls[var_id][index]
+                ))
+            if index == 0:
+                rows = rows[num_skipped_rows[var_id]:]
+            for row in rows:
+                _process_game_row(row, var_id, export_all_games)
+                bar()
+            if len(r.get('rows', [])) != 0:
                 database.cur.execute(
                     "INSERT INTO variant_game_downloads (variant_id, last_game_id) VALUES"
                     "(%s, %s)"
                     "ON CONFLICT (variant_id) DO UPDATE SET last_game_id = EXCLUDED.last_game_id",
                     (var_id, r['rows'][-1]['id'])
                 )
-                database.conn.commit()
-                # we need this so that we don't execute the iteration with forced refresh
-                # if stuff already checked out without refreshing
-                break
+            _commit()
+
+        async_export.fetch_pages(page_urls, process_page, page_size)
@@ -1,97 +1,154 @@
+import copy
 from dataclasses import dataclass
 from types import NoneType
-from typing import Optional, Tuple, List
-import pebble.concurrent
+from typing import Optional, Tuple, List, Dict, Callable
+import json
+import os
+import resource
+import pebble
 import concurrent.futures
+import collections
 
 import traceback
 import alive_progress
 import threading
 import time
 
+import numpy
 import psycopg2.extras
+import platformdirs
 
 import hanabi.hanab_game
 from hanabi import logger
+from hanabi import constants
 from hanabi.hanab_game import GameState
 from hanabi.solvers.sat import solve_sat
+from pysmt.shortcuts import get_model, Symbol
 from hanabi import database
 from hanabi.live import download_data
 from hanabi.live import compress
 from hanabi import hanab_game
 from hanabi.solvers import greedy_solver
 from hanabi.solvers import deck_analyzer
+from hanabi.solvers import batch_deck_analyzer
 from hanabi.live import variants
-from hanabi.database.games_db_interface import store_actions
+from hanabi.live import scheduling
+from hanabi.live import canonical_instances
+from hanabi.live import solve_metrics
+from hanabi.live import deck_corpus
+from hanabi.database import games_db_interface
+from hanabi.database import sharding
+from hanabi.database.games_db_interface import copy_actions
 
 MAX_PROCESSES = 3
 
+# Keeps the best lower bound of each seed, together with the game achieving it (if any)
+LOWER_BOUND_CONFLICT_CLAUSE = (
+    "ON CONFLICT (seed) DO UPDATE SET "
+    "score_lower_bound = GREATEST(score_lower_bounds.score_lower_bound, EXCLUDED.score_lower_bound), "
+    "game_id = CASE "
+    "  WHEN EXCLUDED.score_lower_bound > score_lower_bounds.score_lower_bound THEN EXCLUDED.game_id "
+    "  WHEN EXCLUDED.score_lower_bound = score_lower_bounds.score_lower_bound "
+    "    THEN COALESCE(score_lower_bounds.game_id, EXCLUDED.game_id) "
+    "  ELSE score_lower_bounds.game_id "
+    "END"
+)
 
-def update_trivially_feasible_games(variant_id):
+# Default time limit for solving a single seed, in seconds
+SOLVE_TIMEOUT_SECONDS = 150
+
+# Solving processes are replaced after this many seeds or once their memory exceeds the ceiling,
+# since memory used by z3 keeps growing over the lifetime of a process
+WORKER_MAX_TASKS = 200
+WORKER_MAX_MEMORY_MB = 2048
+# Exit code of workers that stop themselves because of their memory usage
+WORKER_RECYCLE_EXIT_CODE = 75
+
+# Number of greedy prefixes (including the pure greedy run) tried before running SAT on the whole game
+MAX_GREEDY_ATTEMPTS = 3
+# Cutoffs (number of cards remaining in the deck when stopping the greedy strategy) used if nothing was learned yet
+DEFAULT_GREEDY_CUTOFFS = [10, 20]
+# Cutoffs derived from the deck analysis are rounded up to multiples of this, so that statistics accumulate
+GREEDY_CUTOFF_GRANULARITY = 5
+
+
+# Condition on games (of max score) that they were played without rule variations making them easier
+CLEAN_GAME_CONDITION = \
+    "games.deck_plays IS FALSE " \
+    "AND games.one_extra_card IS FALSE " \
+    "AND games.one_less_card IS FALSE " \
+    "AND games.all_or_nothing IS FALSE " \
+    "AND games.detrimental_characters IS FALSE"
+
+
+def update_trivially_feasible_games(variant_id, num_threads: int = 8):
+    """
+    Marks all unsolved seeds of the variant as feasible that have a max-score game without rule variations.
+    Games where it is unknown which rules were used are exported from hanab.live first,
+    where the downloads run concurrently and only games of seeds without a known clean game are considered.
+    """
     variant: variants.Variant = variants.Variant.from_db(variant_id)
-    database.cur.execute("SELECT seed FROM seeds WHERE variant_id = (%s) AND feasible is null", (variant_id,))
-    seeds = database.cur.fetchall()
-    logger.verbose('Checking variant {} (id {}), found {} seeds to check...'.format(variant.name, variant_id, len(seeds)))
+    database.cur.execute(
+        "SELECT games.id FROM games "
+        "INNER JOIN seeds ON seeds.seed = games.seed "
+        "WHERE seeds.variant_id = (%s) "
+        "AND seeds.feasible IS NULL "
+        "AND games.score = (%s) "
+        "AND NOT (" + CLEAN_GAME_CONDITION.replace("IS FALSE", "IS NOT NULL") + ") "
+        "AND NOT EXISTS ("
+        "  SELECT FROM games AS clean_games "
+        "  WHERE clean_games.seed = games.seed AND clean_games.score = games.score "
+        "  AND " + CLEAN_GAME_CONDITION.replace("games.", "clean_games.") +
+        ") "
+        "ORDER BY games.id",
+        (variant_id, variant.max_score)
+    )
+    game_ids = [game_id for (game_id,) in database.cur.fetchall()]
+    logger.verbose('Checking variant {} (id {}), exporting {} games with unknown rules...'.format(
+        variant.name, variant_id, len(game_ids))
+    )
 
-    with alive_progress.alive_bar(total=len(seeds), title='{} ({})'.format(variant.name, variant_id)) as bar:
-        for (seed,) in seeds:
-            database.cur.execute(
-                "SELECT id, deck_plays, one_extra_card, one_less_card, all_or_nothing, detrimental_characters "
-                "FROM games WHERE score = (%s) AND seed = (%s) ORDER BY id;",
-                (variant.max_score, seed)
-            )
-            res = database.cur.fetchall()
-            logger.debug("Checking seed {}: {:3} results".format(seed, len(res)))
-            for (game_id, a, b, c, d, e) in res:
-                if None in [a, b, c, d, e]:
-                    logger.debug('  Game {} not found in database, exporting...'.format(game_id))
-                    download_data.detailed_export_game(
-                        game_id, var_id=variant_id, score=variant.max_score, seed_exists=True
-                    )
-                    database.cur.execute("SELECT deck_plays, one_extra_card, one_less_card, all_or_nothing, "
-                                         "detrimental_characters "
-                                         "FROM games WHERE id = (%s)",
-                                         (game_id,))
-                    (a, b, c, d, e) = database.cur.fetchone()
-                else:
-                    logger.debug('  Game {} already in database'.format(game_id))
-                valid = not any([a, b, c, d, e])
-                if valid:
-                    print(a, b, c, d, e)
-                    logger.verbose(
-                        'Seed {:10} (variant {}) found to be feasible via game {:6}'.format(seed, variant_id, game_id))
-                    database.cur.execute("UPDATE seeds SET (feasible, max_score_theoretical) = (%s, %s) WHERE seed = "
-                                         "(%s)", (True, variant.max_score, seed))
-                    database.cur.execute(
-                        "INSERT INTO score_lower_bounds (seed, score_lower_bound, game_id) VALUES (%s, %s, %s)",
-                        (seed, variant.max_score, game_id)
-                    )
-                    database.conn.commit()
-                    break
-                else:
-                    logger.verbose('  Cheaty game {} found'.format(game_id))
-            bar()
+    download_data.export_games_concurrently(
+        game_ids, '{} ({})'.format(variant.name, variant_id), num_threads,
+        var_id=variant_id, score=variant.max_score, seed_exists=True
+    )
+
+    database.cur.execute(
+        "WITH feasible_seeds AS ("
+        "  SELECT DISTINCT ON (games.seed) games.seed, games.id FROM games "
+        "  INNER JOIN seeds ON seeds.seed = games.seed "
+        "  WHERE seeds.variant_id = (%s) "
+        "  AND seeds.feasible IS NULL "
+        "  AND games.score = (%s) "
+        "  AND " + CLEAN_GAME_CONDITION +
+        "  ORDER BY games.seed, games.id"
+        "), updated_seeds AS ("
+        "  UPDATE seeds SET (feasible, max_score_theoretical) = (true, %s) "
+        "  FROM feasible_seeds WHERE seeds.seed = feasible_seeds.seed"
+        ") "
+        "INSERT INTO score_lower_bounds (seed, score_lower_bound, game_id) "
+        "SELECT seed, (%s), id FROM feasible_seeds " + LOWER_BOUND_CONFLICT_CLAUSE,
+        (variant_id, variant.max_score, variant.max_score, variant.max_score)
+    )
+    logger.info('Found {} seeds of variant {} (id {}) to be feasible via games.'.format(
+        database.cur.rowcount, variant.name, variant_id)
+    )
+    database.conn.commit()
 
 
 def get_decks_for_all_seeds():
-    cur = database.conn.database.cursor()
-    cur.execute("SELECT id "
-                "FROM games "
-                "  INNER JOIN seeds "
-                "  ON seeds.seed = games.seed"
-                "    WHERE"
-                "      seeds.deck is null"
-                "      AND"
-                "      games.id = ("
-                "         SELECT id FROM games WHERE games.seed = seeds.seed LIMIT 1"
-                "     )"
-                )
-    print("Exporting decks for all seeds")
-    res = cur.fetchall()
-    with alive_progress.alive_bar(len(res), title="Exporting decks") as bar:
-        for (game_id,) in res:
-            download_data.detailed_export_game(game_id)
-            bar()
+    """
+    Exports one game of each seed whose deck is not stored yet, which also stores its deck
+    """
+    database.cur.execute(
+        "SELECT MIN(id) "
+        "FROM games "
+        "WHERE NOT EXISTS (SELECT 1 FROM decks WHERE decks.seed = games.seed) "
+        "GROUP BY games.seed"
+    )
+    res = database.cur.fetchall()
+    logger.info("Exporting decks for {} seeds".format(len(res)))
+    download_data.export_games_concurrently([game_id for (game_id,) in res], "Exporting decks")
 
 
 @dataclass
@@ -101,14 +158,112 @@ class SolutionData:
     time_ms: int = 0
     feasible: Optional[bool] = None
     solution: Optional[GameState] = None
+    # Actions of the solution compressed with compress.compress_actions.
+    # Workers only send these back instead of the full solution, which is dropped before returning.
+    actions: Optional[str] = None
     num_remaining_cards: Optional[int] = None
     skipped: bool = False
+    # Cutoffs of greedy prefixes that were tried, in order
+    greedy_cutoffs: List[int] = None
+    num_sat_calls: int = 0
+    # Set if this result has been computed for the canonical instance with this key
+    canonical_key: Optional[str] = None
+    # Process that computed the result and its maximum memory usage, for monitoring
+    worker_pid: Optional[int] = None
+    worker_max_rss_kb: Optional[int] = None
 
     def __init__(self):
         self.infeasibility_reasons = []
+        self.greedy_cutoffs = []
 
 
-def solve_instance(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool = False)-> SolutionData:
+class GreedyCutoffStatistics:
+    """
+    Tracks for each number of players how often a greedy prefix with a given cutoff was tried before SAT
+    and how often this led to a solution. Persisted in the user data directory.
+    """
+    def __init__(self, counts: Optional[Dict[int, Dict[int, List[int]]]] = None):
+        # num_players -> cutoff -> [attempts, successes]
+        self.counts: Dict[int, Dict[int, List[int]]] = counts or {}
+        self.num_seeds = 0
+        self.num_sat_calls = 0
+
+    @staticmethod
+    def file() -> str:
+        return platformdirs.user_data_dir(constants.APP_NAME, ensure_exists=True) + '/greedy_cutoffs.json'
+
+    @staticmethod
+    def load():
+        try:
+            with open(GreedyCutoffStatistics.file(), "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return GreedyCutoffStatistics()
+        return GreedyCutoffStatistics({
+            int(num_players): {int(cutoff): counts for cutoff, counts in entries.items()}
+            for num_players, entries in data.items()
+        })
+
+    def store(self):
+        with open(self.file(), "w") as f:
+            json.dump(self.counts, f, indent=2)
+
+    def cutoffs(self, num_players: int) -> List[int]:
+        """
+        :return: Cutoffs that led to a solution at least once for this number of players
+        """
+        return [cutoff for cutoff, (attempts, successes) in self.counts.get(num_players, {}).items() if successes > 0]
+
+    def success_rate(self, num_players: int, cutoff: int, prior_successes: int = 1, prior_attempts: int = 2) -> float:
+        attempts, successes = self.counts.get(num_players, {}).get(cutoff, [0, 0])
+        return (successes + prior_successes) / (attempts + prior_attempts)
+
+    def record(self, num_players: int, result: SolutionData):
+        self.num_seeds += 1
+        self.num_sat_calls += result.num_sat_calls
+        entries = self.counts.setdefault(num_players, {})
+        for cutoff in result.greedy_cutoffs:
+            counts = entries.setdefault(cutoff, [0, 0])
+            counts[0] += 1
+            if result.feasible and result.num_remaining_cards == cutoff:
+                counts[1] += 1
+
+
+# Statistics used by the solving processes, only read once per process
+_greedy_cutoff_statistics: Optional[GreedyCutoffStatistics] = None
+
+
+def greedy_cutoff_schedule(
+        instance: hanab_game.HanabiInstance,
+        analysis: deck_analyzer.AnalysisResult,
+        statistics: GreedyCutoffStatistics
+) -> List[int]:
+    """
+    Selects the number of remaining cards at which we stop the greedy strategy and try to solve the rest with SAT.
+    We always start with a pure greedy run (cutoff 0), since this needs no SAT call at all.
+    Further candidates are the points where pace is lowest and where most critical cards have to be held,
+    since these are the places where greedy moves tend to go wrong, as well as all cutoffs that were successful
+    in the past. Candidates are ordered by their (smoothed) success rate for this number of players.
+    """
+    def round_up(num_cards):
+        return -(-num_cards // GREEDY_CUTOFF_GRANULARITY) * GREEDY_CUTOFF_GRANULARITY
+
+    # Prior successes and attempts for each candidate
+    priors = {cutoff: (1, 2) for cutoff in DEFAULT_GREEDY_CUTOFFS + statistics.cutoffs(instance.num_players)}
+    # Stop some cards before the critical point, so that SAT still has room to fix the greedy moves
+    for index in [analysis.min_pace.index, analysis.max_stored_crits.index]:
+        priors[round_up(instance.deck_size - index + GREEDY_CUTOFF_GRANULARITY)] = (2, 3)
+
+    candidates = [cutoff for cutoff in priors.keys() if 0 < cutoff < instance.draw_pile_size]
+    candidates.sort(key=lambda cutoff: (-statistics.success_rate(instance.num_players, cutoff, *priors[cutoff]), cutoff))
+    return [0] + candidates[:MAX_GREEDY_ATTEMPTS - 1]
+
+
+def solve_instance(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool = False, skip_pure_greedy: bool = False)-> SolutionData:
+    """
+    :param skip_pure_greedy: Whether the pure greedy run (cutoff 0) already failed on this instance,
+    which is the case for instances that passed the prefilter stage of solve_unknown_seeds
+    """
     retval = SolutionData()
     # first, sanity check on running out of pace
     result = deck_analyzer.analyze(instance, list_all_pace_cuts=list_all_pace_cuts)
@@ -117,10 +272,18 @@ def solve_instance(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool
         retval.feasible = False
         retval.infeasibility_reasons = result.infeasibility_reasons
         return retval
-    for num_remaining_cards in [0, 10, 20]:
+    global _greedy_cutoff_statistics
+    if _greedy_cutoff_statistics is None:
+        _greedy_cutoff_statistics = GreedyCutoffStatistics.load()
+    greedy_weights = greedy_solver.load_greedy_weights(instance)
+    cutoffs = greedy_cutoff_schedule(instance, result, _greedy_cutoff_statistics)
+    if skip_pure_greedy:
+        retval.greedy_cutoffs.append(cutoffs.pop(0))
+    for num_remaining_cards in cutoffs:
         #        logger.info("trying with {} remaining cards".format(num_remaining_cards))
+        retval.greedy_cutoffs.append(num_remaining_cards)
         game = hanab_game.GameState(instance)
-        strat = greedy_solver.GreedyStrategy(game)
+        strat = greedy_solver.GreedyStrategy(game, greedy_weights)
 
         # make a number of greedy moves
         while not game.is_over() and not game.is_known_lost():
@@ -136,9 +299,12 @@ def solve_instance(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool
             #            print("won with greedy strat")
             return retval
 
-        # now, apply sat solver
-        if not game.is_over():
+        # now, apply sat solver, unless we can already see that the greedy moves lost the game
+        if not game.is_over() and len(deck_analyzer.analyze_state(game).infeasibility_reasons) != 0:
+            logger.debug("Greedy moves lead to an infeasible state, skipping SAT")
+        elif not game.is_over():
             logger.debug("continuing greedy sol with SAT")
+            retval.num_sat_calls += 1
             solvable, solution = solve_sat(game)
             if solvable:
                 retval.feasible = True
@@ -152,6 +318,7 @@ def solve_instance(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool
     logger.debug("Starting full SAT solver")
 
     game = hanab_game.GameState(instance)
+    retval.num_sat_calls += 1
     retval.feasible, retval.solution = solve_sat(game)
     retval.num_remaining_cards = instance.draw_pile_size
     if not retval.feasible:
@@ -161,39 +328,77 @@ def solve_instance(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool
 
 
 
-def solve_seed(seed, num_players, deck, list_all_pace_cuts: bool = False, timeout: Optional[int] = 150) -> SolutionData:
-    try:
-        @pebble.concurrent.process(timeout=timeout)
-        def solve_seed_with_timeout(seed, num_players, deck) -> SolutionData:
-            try:
-                logger.verbose("Starting to solve seed {}".format(seed))
-
-                t0 = time.perf_counter()
-                retval = solve_instance(hanab_game.HanabiInstance(deck, num_players), list_all_pace_cuts=list_all_pace_cuts)
-                t1 = time.perf_counter()
-
-                retval.seed = seed
-                retval.time_ms = round((t1 - t0) * 1000)
-                logger.verbose("Solved instance {} in {} seconds: {}".format(seed, round(t1 - t0, 2), retval.feasible))
-                return retval
+def init_solve_worker(corpus_handle: Optional[Tuple[str, int, int]] = None):
+    # Set up the SAT backend once per worker, so that seeds do not pay for imports and solver creation
+    get_model(Symbol('warm_up'))
+    if corpus_handle is not None:
+        deck_corpus.attach_corpus(*corpus_handle)
 
-            except Exception as e:
-                print("exception in subprocess:")
-                traceback.print_exc()
 
-        f = solve_seed_with_timeout(seed, num_players, deck)
-        try:
-            return f.result()
-        except TimeoutError:
-            retval = SolutionData()
-            retval.seed = seed
-            retval.feasible = None
-            retval.time_ms = 1000 * timeout
-            logger.verbose("Solving on seed {} timed out".format(seed))
-            return retval
-    except Exception as e:
-        print("exception in subprocess:")
-        traceback.print_exc()
+def _solve_seed_instance(seed: str, instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool, skip_pure_greedy: bool = False) -> SolutionData:
+    # Workers whose memory usage grew beyond the ceiling exit before starting the seed, which is then rescheduled.
+    if resource.getrusage(resource.RUSAGE_SELF).ru_maxrss > 1024 * WORKER_MAX_MEMORY_MB:
+        os._exit(WORKER_RECYCLE_EXIT_CODE)
+
+    logger.verbose("Starting to solve seed {}".format(seed))
+    t0 = time.perf_counter()
+    retval = solve_instance(instance, list_all_pace_cuts=list_all_pace_cuts, skip_pure_greedy=skip_pure_greedy)
+    t1 = time.perf_counter()
+
+    retval.seed = seed
+    retval.time_ms = round((t1 - t0) * 1000)
+    retval.worker_pid = os.getpid()
+    retval.worker_max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if retval.solution is not None:
+        retval.actions = compress.compress_actions(retval.solution.actions)
+        retval.solution = None
+    logger.verbose("Solved instance {} in {} seconds: {}".format(seed, round(t1 - t0, 2), retval.feasible))
+    return retval
+
+
+def seed_instance(num_players: int, starting_player: int, suits: List[int], ranks: List[int]) -> hanab_game.HanabiInstance:
+    deck = [hanab_game.DeckCard(suit, rank) for (suit, rank) in zip(suits, ranks)]
+    return hanab_game.HanabiInstance(deck, num_players, starting_player=starting_player)
+
+
+def solve_seed(
+        seed: str, num_players: int, starting_player: int, suits: List[int], ranks: List[int],
+        list_all_pace_cuts: bool = False
+) -> SolutionData:
+    """
+    Solves the canonical instance of a single seed in a worker of the solving pool, timeouts are enforced by the pool.
+    """
+    instance = seed_instance(num_players, starting_player, suits, ranks)
+    return _solve_seed_instance(seed, canonical_instances.canonical_form(instance).instance, list_all_pace_cuts)
+
+
+def solve_corpus_seed(index: int, seed: str, list_all_pace_cuts: bool = False, skip_pure_greedy: bool = False) -> SolutionData:
+    """
+    Solves the canonical instance of a seed from the deck corpus attached to the worker,
+    so that only the index of the seed has to be sent to the worker.
+    """
+    instance = deck_corpus.attached_corpus().instance(index)
+    return _solve_seed_instance(
+        seed, canonical_instances.canonical_form(instance).instance, list_all_pace_cuts, skip_pure_greedy
+    )
+
+
+def greedy_corpus_seeds(indices: List[int]) -> List[Optional[str]]:
+    """
+    Plays the canonical instances of the given seeds of the attached deck corpus with the greedy strategy.
+    :return: Compressed actions of the game for each seed where the greedy strategy won, None for the others
+    """
+    corpus = deck_corpus.attached_corpus()
+    won = []
+    for index in indices:
+        instance = canonical_instances.canonical_form(corpus.instance(index)).instance
+        game = hanab_game.GameState(instance)
+        strat = greedy_solver.GreedyStrategy(game, greedy_solver.load_greedy_weights(instance))
+        while not game.is_over() and not game.is_known_lost():
+            strat.make_move()
+        won.append(compress.compress_actions(game.actions) if game.is_won() else None)
+    return won
+
 
 def replace_none_with_zero(x):
     if x is None:
@@ -202,77 +407,693 @@ def replace_none_with_zero(x):
         return x
 
 
-def process_solve_result(result: SolutionData):
-    if result is None:
-        return
-    if result.feasible is not None:
-        database.cur.execute("UPDATE seeds SET (feasible, solve_time_ms) = (%s, %s) WHERE seed = (%s)",
-                             (result.feasible, result.time_ms, result.seed))
+def get_solve_result(future: concurrent.futures.Future, seed: str, timeout: Optional[int]) -> Tuple[Optional[SolutionData], bool]:
+    """
+    Retrieves the result of solve_seed scheduled on the solving pool.
+    :return: The result (None in case of errors) and whether the seed has to be rescheduled,
+    which is the case if its worker exited since its memory grew too large.
+    """
+    try:
+        return future.result(), False
+    except TimeoutError:
+        result = SolutionData()
+        result.seed = seed
+        result.feasible = None
+        result.time_ms = 1000 * timeout
+        logger.verbose("Solving on seed {} timed out".format(seed))
+        return result, False
+    except pebble.ProcessExpired as e:
+        if e.exitcode == WORKER_RECYCLE_EXIT_CODE:
+            logger.debug("Worker recycled due to memory usage, rescheduling seed {}".format(seed))
+            return None, True
+        logger.error("Worker died while solving seed {}: {}".format(seed, e))
+    except Exception:
+        logger.error("Exception while solving seed {}:".format(seed))
+        traceback.print_exc()
+    return None, False
+
+
+def expand_canonical_result(
+        result: SolutionData,
+        group: List[Tuple[str, hanab_game.HanabiInstance, canonical_instances.CanonicalForm]]
+) -> List[SolutionData]:
+    """
+    Translates the result for a canonical instance to all seeds in the group sharing it.
+    The result for the first seed keeps the canonical key, so that it is stored as representative of the instance.
+    """
+    seed_results = []
+    for (index, (seed, instance, form)) in enumerate(group):
+        seed_result = copy.copy(result)
+        seed_result.seed = seed
+        if index != 0:
+            # Solver statistics are only recorded once per solved instance
+            seed_result.canonical_key = None
+            seed_result.greedy_cutoffs = []
+            seed_result.num_sat_calls = 0
         if result.feasible:
-            assert result.solution is not None
-            database.cur.execute("INSERT INTO certificate_games (seed, num_turns) "
-                                 "VALUES (%s, %s) "
-                                 "RETURNING ID ", (result.seed, len(result.solution.actions)))
-            game_id = database.cur.fetchone()[0]
-            store_actions(game_id, result.solution.actions, True)
-            logger.verbose("Success with {} cards left in draw by greedy solver on seed {}: {}\n".format(
-                result.num_remaining_cards, result.seed, compress.link(result.solution))
+            seed_result.actions = compress.compress_actions(
+                form.from_canonical(compress.decompress_actions(result.actions))
             )
-        else:
-            logger.debug("seed {} was not solvable".format(result.seed))
-            vals = [(result.seed, reason.type.value, replace_none_with_zero(reason.index), replace_none_with_zero(reason.value)) for reason in result.infeasibility_reasons]
-            psycopg2.extras.execute_values(
-                database.cur,
-                "INSERT INTO infeasibility_reasons (seed, reason, index, value) "
-                "VALUES %s "
-                "ON CONFLICT (seed, reason, index) DO NOTHING",
-                vals
+        elif result.feasible is False and (len(result.infeasibility_reasons) == 0 or form.instance.deck != instance.deck):
+            # Reasons refer to suits and positions, so we recompute them on the seed itself
+            seed_result.infeasibility_reasons = deck_analyzer.analyze(instance).infeasibility_reasons or [
+                deck_analyzer.InfeasibilityReason(deck_analyzer.InfeasibilityType.SAT)
+            ]
+        seed_results.append(seed_result)
+    return seed_results
+
+
+def corpus_members(
+        corpus: deck_corpus.DeckCorpus, seeds: List[str], group: List[int]
+) -> List[Tuple[str, hanab_game.HanabiInstance, canonical_instances.CanonicalForm]]:
+    members = []
+    for index in group:
+        instance = corpus.instance(index)
+        members.append((seeds[index], instance, canonical_instances.canonical_form(instance)))
+    return members
+
+
+def load_canonical_results(
+        groups: Dict[str, list],
+        members: Callable[[list], List[Tuple[str, hanab_game.HanabiInstance, canonical_instances.CanonicalForm]]]
+) -> List[Tuple[SolutionData, int]]:
+    """
+    Looks up the canonical instances of the groups that have been solved before, removes them from the groups
+    and returns results for their seeds, including certificates translated from the representative seed.
+    :param groups: The seeds sharing each canonical key, in any representation understood by members
+    :param members: Seed, instance and canonical form of each seed of a group
+    :return: Results together with the number of players of the seeds
+    """
+    database.cur.execute(
+        "SELECT key, canonical_instances.seed, canonical_instances.feasible, certificate_game_id, "
+        "num_players, starting_player "
+        "FROM canonical_instances "
+        "INNER JOIN seeds ON seeds.seed = canonical_instances.seed "
+        "WHERE key = ANY(%s)",
+        (list(groups.keys()),)
+    )
+    results = []
+    for (key, representative, feasible, game_id, num_players, starting_player) in database.cur.fetchall():
+        result = SolutionData()
+        result.feasible = feasible
+        if feasible:
+            if game_id is None:
+                # Certificate has been deleted, so we solve this instance again
+                continue
+            instance = hanab_game.HanabiInstance(
+                games_db_interface.load_deck(representative), num_players, starting_player=starting_player
             )
-            database.conn.commit()
-    elif result.skipped:
-        logger.verbose("seed {} skipped".format(result.seed))
-    else:
-        database.cur.execute("UPDATE seeds SET solve_time_ms = %s WHERE seed = (%s)", (result.time_ms, result.seed))
-    database.conn.commit()
+            form = canonical_instances.canonical_form(instance)
+            result.actions = compress.compress_actions(
+                form.to_canonical(games_db_interface.load_actions(game_id, True))
+            )
+        results += [
+            (seed_result, num_players)
+            for seed_result in expand_canonical_result(result, members(groups.pop(key)))
+        ]
+    return results
+
+
+class SolveResultBuffer:
+    """
+    Collects results of solved seeds and writes them to the database in batches,
+    with one transaction per flush. A flush happens once max_size results are buffered
+    or max_delay seconds have passed since the last one.
+    Make sure to flush at the end, also in case of interrupts.
+    If a worker name is given, the solve jobs of the stored seeds are removed in the same transaction,
+    regardless of the worker currently holding them.
+    """
+    def __init__(
+            self,
+            cutoff_statistics: GreedyCutoffStatistics,
+            max_size: int = 100,
+            max_delay: float = 10,
+            worker: Optional[str] = None
+    ):
+        self.cutoff_statistics = cutoff_statistics
+        self.worker = worker
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.results: List[SolutionData] = []
+        self.last_flush = time.perf_counter()
+
+    def add(self, result: SolutionData, num_players: int):
+        if result.feasible is not None:
+            self.cutoff_statistics.record(num_players, result)
+            if result.feasible:
+                logger.verbose("Success with {} cards left in draw by greedy solver on seed {} after {} SAT calls, actions: {}\n".format(
+                    result.num_remaining_cards, result.seed, result.num_sat_calls, result.actions)
+                )
+            else:
+                logger.debug("seed {} was not solvable".format(result.seed))
+        elif result.skipped:
+            logger.verbose("seed {} skipped".format(result.seed))
+            return
+        self.results.append(result)
+        if len(self.results) >= self.max_size or time.perf_counter() - self.last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.perf_counter()
+        if len(self.results) == 0:
+            return
+        results = self.results
+        psycopg2.extras.execute_values(
+            database.cur,
+            "UPDATE seeds SET (feasible, solve_time_ms) = (COALESCE(solved.feasible, seeds.feasible), solved.time_ms) "
+            "FROM (VALUES %s) AS solved (seed, feasible, time_ms) "
+            "WHERE seeds.seed = solved.seed",
+            [(result.seed, result.feasible, result.time_ms) for result in results],
+            template="(%s, %s::boolean, %s)",
+            page_size=1000
+        )
+        solved = [(result.seed, compress.decompress_actions(result.actions)) for result in results if result.feasible]
+        game_ids = psycopg2.extras.execute_values(
+            database.cur,
+            "INSERT INTO certificate_games (seed, num_turns) "
+            "VALUES %s "
+            "RETURNING id, seed",
+            [(seed, len(actions)) for (seed, actions) in solved],
+            page_size=1000,
+            fetch=True
+        )
+        game_id_by_seed = {seed: game_id for (game_id, seed) in game_ids}
+        copy_actions({game_id_by_seed[seed]: actions for (seed, actions) in solved}, True)
+        psycopg2.extras.execute_values(
+            database.cur,
+            "INSERT INTO canonical_instances (key, seed, feasible, certificate_game_id) "
+            "VALUES %s "
+            "ON CONFLICT (key) DO NOTHING",
+            [
+                (result.canonical_key, result.seed, result.feasible, game_id_by_seed.get(result.seed))
+                for result in results if result.canonical_key is not None and result.feasible is not None
+            ],
+            page_size=1000
+        )
+        psycopg2.extras.execute_values(
+            database.cur,
+            "INSERT INTO infeasibility_reasons (seed, reason, index, value) "
+            "VALUES %s "
+            "ON CONFLICT (seed, reason, index) DO NOTHING",
+            [
+                (result.seed, reason.type.value, replace_none_with_zero(reason.index), replace_none_with_zero(reason.value))
+                for result in results if result.feasible is False for reason in result.infeasibility_reasons
+            ],
+            page_size=1000
+        )
+        if self.worker is not None:
+            # Also if the lease expired and another worker holds the job now, since the seed is solved anyway
+            database.cur.execute(
+                "DELETE FROM solve_jobs WHERE seed = ANY(%s)",
+                ([result.seed for result in results],)
+            )
+        database.conn.commit()
+        logger.debug("Stored results of {} seeds".format(len(results)))
+        self.results = []
+
+
+# Number of instances per task of the greedy stage of solve_unknown_seeds
+PREFILTER_BATCH_SIZE = 200
+
+
+@dataclass
+class StageStatistics:
+    name: str
+    num_candidates: int = 0
+    num_resolved: int = 0
+    seconds: float = 0
+
+    def report(self):
+        logger.info("Stage {}: resolved {} of {} instances ({:.1%}) in {:.2f}s, {:.0f} instances/s".format(
+            self.name, self.num_resolved, self.num_candidates, self.num_resolved / max(self.num_candidates, 1),
+            self.seconds, self.num_candidates / max(self.seconds, 1e-9)
+        ))
+
+
+def analyze_representatives(
+        corpus: deck_corpus.DeckCorpus, representatives: Dict[str, int], list_all_pace_cuts: bool
+) -> Tuple[Dict[str, SolutionData], Dict[str, Tuple[int, int]]]:
+    """
+    Runs the deck analyzer on the canonical instances of the given seeds of the corpus at once,
+    vectorized over decks with equal settings by the batch analyzer.
+    :param representatives: Canonical key -> corpus index of a seed with this key
+    :return: Results for the instances proven infeasible,
+        and minimum pace and maximum number of stored critical cards of each instance (for scheduling)
+    """
+    batches: Dict[Tuple[int, int, int], List[Tuple[str, hanab_game.HanabiInstance]]] = {}
+    for key, index in representatives.items():
+        instance = canonical_instances.canonical_form(corpus.instance(index)).instance
+        batches.setdefault((instance.num_players, instance.num_suits, instance.deck_size), []).append((key, instance))
+
+    results = {}
+    features = {}
+    for ((num_players, num_suits, _), batch) in batches.items():
+        analysis = batch_deck_analyzer.analyze_batch(
+            batch_deck_analyzer.encode_decks(instance.deck for (_, instance) in batch),
+            num_players,
+            num_suits=num_suits,
+            hand_size=batch[0][1].hand_size,
+            list_all_pace_cuts=list_all_pace_cuts
+        )
+        for row in numpy.flatnonzero(analysis.infeasible):
+            result = SolutionData()
+            result.feasible = False
+            result.infeasibility_reasons = analysis.infeasibility_reasons(row)
+            results[batch[row][0]] = result
+        for (row, (key, _)) in enumerate(batch):
+            features[key] = (int(analysis.min_pace[row]), int(analysis.max_stored_crits[row]))
+    return results, features
 
 
-def solve_unknown_seeds(variant_id, seed_class: int = 0, num_players: Optional[int] = None, list_all_pace_cuts: bool = False, timeout: Optional[int] = 150, num_threads: int = 4):
+def order_candidates(
+        candidates: List[str],
+        groups: Dict[str, List[int]],
+        analysis_features: Dict[str, Tuple[int, int]],
+        corpus: deck_corpus.DeckCorpus,
+        seeds: List[str],
+        seed_stats: List[Tuple[int, int, Optional[int]]],
+        model: scheduling.DifficultyModel,
+        policy: str
+) -> List[str]:
+    """
+    Orders canonical instances by the scheduling policy, using the features of the first seed of each group.
+    Features are computed from the deck analysis of the corpus, so no decks have to be loaded again.
+    """
+    def priority(key: str):
+        index = groups[key][0]
+        (num, solve_time_ms, greedy_score) = seed_stats[index]
+        (min_pace, max_stored_crits) = analysis_features[key]
+        return model.priority(scheduling.seed_features(
+            seeds[index], num, corpus.instance(index), min_pace, max_stored_crits, solve_time_ms, greedy_score
+        ), policy)
+    return sorted(candidates, key=priority)
+
+
+def solve_unknown_seeds(variant_id, seed_class: int = 0, num_players: Optional[int] = None, list_all_pace_cuts: bool = False, timeout: Optional[int] = SOLVE_TIMEOUT_SECONDS, num_threads: int = 4, policy: str = scheduling.DEFAULT_POLICY, shard: sharding.Shard = sharding.ALL_SEEDS):
     variant_name = variants.variant_name(variant_id)
-    query = "SELECT seeds.seed, num_players, array_agg(suit_index order by deck_index asc), array_agg(rank order by deck_index asc) "\
+    query = "SELECT seeds.seed, num_players, starting_player, array_agg(suit_index order by deck_index asc), array_agg(rank order by deck_index asc), "\
+            "num, solve_time_ms, (SELECT score_lower_bound FROM score_lower_bounds WHERE score_lower_bounds.seed = seeds.seed) "\
             "FROM seeds "\
             "INNER JOIN decks ON seeds.seed = decks.seed "\
             "WHERE variant_id = (%s) "\
             "AND class = (%s) "\
             "AND feasible IS NULL "\
-            "AND solve_time_ms < (%s)"
+            "AND solve_time_ms < (%s) "\
+            "AND {} ".format(shard.sql_condition())
     if num_players is not None:
         query += "AND num_players = {} ".format(num_players)
     query += "GROUP BY seeds.seed ORDER BY num"
-    database.cur.execute(query,
-        (variant_id, seed_class, 1000 * timeout)
+    # Decks are streamed into a compact corpus in shared memory that the workers read from
+    seeds = []
+    # Number, time spent so far and greedy score of each seed, used by the scheduling policy
+    seed_stats = []
+
+    def read_decks(rows):
+        for (seed, seed_num_players, starting_player, suits, ranks, num, solve_time_ms, greedy_score) in rows:
+            seeds.append(seed)
+            seed_stats.append((num, solve_time_ms, greedy_score))
+            yield seed_num_players, starting_player, suits, ranks
+
+    with database.conn.cursor(name='solve_unknown_seeds') as seeds_cur:
+        seeds_cur.itersize = 10000
+        seeds_cur.execute(query, (variant_id, seed_class, 1000 * timeout))
+        corpus = deck_corpus.DeckCorpus.create(read_decks(seeds_cur))
+    try:
+        return _solve_corpus(
+            corpus, seeds, seed_stats, variant_id, seed_class, list_all_pace_cuts, timeout, num_threads, policy, shard
+        )
+    finally:
+        corpus.close()
+
+
+def _solve_corpus(
+        corpus: deck_corpus.DeckCorpus,
+        seeds: List[str],
+        seed_stats: List[Tuple[int, int, Optional[int]]],
+        variant_id: int,
+        seed_class: int,
+        list_all_pace_cuts: bool,
+        timeout: Optional[int],
+        num_threads: int,
+        policy: str,
+        shard: sharding.Shard
+) -> Tuple[int, int]:
+    variant_name = variants.variant_name(variant_id)
+    if shard != sharding.ALL_SEEDS:
+        variant_name += " (shard {})".format(shard)
+    # Seeds that are equal up to relabeling of suits and rotation of players are only solved once.
+    # The corpus is ordered by seed number, so the groups are in 'fifo' order.
+    groups: Dict[str, List[int]] = {}
+    for index in range(len(seeds)):
+        groups.setdefault(canonical_instances.canonical_form(corpus.instance(index)).key, []).append(index)
+
+    cutoff_statistics = GreedyCutoffStatistics.load()
+    result_buffer = SolveResultBuffer(cutoff_statistics)
+    metrics = solve_metrics.SolveMetrics('Seed solving on {}'.format(variant_name), num_threads)
+    metrics.set_total(len(seeds))
+    reused_results = load_canonical_results(groups, lambda group: corpus_members(corpus, seeds, group))
+    logger.verbose("Solving {} distinct instances, reusing results for {} seeds".format(len(groups), len(reused_results)))
+    for (result, seed_num_players) in reused_results:
+        result_buffer.add(result, seed_num_players)
+    metrics.record_reused(len(reused_results))
+    # Workers are long-lived, so that imports and the SAT backend are only set up once per worker
+    pool = pebble.ProcessPool(
+        max_workers=num_threads, max_tasks=WORKER_MAX_TASKS, initializer=init_solve_worker, initargs=(corpus.handle(),)
     )
-    res = database.cur.fetchall()
-    data = []
-    for (seed, num_players, suits, ranks) in res:
-        assert len(suits) == len(ranks)
-        deck = []
-        for (suit, rank) in zip(suits, ranks):
-            deck.append(hanabi.hanab_game.DeckCard(suit, rank))
-        data.append((seed, num_players, deck))
-
-    """
-    with alive_progress.alive_bar(len(res), title='Seed solving on {}'.format(variant_name)) as bar:
-        for d in data:
-            solve_seed(d[0], d[1], d[2], timeout)
-            bar()
-    return
-    """
-
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=num_threads) as executor:
-        fs = [executor.submit(solve_seed, d[0], d[1], d[2], list_all_pace_cuts, timeout) for d in data]
-        with alive_progress.alive_bar(len(res), title='Seed solving on {}'.format(variant_name)) as bar:
-            for f in concurrent.futures.as_completed(fs):
-                result = f.result()
-                process_solve_result(result)
-                bar()
\ No newline at end of file
+    try:
+        with alive_progress.alive_bar(len(seeds) - len(reused_results), title='Seed solving on {}'.format(variant_name)) as bar:
+            def resolve(key: str, result: SolutionData):
+                group = groups[key]
+                result.canonical_key = key
+                for seed_result in expand_canonical_result(result, corpus_members(corpus, seeds, group)):
+                    result_buffer.add(seed_result, int(corpus.num_players[group[0]]))
+                bar(len(group))
+
+            # Stage 1: Deck analysis of all instances at once, in this process
+            analysis_stage = StageStatistics('analysis', len(groups))
+            t0 = time.perf_counter()
+            infeasible, analysis_features = analyze_representatives(
+                corpus, {key: group[0] for (key, group) in groups.items()}, list_all_pace_cuts
+            )
+            for key, result in infeasible.items():
+                resolve(key, result)
+                metrics.record_prefiltered(len(groups[key]))
+            analysis_stage.num_resolved = len(infeasible)
+            analysis_stage.seconds = time.perf_counter() - t0
+            analysis_stage.report()
+
+            # Stage 2: Pure greedy runs, in batches on the pool
+            candidates = [key for key in groups.keys() if key not in infeasible]
+            if policy != 'fifo':
+                candidates = order_candidates(
+                    candidates, groups, analysis_features, corpus, seeds, seed_stats,
+                    scheduling.load_model(variant_id, seed_class, 1000 * timeout), policy
+                )
+            greedy_stage = StageStatistics('greedy', len(candidates))
+            t0 = time.perf_counter()
+            greedy_futures = {}
+            for start in range(0, len(candidates), PREFILTER_BATCH_SIZE):
+                batch = candidates[start:start + PREFILTER_BATCH_SIZE]
+                greedy_futures[pool.schedule(greedy_corpus_seeds, args=([groups[key][0] for key in batch],))] = batch
+            unresolved = set()
+            # Instances of crashed batches, which did not get their pure greedy attempt yet
+            greedy_failed = set()
+            for future in concurrent.futures.as_completed(greedy_futures):
+                batch = greedy_futures[future]
+                try:
+                    won = future.result()
+                except Exception as e:
+                    # These instances are left to the SAT stage, which then also tries the pure greedy strategy
+                    logger.error("Greedy stage failed on a batch of {} instances: {}".format(len(batch), e))
+                    greedy_failed.update(batch)
+                    won = [None] * len(batch)
+                for key, actions in zip(batch, won):
+                    if actions is None:
+                        unresolved.add(key)
+                        continue
+                    result = SolutionData()
+                    result.feasible = True
+                    result.actions = actions
+                    result.num_remaining_cards = 0
+                    result.greedy_cutoffs = [0]
+                    resolve(key, result)
+                    metrics.record_prefiltered(len(groups[key]))
+                    greedy_stage.num_resolved += 1
+                metrics.maybe_write()
+            greedy_stage.seconds = time.perf_counter() - t0
+            greedy_stage.report()
+
+            # Stage 3: SAT solving of the remaining instances, one task each
+            sat_stage = StageStatistics('sat', len(unresolved))
+            t0 = time.perf_counter()
+            pending = {}
+
+            def schedule(key):
+                index = groups[key][0]
+                future = pool.schedule(
+                    solve_corpus_seed, args=(index, seeds[index], list_all_pace_cuts, key not in greedy_failed),
+                    timeout=timeout
+                )
+                pending[future] = key
+
+            # Keep the order of the groups, since this is the order given by the scheduling policy
+            for key in candidates:
+                if key in unresolved:
+                    schedule(key)
+
+            while len(pending) > 0:
+                # Wake up regularly even if no seed finishes, so that metrics also show stalls
+                done, _ = concurrent.futures.wait(
+                    pending, timeout=solve_metrics.WRITE_INTERVAL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    key = pending.pop(future)
+                    group = groups[key]
+                    result, reschedule = get_solve_result(future, seeds[group[0]], timeout)
+                    if reschedule:
+                        metrics.record_recycle()
+                        schedule(key)
+                        continue
+                    if result is not None:
+                        metrics.record_result(result, len(group))
+                        if result.feasible is not None:
+                            sat_stage.num_resolved += 1
+                        resolve(key, result)
+                    else:
+                        metrics.record_error()
+                        bar(len(group))
+                metrics.set_queue_depth(len(pending))
+                metrics.maybe_write()
+            sat_stage.seconds = time.perf_counter() - t0
+            sat_stage.report()
+    finally:
+        # By now, only tasks that we do not wait for anymore are left, in case of interrupts
+        pool.stop()
+        pool.join()
+        result_buffer.flush()
+        metrics.finish()
+        cutoff_statistics.store()
+        if cutoff_statistics.num_seeds > 0:
+            logger.info("Used {:.2f} SAT calls per solved seed on average.".format(
+                cutoff_statistics.num_sat_calls / cutoff_statistics.num_seeds
+            ))
+    return len(seeds), cutoff_statistics.num_seeds
+
+
+# Timeouts of the tiers of solve_tiered grow by this factor
+DEFAULT_TIER_FACTOR = 4
+
+
+def solve_tiered(
+        variant_id,
+        seed_class: int = 0,
+        num_players: Optional[int] = None,
+        list_all_pace_cuts: bool = False,
+        base_timeout: int = 10,
+        num_tiers: int = 4,
+        tier_factor: int = DEFAULT_TIER_FACTOR,
+        num_threads: int = 4,
+        policy: str = scheduling.DEFAULT_POLICY,
+        shard: sharding.Shard = sharding.ALL_SEEDS
+):
+    """
+    Solves seeds in tiers of geometrically growing timeouts: The first tier tries all unsolved seeds with a short
+    timeout, each further tier only retries the seeds that timed out before.
+    Finished tiers are recorded in solve_tiers, so an interrupted run continues with the tier it stopped in.
+    Within a tier, seeds that have been tried with its timeout already are skipped anyway.
+    Tiers are recorded per shard, so that each host of a sharded run keeps its own progress.
+    """
+    for tier in range(num_tiers):
+        timeout = base_timeout * tier_factor ** tier
+        database.cur.execute(
+            "SELECT num_seeds, num_solved FROM solve_tiers "
+            "WHERE variant_id = (%s) AND class = (%s) AND num_players = (%s) AND timeout = (%s) "
+            "AND shard = (%s) AND num_shards = (%s)",
+            (variant_id, seed_class, num_players or 0, timeout, shard.index, shard.count)
+        )
+        finished = database.cur.fetchone()
+        if finished is not None:
+            logger.verbose("Tier {} (timeout {}s) already finished: solved {} of {} seeds".format(
+                tier, timeout, finished[1], finished[0])
+            )
+            continue
+        logger.info("Starting tier {} with timeout {}s".format(tier, timeout))
+        num_seeds, num_solved = solve_unknown_seeds(
+            variant_id, seed_class, num_players, list_all_pace_cuts, timeout, num_threads, policy, shard
+        )
+        database.cur.execute(
+            "INSERT INTO solve_tiers (variant_id, class, num_players, timeout, shard, num_shards, num_seeds, num_solved) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON CONFLICT (variant_id, class, num_players, timeout, shard, num_shards) DO UPDATE "
+            "SET (num_seeds, num_solved) = (EXCLUDED.num_seeds, EXCLUDED.num_solved)",
+            (variant_id, seed_class, num_players or 0, timeout, shard.index, shard.count, num_seeds, num_solved)
+        )
+        database.conn.commit()
+        logger.info("Tier {} (timeout {}s) solved {} of {} seeds".format(tier, timeout, num_solved, num_seeds))
+
+# Number of seeds bounded per task of the process pool and stored in a single transaction
+SCORE_BOUNDS_BATCH_SIZE = 500
+
+
+@dataclass
+class ScoreBounds:
+    seed: str
+    max_score: int
+    upper_bound: int
+    lower_bound: int
+    # Compressed actions of the greedy game achieving the lower bound
+    actions: str
+    infeasibility_reasons: List[deck_analyzer.InfeasibilityReason]
+
+
+def bound_scores(seeds: List[Tuple[str, int, int, List[int], List[int]]]) -> List[ScoreBounds]:
+    """
+    Bounds the maximum score of each seed from above by the relaxation of the deck analyzer
+    and from below by a game of the greedy strategy.
+    :param seeds: Seed, number of players, starting player, suits and ranks of the deck of each seed
+    """
+    results = []
+    for (seed, num_players, starting_player, suits, ranks) in seeds:
+        deck = [hanab_game.DeckCard(suit, rank) for (suit, rank) in zip(suits, ranks)]
+        instance = hanab_game.HanabiInstance(deck, num_players, starting_player=starting_player)
+        upper_bound = deck_analyzer.score_upper_bound(instance)
+        reasons = []
+        if upper_bound < instance.max_score:
+            reasons = deck_analyzer.analyze(instance).infeasibility_reasons
+
+        game = hanab_game.GameState(instance)
+        strat = greedy_solver.GreedyStrategy(game, greedy_solver.load_greedy_weights(instance))
+        while not game.is_over():
+            strat.make_move()
+        results.append(ScoreBounds(
+            seed, instance.max_score, upper_bound, game.score, compress.compress_actions(game.actions), reasons
+        ))
+    return results
+
+
+def process_score_bounds(results: List[ScoreBounds]) -> int:
+    """
+    Stores the bounds of a batch of seeds in a single transaction.
+    Seeds whose bounds agree are closed by storing their maximum score.
+    :return: Number of seeds closed
+    """
+    psycopg2.extras.execute_values(
+        database.cur,
+        "INSERT INTO score_upper_bounds (seed, score_upper_bound) "
+        "VALUES %s "
+        "ON CONFLICT (seed) DO UPDATE "
+        "SET score_upper_bound = LEAST(score_upper_bounds.score_upper_bound, EXCLUDED.score_upper_bound)",
+        [(result.seed, result.upper_bound) for result in results]
+    )
+    psycopg2.extras.execute_values(
+        database.cur,
+        "INSERT INTO score_lower_bounds (seed, score_lower_bound) VALUES %s " + LOWER_BOUND_CONFLICT_CLAUSE,
+        [(result.seed, result.lower_bound) for result in results]
+    )
+    psycopg2.extras.execute_values(
+        database.cur,
+        "INSERT INTO infeasibility_reasons (seed, reason, index, value) "
+        "VALUES %s "
+        "ON CONFLICT (seed, reason, index) DO NOTHING",
+        [
+            (result.seed, reason.type.value, replace_none_with_zero(reason.index), replace_none_with_zero(reason.value))
+            for result in results for reason in result.infeasibility_reasons
+        ]
+    )
+    psycopg2.extras.execute_values(
+        database.cur,
+        "UPDATE seeds SET feasible = false "
+        "FROM (VALUES %s) AS infeasible (seed) "
+        "WHERE seeds.seed = infeasible.seed",
+        [(result.seed,) for result in results if result.upper_bound < result.max_score]
+    )
+    closed = [result for result in results if result.lower_bound == result.upper_bound]
+    psycopg2.extras.execute_values(
+        database.cur,
+        "UPDATE seeds SET max_score_theoretical = closed.score "
+        "FROM (VALUES %s) AS closed (seed, score) "
+        "WHERE seeds.seed = closed.seed",
+        [(result.seed, result.upper_bound) for result in closed]
+    )
+    won = [
+        (result.seed, compress.decompress_actions(result.actions))
+        for result in closed if result.lower_bound == result.max_score
+    ]
+    psycopg2.extras.execute_values(
+        database.cur,
+        "UPDATE seeds SET feasible = true "
+        "FROM (VALUES %s) AS won (seed) "
+        "WHERE seeds.seed = won.seed",
+        [(seed,) for (seed, _) in won]
+    )
+    game_ids = psycopg2.extras.execute_values(
+        database.cur,
+        "INSERT INTO certificate_games (seed, num_turns) "
+        "VALUES %s "
+        "RETURNING id, seed",
+        [(seed, len(actions)) for (seed, actions) in won],
+        page_size=1000,
+        fetch=True
+    )
+    game_id_by_seed = {seed: game_id for (game_id, seed) in game_ids}
+    copy_actions({game_id_by_seed[seed]: actions for (seed, actions) in won}, True)
+    database.conn.commit()
+    return len(closed)
+
+
+def bound_unknown_seeds(variant_id, seed_class: int = 0, num_players: Optional[int] = None, num_threads: int = 4, shard: sharding.Shard = sharding.ALL_SEEDS):
+    """
+    Computes upper and lower bounds on the maximum score of all seeds of the variant whose maximum score is not known.
+    Seeds where both bounds agree do not need to be solved anymore.
+    """
+    variant_name = variants.variant_name(variant_id)
+    condition = "WHERE variant_id = (%s) "\
+                "AND class = (%s) "\
+                "AND feasible IS NOT TRUE "\
+                "AND max_score_theoretical IS NULL "\
+                "AND {} ".format(shard.sql_condition())
+    if num_players is not None:
+        condition += "AND num_players = {} ".format(num_players)
+    database.cur.execute(
+        "SELECT COUNT(*) FROM seeds " + condition +
+        "AND EXISTS (SELECT 1 FROM decks WHERE decks.seed = seeds.seed)",
+        (variant_id, seed_class)
+    )
+    (num_seeds,) = database.cur.fetchone()
+
+    num_bounded = 0
+    num_closed = 0
+    # We commit after each batch, so the server-side cursor has to survive commits
+    with database.conn.cursor(name='score_bounds_seeds', withhold=True) as seeds_cur, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=num_threads) as executor, \
+            alive_progress.alive_bar(num_seeds, title='Score bounds on {}'.format(variant_name)) as bar:
+        seeds_cur.itersize = SCORE_BOUNDS_BATCH_SIZE
+        seeds_cur.execute(
+            "SELECT seeds.seed, num_players, starting_player, "
+            "array_agg(suit_index order by deck_index asc), array_agg(rank order by deck_index asc) "
+            "FROM seeds "
+            "INNER JOIN decks ON seeds.seed = decks.seed " + condition +
+            "GROUP BY seeds.seed ORDER BY num",
+            (variant_id, seed_class)
+        )
+
+        # Batches in flight, in the order they have been read, so that only a bounded number of decks is in memory
+        pending = collections.deque()
+
+        def store_oldest_batch():
+            nonlocal num_bounded, num_closed
+            results = pending.popleft().result()
+            num_closed += process_score_bounds(results)
+            num_bounded += len(results)
+            bar(len(results))
+
+        while True:
+            seeds = seeds_cur.fetchmany(SCORE_BOUNDS_BATCH_SIZE)
+            if len(seeds) == 0:
+                break
+            pending.append(executor.submit(bound_scores, seeds))
+            if len(pending) >= 2 * num_threads:
+                store_oldest_batch()
+        while len(pending) > 0:
+            store_oldest_batch()
+    logger.info("Closed {} of {} seeds by score bounds.".format(num_closed, num_bounded))
@@ -0,0 +1,258 @@
+import dataclasses
+import heapq
+import statistics
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Tuple
+
+from hanabi import logger
+from hanabi import database
+from hanabi import hanab_game
+from hanabi.solvers import batch_deck_analyzer
+
+# Policies to order seeds for solving:
+# - 'fifo': in order of their number, as before
+# - 'sjf': shortest expected solve time first
+# - 'rate': highest probability of resolving the seed per expected second of solving first
+POLICIES = ['fifo', 'sjf', 'rate']
+DEFAULT_POLICY = 'fifo'
+
+# Minimum number of historical seeds with equal features for their statistics to be used instead of coarser ones
+MIN_BUCKET_SIZE = 10
+# Number of decks read from the database and analyzed at once when loading features
+FEATURES_BATCH_SIZE = 10000
+
+
+@dataclass
+class SeedFeatures:
+    """
+    Cheap features of a seed that we use to estimate how hard it is to solve
+    """
+    seed: str
+    num: int
+    num_players: int
+    min_pace: int
+    max_stored_crits: int
+    # Time already spent on the seed without success (or time needed to solve it, for historical data)
+    solve_time_ms: int
+    # Whether the greedy strategy won the seed, None if unknown
+    greedy_won: Optional[bool]
+
+    def keys(self) -> List[Tuple]:
+        """
+        Keys of the buckets this seed falls into, from finest to coarsest
+        """
+        return [
+            (self.num_players, min(self.min_pace, 10), self.max_stored_crits, self.greedy_won),
+            (self.num_players, min(self.min_pace, 10)),
+            (self.num_players,),
+            ()
+        ]
+
+
+def seed_features(
+        seed: str, num: int, instance: hanab_game.HanabiInstance, min_pace: int, max_stored_crits: int,
+        solve_time_ms: int, greedy_score: Optional[int]
+) -> SeedFeatures:
+    """
+    :param min_pace: Minimum pace of the instance, as computed by batch_deck_analyzer.analyze_batch
+    :param max_stored_crits: Maximum number of stored critical cards, as computed by batch_deck_analyzer.analyze_batch
+    """
+    return SeedFeatures(
+        seed, num, instance.num_players, min_pace, max_stored_crits, solve_time_ms,
+        None if greedy_score is None else greedy_score == instance.max_score
+    )
+
+
+def analyze_instances(instances: List[hanab_game.HanabiInstance]) -> List[Tuple[int, int]]:
+    """
+    Runs the batch deck analyzer on groups of instances with equal settings.
+    :return: Minimum pace and maximum number of stored critical cards of each instance
+    """
+    batches: Dict[Tuple[int, int, int, int], List[int]] = {}
+    for (i, instance) in enumerate(instances):
+        batches.setdefault(
+            (instance.num_players, instance.num_suits, instance.deck_size, instance.hand_size), []
+        ).append(i)
+    results = [(0, 0)] * len(instances)
+    for ((num_players, num_suits, _, hand_size), rows) in batches.items():
+        analysis = batch_deck_analyzer.analyze_batch(
+            batch_deck_analyzer.encode_decks(instances[i].deck for i in rows),
+            num_players,
+            num_suits=num_suits,
+            hand_size=hand_size
+        )
+        for (row, i) in enumerate(rows):
+            results[i] = (int(analysis.min_pace[row]), int(analysis.max_stored_crits[row]))
+    return results
+
+
+class DifficultyModel:
+    """
+    Estimates the expected solve time and the probability of solving a seed within the timeout
+    from historical seeds with similar features.
+    Seeds are grouped into buckets by their features, if a bucket has too few seeds, a coarser one is used.
+    """
+    def __init__(self, timeout_ms: int):
+        self.timeout_ms = timeout_ms
+        # bucket key -> list of (solve time, solved)
+        self.buckets: Dict[Tuple, List[Tuple[int, bool]]] = {}
+
+    def fit(self, history: List[Tuple[SeedFeatures, bool]]):
+        """
+        :param history: Features of seeds that have been attempted before, together with whether they were solved.
+        Unsolved seeds count as taking the full timeout.
+        """
+        self.buckets = {}
+        for features, solved in history:
+            time_ms = min(features.solve_time_ms, self.timeout_ms)
+            solved = solved and features.solve_time_ms <= self.timeout_ms
+            for key in features.keys():
+                self.buckets.setdefault(key, []).append((time_ms, solved))
+
+    def _bucket(self, features: SeedFeatures) -> List[Tuple[int, bool]]:
+        for key in features.keys():
+            bucket = self.buckets.get(key, [])
+            if len(bucket) >= MIN_BUCKET_SIZE or key == ():
+                return bucket
+        return []
+
+    def estimate(self, features: SeedFeatures) -> Tuple[float, float]:
+        """
+        :return: Expected time (in ms) spent on the seed and probability of solving it within the timeout.
+        Time already spent on the seed is taken into account by only considering seeds that took longer.
+        """
+        bucket = [(t, s) for (t, s) in self._bucket(features) if t >= features.solve_time_ms]
+        if len(bucket) == 0:
+            # No seed took this long so far, so we assume the seed needs the full timeout and will not be solved
+            return self.timeout_ms, 0
+        expected_time = statistics.fmean(t for (t, _) in bucket) - features.solve_time_ms
+        success_rate = sum(1 for (_, s) in bucket if s) / len(bucket)
+        return max(expected_time, 1), success_rate
+
+    def priority(self, features: SeedFeatures, policy: str) -> Tuple:
+        """
+        Sort key of the seed under the policy, smaller keys are solved first
+        """
+        match policy:
+            case 'fifo':
+                return (features.num,)
+            case 'sjf':
+                expected_time, _ = self.estimate(features)
+                return expected_time, features.num
+            case 'rate':
+                expected_time, success_rate = self.estimate(features)
+                return -success_rate / expected_time, features.num
+            case _:
+                raise ValueError("Unknown scheduling policy {}".format(policy))
+
+    def order(self, seeds: List[SeedFeatures], policy: str) -> List[SeedFeatures]:
+        return sorted(seeds, key=lambda features: self.priority(features, policy))
+
+
+def simulate(jobs: List[Tuple[SeedFeatures, int, bool]], num_workers: int, timeout_ms: int, duration_ms: int) -> int:
+    """
+    Simulates solving the jobs in the given order on num_workers workers.
+    :param jobs: Features, actual solve time and whether the seed can be solved, for each seed
+    :return: Number of seeds solved within the given duration
+    """
+    # Times at which the workers become idle
+    workers = [0] * num_workers
+    num_solved = 0
+    for (_, time_ms, solvable) in jobs:
+        start = heapq.heappop(workers)
+        if start >= duration_ms:
+            break
+        if solvable and time_ms <= timeout_ms:
+            end = start + time_ms
+            if end <= duration_ms:
+                num_solved += 1
+        else:
+            end = start + timeout_ms
+        heapq.heappush(workers, end)
+    return num_solved
+
+
+def compare_policies(
+        history: List[Tuple[SeedFeatures, bool]], num_workers: int, timeout_ms: int, duration_ms: int
+) -> Dict[str, int]:
+    """
+    Compares the policies on historical data: The model is fitted on every other seed,
+    then the remaining seeds are solved in simulation (with their historical solve times) in the order of each policy.
+    :return: Number of seeds solved by each policy
+    """
+    training = history[0::2]
+    evaluation = history[1::2]
+    model = DifficultyModel(timeout_ms)
+    model.fit(training)
+    jobs = {features.seed: (features, features.solve_time_ms, solved) for (features, solved) in evaluation}
+    # The simulated seeds have not been attempted yet
+    fresh = [dataclasses.replace(features, solve_time_ms=0) for (features, _) in evaluation]
+    results = {}
+    for policy in POLICIES:
+        ordered = model.order(fresh, policy)
+        results[policy] = simulate([jobs[features.seed] for features in ordered], num_workers, timeout_ms, duration_ms)
+    return results
+
+
+def load_features(variant_id: int, seed_class: int, condition: str) -> List[Tuple[SeedFeatures, Optional[bool]]]:
+    """
+    Loads the features of all seeds of the variant satisfying the given condition, together with their feasibility.
+    Greedy outcomes are taken from the lower bounds on scores stored so far.
+    Decks are streamed from the database and analyzed in batches, only their features are kept.
+    """
+    features = []
+    with database.conn.cursor(name='scheduling_features') as seeds_cur:
+        seeds_cur.itersize = FEATURES_BATCH_SIZE
+        seeds_cur.execute(
+            "SELECT seeds.seed, num, num_players, feasible, solve_time_ms, "
+            "(SELECT MAX(score_lower_bound) FROM score_lower_bounds WHERE score_lower_bounds.seed = seeds.seed), "
+            "array_agg(suit_index ORDER BY deck_index ASC), array_agg(rank ORDER BY deck_index ASC) "
+            "FROM seeds "
+            "INNER JOIN decks ON seeds.seed = decks.seed "
+            "WHERE variant_id = (%s) "
+            "AND class = (%s) "
+            "AND {} "
+            "GROUP BY seeds.seed "
+            "ORDER BY num".format(condition),
+            (variant_id, seed_class)
+        )
+        while len(rows := seeds_cur.fetchmany(FEATURES_BATCH_SIZE)) != 0:
+            instances = [
+                hanab_game.HanabiInstance(
+                    [hanab_game.DeckCard(suit, rank) for (suit, rank) in zip(suits, ranks)], num_players
+                )
+                for (_, _, num_players, _, _, _, suits, ranks) in rows
+            ]
+            features += [
+                (seed_features(seed, num, instance, min_pace, max_stored_crits, solve_time_ms, greedy_score), feasible)
+                for ((seed, num, _, feasible, solve_time_ms, greedy_score, _, _), instance, (min_pace, max_stored_crits))
+                in zip(rows, instances, analyze_instances(instances))
+            ]
+    return features
+
+
+def load_model(variant_id: int, seed_class: int, timeout_ms: int) -> DifficultyModel:
+    """
+    Fits the difficulty model on all seeds of the variant that have been attempted before
+    """
+    history = load_features(variant_id, seed_class, "solve_time_ms > 0")
+    model = DifficultyModel(timeout_ms)
+    model.fit([(features, feasible is not None) for (features, feasible) in history])
+    logger.verbose("Fitted difficulty model on {} seeds".format(len(history)))
+    return model
+
+
+def simulate_policies(variant_id: int, seed_class: int = 0, num_workers: int = 4, timeout: int = 150, hours: float = 1):
+    history = [
+        (features, feasible is not None)
+        for (features, feasible) in load_features(variant_id, seed_class, "solve_time_ms > 0")
+    ]
+    if len(history) < 2:
+        logger.error("Not enough seeds with timing data to simulate on.")
+        return
+    results = compare_policies(history, num_workers, 1000 * timeout, round(3600 * 1000 * hours))
+    logger.info("Simulated {} seeds with {} workers for {} hours, timeout {}s:".format(
+        len(history) // 2, num_workers, hours, timeout)
+    )
+    for policy, num_solved in results.items():
+        logger.info("  {:5}: {} seeds solved".format(policy, num_solved))
@@ -7,6 +7,10 @@ import platformdirs
 from hanabi import logger
 from hanabi import constants
 
+SITE_URL = "https://hanab.live/"
+# Number of rows per page requested from the API
+API_PAGE_SIZE = 100
+
 # Cache all requests to site to reduce traffic and latency
 session = requests_cache.CachedSession(
     platformdirs.user_cache_dir(constants.APP_NAME) + '/hanab.live',
@@ -18,7 +22,7 @@ session = requests_cache.CachedSession(
 
 def get(url, refresh=False) -> Optional[Dict | str]:
     #    print("sending request for " + url)
-    query = "https://hanab.live/" + url
+    query = SITE_URL + url
     logger.debug("GET {} (force_refresh={})".format(query, refresh))
     response = session.get(query, force_refresh=refresh)
     if not response:
@@ -27,19 +31,27 @@ def get(url, refresh=False) -> Optional[Dict | str]:
     if not response.status_code == 200:
         logger.debug("Request {} from hanab.live produced status code {}".format(query, response.status_code))
         return None
-    if "application/json" in response.headers['content-type']:
-        return json.loads(response.text)
-    return response.text
+    return parse_response(response.text, response.headers['content-type'])
 
 
-def api(url, refresh=False):
+def parse_response(content: str, content_type: str) -> Dict | str:
+    if "application/json" in content_type:
+        return json.loads(content)
+    return content
+
+
+def api_url(url) -> str:
     link = "api/v1/" + url
     if "?" in url:
         link += "&"
     else:
         link += "?"
-    link += "size=100"
-    return get(link, refresh)
+    link += "size={}".format(API_PAGE_SIZE)
+    return link
+
+
+def api(url, refresh=False):
+    return get(api_url(url), refresh)
 
 
 def replay(seed):
@@ -0,0 +1,254 @@
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+from typing import Optional, List, Tuple, Dict
+
+import pebble
+
+from hanabi import logger
+from hanabi import database
+from hanabi.live import instance_finder
+from hanabi.live import canonical_instances
+from hanabi.live import solve_metrics
+
+# Duration of a lease on a job. Workers renew the leases of their jobs regularly,
+# so this is the time after which jobs of a crashed worker are handed out again.
+LEASE_SECONDS = 120
+HEARTBEAT_INTERVAL_SECONDS = 30
+# Jobs whose workers crashed (or failed to solve them) this many times are not handed out anymore
+MAX_ATTEMPTS = 3
+
+
+def enqueue_solve_jobs(variant_id: int, seed_class: int = 0, num_players: Optional[int] = None, timeout: int = instance_finder.SOLVE_TIMEOUT_SECONDS) -> int:
+    """
+    Adds all unsolved seeds of the variant that have not been tried with the given timeout yet to the job queue.
+    :return: Number of jobs added
+    """
+    query = "INSERT INTO solve_jobs (seed, timeout) " \
+            "SELECT seed, (%s) FROM seeds " \
+            "WHERE variant_id = (%s) " \
+            "AND class = (%s) " \
+            "AND feasible IS NULL " \
+            "AND solve_time_ms < (%s) "
+    if num_players is not None:
+        query += "AND num_players = {} ".format(num_players)
+    query += "ON CONFLICT (seed) DO NOTHING"
+    database.cur.execute(query, (timeout, variant_id, seed_class, 1000 * timeout))
+    num_added = database.cur.rowcount
+    database.conn.commit()
+    logger.info("Added {} seeds of variant {} to the solve queue.".format(num_added, variant_id))
+    return num_added
+
+
+def claim_jobs(worker: str, num_jobs: int) -> List[Tuple[str, int, int, List[int], List[int], int]]:
+    """
+    Leases up to num_jobs free jobs to the worker. Jobs whose lease expired count as free.
+    Concurrent workers skip the rows locked by each other, so every job is handed out once.
+    :return: Seed, number of players, starting player, suits and ranks of the deck and timeout of each claimed job
+    """
+    database.cur.execute(
+        "UPDATE solve_jobs "
+        "SET worker = (%s), lease_expires_at = NOW() + make_interval(secs => %s), attempts = attempts + 1 "
+        "WHERE seed IN ("
+        "  SELECT seed FROM solve_jobs "
+        "  WHERE (lease_expires_at IS NULL OR lease_expires_at < NOW()) "
+        "  AND attempts < (%s) "
+        "  ORDER BY seed "
+        "  LIMIT (%s) "
+        "  FOR UPDATE SKIP LOCKED"
+        ") "
+        "RETURNING seed, timeout",
+        (worker, LEASE_SECONDS, MAX_ATTEMPTS, num_jobs)
+    )
+    timeouts = dict(database.cur.fetchall())
+    database.conn.commit()
+    if len(timeouts) == 0:
+        return []
+    database.cur.execute(
+        "SELECT seeds.seed, num_players, starting_player, "
+        "array_agg(suit_index order by deck_index asc), array_agg(rank order by deck_index asc) "
+        "FROM seeds "
+        "INNER JOIN decks ON seeds.seed = decks.seed "
+        "WHERE seeds.seed = ANY(%s) "
+        "GROUP BY seeds.seed",
+        (list(timeouts.keys()),)
+    )
+    jobs = [
+        (seed, num_players, starting_player, suits, ranks, timeouts[seed])
+        for (seed, num_players, starting_player, suits, ranks) in database.cur.fetchall()
+    ]
+    # Seeds without a stored deck cannot be solved, so their jobs would only stay leased until all attempts are used up
+    missing_decks = set(timeouts.keys()) - set(job[0] for job in jobs)
+    if len(missing_decks) != 0:
+        logger.warning("Removing jobs of {} seeds without a stored deck from the solve queue: {}".format(
+            len(missing_decks), ", ".join(sorted(missing_decks))
+        ))
+        database.cur.execute("DELETE FROM solve_jobs WHERE seed = ANY(%s)", (list(missing_decks),))
+        database.conn.commit()
+    return jobs
+
+
+def seconds_until_lease_expiry() -> Optional[float]:
+    """
+    :return: Time until the next lease of a job that can still be handed out expires,
+        None if no such job is leased at the moment
+    """
+    database.cur.execute(
+        "SELECT EXTRACT(EPOCH FROM MIN(lease_expires_at) - NOW()) FROM solve_jobs "
+        "WHERE lease_expires_at >= NOW() AND attempts < (%s)",
+        (MAX_ATTEMPTS,)
+    )
+    (seconds,) = database.cur.fetchone()
+    database.conn.commit()
+    return None if seconds is None else float(seconds)
+
+
+def job_members(jobs) -> List[Tuple[str, instance_finder.hanab_game.HanabiInstance, canonical_instances.CanonicalForm]]:
+    """
+    Seed, instance and canonical form of each of the given jobs, see instance_finder.expand_canonical_result
+    """
+    members = []
+    for (seed, num_players, starting_player, suits, ranks, _) in jobs:
+        instance = instance_finder.seed_instance(num_players, starting_player, suits, ranks)
+        members.append((seed, instance, canonical_instances.canonical_form(instance)))
+    return members
+
+
+def release_job(worker: str, seed: str):
+    """
+    Hands a job back to the queue, e.g. if solving it failed.
+    """
+    database.cur.execute(
+        "UPDATE solve_jobs SET (worker, lease_expires_at) = (NULL, NULL) WHERE seed = (%s) AND worker = (%s)",
+        (seed, worker)
+    )
+    database.conn.commit()
+
+
+def _heartbeat(worker: str, stop: threading.Event):
+    # The main connection is busy with storing results, so we use a separate one here
+    conn = database.global_db_connection_manager.new_connection()
+    conn.autocommit = True
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL_SECONDS):
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE solve_jobs SET lease_expires_at = NOW() + make_interval(secs => %s) WHERE worker = (%s)",
+                    (LEASE_SECONDS, worker)
+                )
+                logger.debug("Renewed leases of {} jobs".format(cur.rowcount))
+    finally:
+        conn.close()
+
+
+def run_solve_worker(list_all_pace_cuts: bool = False, num_threads: int = 4):
+    """
+    Solves jobs from the queue until it is empty and no jobs are leased by other workers anymore.
+    Any number of workers can run at the same time, also on different hosts.
+    Jobs are leased in small batches, leases are renewed by a heartbeat thread while the jobs are solved.
+    Results are stored in batches, together with the removal of the corresponding jobs.
+    If the worker dies, its jobs are handed out again once their leases expired.
+    """
+    worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    logger.info("Starting solve worker {}".format(worker))
+
+    cutoff_statistics = instance_finder.GreedyCutoffStatistics.load()
+    result_buffer = instance_finder.SolveResultBuffer(cutoff_statistics, worker=worker)
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(worker, stop_heartbeat), daemon=True)
+    heartbeat.start()
+    metrics = solve_metrics.SolveMetrics('Solve worker {}'.format(worker), num_threads)
+    pool = pebble.ProcessPool(
+        max_workers=num_threads,
+        max_tasks=instance_finder.WORKER_MAX_TASKS,
+        initializer=instance_finder.init_solve_worker
+    )
+    num_solved = 0
+    try:
+        # future -> canonical key and the jobs of all seeds sharing this instance
+        pending = {}
+        # canonical key -> jobs, for the instances currently being solved
+        solving: Dict[str, list] = {}
+
+        def schedule(key: str, jobs: list):
+            (seed, num_players, starting_player, suits, ranks, timeout) = jobs[0]
+            future = pool.schedule(
+                instance_finder.solve_seed,
+                args=(seed, num_players, starting_player, suits, ranks, list_all_pace_cuts),
+                timeout=timeout
+            )
+            pending[future] = (key, jobs)
+            solving[key] = jobs
+
+        while True:
+            # Keep the pool busy, but do not lease more jobs than we can start soon
+            # Seeds that are equal up to relabeling of suits and rotation of players are only solved once
+            groups: Dict[str, list] = {}
+            for job in claim_jobs(worker, 2 * num_threads - len(pending)):
+                (_, num_players, starting_player, suits, ranks, _) = job
+                key = canonical_instances.canonical_form(
+                    instance_finder.seed_instance(num_players, starting_player, suits, ranks)
+                ).key
+                if key in solving:
+                    # Stored together with the result of the equivalent seed that is already being solved
+                    solving[key].append(job)
+                else:
+                    groups.setdefault(key, []).append(job)
+            reused_results = instance_finder.load_canonical_results(groups, job_members)
+            for (result, seed_num_players) in reused_results:
+                result_buffer.add(result, seed_num_players)
+            metrics.record_reused(len(reused_results))
+            num_solved += len(reused_results)
+            for key, jobs in groups.items():
+                schedule(key, jobs)
+            if len(pending) == 0:
+                # Jobs leased by other workers come back to the queue if their worker crashed, so wait for them
+                wait_seconds = seconds_until_lease_expiry()
+                if wait_seconds is None:
+                    break
+                metrics.set_queue_depth(0)
+                metrics.maybe_write()
+                time.sleep(wait_seconds + 1)
+                continue
+
+            done, _ = concurrent.futures.wait(
+                pending, timeout=solve_metrics.WRITE_INTERVAL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                (key, jobs) = pending.pop(future)
+                (seed, num_players, _, _, _, timeout) = jobs[0]
+                result, reschedule = instance_finder.get_solve_result(future, seed, timeout)
+                if reschedule:
+                    metrics.record_recycle()
+                    schedule(key, jobs)
+                    continue
+                del solving[key]
+                if result is None:
+                    metrics.record_error()
+                    for job in jobs:
+                        release_job(worker, job[0])
+                else:
+                    metrics.record_result(result, len(jobs))
+                    result.canonical_key = key
+                    for seed_result in instance_finder.expand_canonical_result(result, job_members(jobs)):
+                        result_buffer.add(seed_result, num_players)
+                    num_solved += len(jobs)
+            metrics.set_queue_depth(len(pending))
+            metrics.maybe_write()
+    finally:
+        pool.stop()
+        pool.join()
+        result_buffer.flush()
+        metrics.finish()
+        # Hand back jobs we did not finish because of an interrupt, this does not count as a failed attempt
+        database.cur.execute(
+            "UPDATE solve_jobs SET (worker, lease_expires_at, attempts) = (NULL, NULL, attempts - 1) WHERE worker = (%s)",
+            (worker,)
+        )
+        database.conn.commit()
+        stop_heartbeat.set()
+        heartbeat.join()
+        cutoff_statistics.store()
+        logger.info("Worker {} processed {} jobs".format(worker, num_solved))
@@ -0,0 +1,253 @@
+import collections
+import json
+import os
+import socket
+import time
+from typing import Optional, List, Dict
+
+import platformdirs
+
+from hanabi import logger
+from hanabi import constants
+
+# Upper bounds of the buckets of the solve time histogram
+SOLVE_TIME_BUCKETS_MS = [100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000]
+# Interval in which the metrics files are rewritten while solving
+WRITE_INTERVAL_SECONDS = 10
+# Window over which the current throughput is computed
+THROUGHPUT_WINDOW_SECONDS = 300
+# Outcomes of a single solver run
+OUTCOMES = ['feasible', 'infeasible', 'timeout', 'skipped', 'error', 'recycled']
+
+
+def metrics_file(extension: str) -> str:
+    return platformdirs.user_data_dir(constants.APP_NAME, ensure_exists=True) + '/solve_metrics.' + extension
+
+
+class SolveMetrics:
+    """
+    Counters and histograms of a solving run, kept in the parent process.
+    They are periodically written to a file in Prometheus text format (e.g. for the textfile collector
+    of the node exporter) and to a JSON snapshot that is read by the 'status' subcommand.
+    """
+    def __init__(self, title: str, num_workers: int, write_interval: int = WRITE_INTERVAL_SECONDS):
+        self.title = title
+        self.num_workers = num_workers
+        self.write_interval = write_interval
+        self.started_at = time.time()
+        self.last_write = 0
+        self.running = True
+        self.runs: Dict[str, int] = {outcome: 0 for outcome in OUTCOMES}
+        self.num_seeds = 0
+        self.num_reused = 0
+        self.num_prefiltered = 0
+        self.num_total = 0
+        self.queue_depth = 0
+        self.solve_time_counts = [0] * (len(SOLVE_TIME_BUCKETS_MS) + 1)
+        self.solve_time_sum_ms = 0
+        # Completion times of recent seeds, to compute the current throughput
+        self.completions = collections.deque()
+        # worker pid -> maximum resident set size in kB, for the most recently active workers
+        self.worker_memory_kb: Dict[int, int] = {}
+
+    def set_total(self, num_total: int):
+        self.num_total = num_total
+
+    def set_queue_depth(self, queue_depth: int):
+        self.queue_depth = queue_depth
+
+    def record_result(self, result, num_seeds: int = 1):
+        """
+        Records a result returned by the solving pool, which might resolve several seeds at once
+        """
+        if result.skipped:
+            outcome = 'skipped'
+        elif result.feasible is None:
+            outcome = 'timeout'
+        else:
+            outcome = 'feasible' if result.feasible else 'infeasible'
+        self.runs[outcome] += 1
+        if outcome != 'skipped':
+            bucket = next(
+                (i for (i, bound) in enumerate(SOLVE_TIME_BUCKETS_MS) if result.time_ms <= bound),
+                len(SOLVE_TIME_BUCKETS_MS)
+            )
+            self.solve_time_counts[bucket] += 1
+            self.solve_time_sum_ms += result.time_ms
+        if result.worker_pid is not None:
+            # Workers are recycled, so we only keep as many as are alive at the same time
+            self.worker_memory_kb.pop(result.worker_pid, None)
+            self.worker_memory_kb[result.worker_pid] = result.worker_max_rss_kb
+            if len(self.worker_memory_kb) > self.num_workers:
+                del self.worker_memory_kb[next(iter(self.worker_memory_kb))]
+        self._complete(num_seeds)
+
+    def record_reused(self, num_seeds: int):
+        self.num_reused += num_seeds
+        self._complete(num_seeds)
+
+    def record_prefiltered(self, num_seeds: int):
+        self.num_prefiltered += num_seeds
+        self._complete(num_seeds)
+
+    def record_error(self):
+        self.runs['error'] += 1
+        self._complete(1)
+
+    def record_recycle(self):
+        self.runs['recycled'] += 1
+
+    def _complete(self, num_seeds: int):
+        now = time.time()
+        self.num_seeds += num_seeds
+        self.completions.append((now, num_seeds))
+        while self.completions[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self.completions.popleft()
+
+    def throughput(self) -> float:
+        """
+        :return: Seeds per minute over the last THROUGHPUT_WINDOW_SECONDS
+        """
+        now = time.time()
+        window = min(THROUGHPUT_WINDOW_SECONDS, now - self.started_at)
+        if window <= 0:
+            return 0
+        return 60 * sum(n for (t, n) in self.completions if t >= now - window) / window
+
+    def snapshot(self) -> dict:
+        return {
+            'title': self.title,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'running': self.running,
+            'started_at': self.started_at,
+            'updated_at': time.time(),
+            'write_interval': self.write_interval,
+            'num_total': self.num_total,
+            'num_seeds': self.num_seeds,
+            'num_reused': self.num_reused,
+            'num_prefiltered': self.num_prefiltered,
+            'queue_depth': self.queue_depth,
+            'throughput_per_minute': self.throughput(),
+            'runs': self.runs,
+            'solve_time_buckets_ms': SOLVE_TIME_BUCKETS_MS,
+            'solve_time_counts': self.solve_time_counts,
+            'solve_time_sum_ms': self.solve_time_sum_ms,
+            'worker_memory_kb': self.worker_memory_kb
+        }
+
+    def prometheus(self) -> str:
+        lines = [
+            '# HELP hanabi_solve_runs_total Solver runs by outcome.',
+            '# TYPE hanabi_solve_runs_total counter'
+        ]
+        for outcome, count in self.runs.items():
+            lines.append('hanabi_solve_runs_total{{outcome="{}"}} {}'.format(outcome, count))
+        lines += [
+            '# HELP hanabi_solve_seeds_total Seeds processed, including seeds resolved by results of equivalent seeds.',
+            '# TYPE hanabi_solve_seeds_total counter',
+            'hanabi_solve_seeds_total {}'.format(self.num_seeds),
+            '# HELP hanabi_solve_seeds_reused_total Seeds resolved by stored results of equivalent seeds.',
+            '# TYPE hanabi_solve_seeds_reused_total counter',
+            'hanabi_solve_seeds_reused_total {}'.format(self.num_reused),
+            '# HELP hanabi_solve_seeds_prefiltered_total Seeds resolved by deck analysis or greedy play before SAT solving.',
+            '# TYPE hanabi_solve_seeds_prefiltered_total counter',
+            'hanabi_solve_seeds_prefiltered_total {}'.format(self.num_prefiltered),
+            '# HELP hanabi_solve_seeds_remaining Seeds of this run that have not been processed yet.',
+            '# TYPE hanabi_solve_seeds_remaining gauge',
+            'hanabi_solve_seeds_remaining {}'.format(max(self.num_total - self.num_seeds, 0)),
+            '# HELP hanabi_solve_queue_depth Jobs scheduled on the solving pool that have not finished yet.',
+            '# TYPE hanabi_solve_queue_depth gauge',
+            'hanabi_solve_queue_depth {}'.format(self.queue_depth),
+            '# HELP hanabi_solve_throughput_seeds_per_minute Seeds processed per minute recently.',
+            '# TYPE hanabi_solve_throughput_seeds_per_minute gauge',
+            'hanabi_solve_throughput_seeds_per_minute {:.3f}'.format(self.throughput()),
+            '# HELP hanabi_solve_time_ms Time spent on solver runs.',
+            '# TYPE hanabi_solve_time_ms histogram'
+        ]
+        cumulative = 0
+        for bound, count in zip(SOLVE_TIME_BUCKETS_MS + ['+Inf'], self.solve_time_counts):
+            cumulative += count
+            lines.append('hanabi_solve_time_ms_bucket{{le="{}"}} {}'.format(bound, cumulative))
+        lines += [
+            'hanabi_solve_time_ms_sum {}'.format(self.solve_time_sum_ms),
+            'hanabi_solve_time_ms_count {}'.format(cumulative),
+            '# HELP hanabi_solve_worker_max_rss_bytes Maximum resident set size of the solving processes.',
+            '# TYPE hanabi_solve_worker_max_rss_bytes gauge'
+        ]
+        for pid, memory_kb in self.worker_memory_kb.items():
+            lines.append('hanabi_solve_worker_max_rss_bytes{{pid="{}"}} {}'.format(pid, 1024 * memory_kb))
+        lines += [
+            '# HELP hanabi_solve_last_update_seconds Time of the last update of these metrics.',
+            '# TYPE hanabi_solve_last_update_seconds gauge',
+            'hanabi_solve_last_update_seconds {:.0f}'.format(time.time())
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        self.last_write = time.time()
+        # Write to temporary files first, so that readers never see partially written files
+        for extension, content in [('prom', self.prometheus()), ('json', json.dumps(self.snapshot(), indent=2))]:
+            file = metrics_file(extension)
+            with open(file + '.tmp', 'w') as f:
+                f.write(content)
+            os.replace(file + '.tmp', file)
+
+    def maybe_write(self):
+        if time.time() - self.last_write >= self.write_interval:
+            self.write()
+
+    def finish(self):
+        self.running = False
+        self.write()
+
+
+def solve_time_quantile(snapshot: dict, quantile: float) -> Optional[int]:
+    """
+    :return: Upper bound of the histogram bucket containing the quantile, None if it lies in the last bucket
+    """
+    counts = snapshot['solve_time_counts']
+    target = quantile * sum(counts)
+    cumulative = 0
+    for bound, count in zip(snapshot['solve_time_buckets_ms'], counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def print_status():
+    try:
+        with open(metrics_file('json'), 'r') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        logger.info("No solving run has written metrics yet.")
+        return
+
+    age = time.time() - snapshot['updated_at']
+    if not snapshot['running']:
+        state = 'finished'
+    elif age > 3 * max(snapshot['write_interval'], 1):
+        state = 'stalled or killed, no update for {:.0f}s'.format(age)
+    else:
+        state = 'running'
+    runs = snapshot['runs']
+    num_runs = sum(runs[outcome] for outcome in ['feasible', 'infeasible', 'timeout'])
+    logger.info("{} on {} (pid {}): {}".format(snapshot['title'], snapshot['host'], snapshot['pid'], state))
+    logger.info("  elapsed:    {:.0f}s".format(snapshot['updated_at'] - snapshot['started_at']))
+    logger.info("  seeds:      {} / {} ({} reused from equivalent seeds, {} resolved before SAT)".format(
+        snapshot['num_seeds'], snapshot['num_total'], snapshot['num_reused'], snapshot.get('num_prefiltered', 0))
+    )
+    logger.info("  throughput: {:.1f} seeds/min".format(snapshot['throughput_per_minute']))
+    logger.info("  queue:      {} jobs".format(snapshot['queue_depth']))
+    logger.info("  runs:       {}".format(", ".join("{} {}".format(count, outcome) for outcome, count in runs.items())))
+    if num_runs > 0:
+        logger.info("  timeouts:   {:.1%}".format(runs['timeout'] / num_runs))
+        logger.info("  solve time: mean {:.0f}ms, p50 <= {}, p90 <= {}".format(
+            snapshot['solve_time_sum_ms'] / sum(snapshot['solve_time_counts']),
+            *["{}ms".format(bound) if bound is not None else "inf" for bound in [
+                solve_time_quantile(snapshot, 0.5), solve_time_quantile(snapshot, 0.9)
+            ]]
+        ))
+    for pid, memory_kb in snapshot['worker_memory_kb'].items():
+        logger.info("  worker {}: {:.0f} MB".format(pid, memory_kb / 1024))
@@ -0,0 +1,498 @@
+from typing import List, Optional, Iterable, Set, Tuple
+from dataclasses import dataclass
+
+import numpy as np
+
+from hanabi import constants
+from hanabi.hanab_game import DeckCard
+from hanabi.solvers.deck_analyzer import InfeasibilityType, InfeasibilityReason, ValueWithIndex, AnalysisResult, \
+    _add_reason
+
+# Decks are passed as (N, deck_size) integer arrays, where the card (suit_index, rank) is encoded as below.
+# All decks of a batch have to belong to the same variant and are analyzed for the same number of players.
+
+
+def card_code(card: DeckCard) -> int:
+    return 5 * card.suitIndex + card.rank - 1
+
+
+def encode_decks(decks: Iterable[List[DeckCard]]) -> np.ndarray:
+    return np.array([[card_code(card) for card in deck] for deck in decks], dtype=np.int8)
+
+
+def decode_deck(cards: np.ndarray) -> List[DeckCard]:
+    return [DeckCard(int(code) // 5, int(code) % 5 + 1) for code in cards]
+
+
+# The state of a single suit during the sweep of analyze_pace_and_hand_size consists of the stack
+# and the ranks of the stored cards and stored crits. Since ranks 1 are never stored, we encode this as
+#   stack + 6 * (stored_ranks + 16 * crit_ranks),
+# where stored_ranks and crit_ranks are bitmasks over ranks 2 to 5.
+_NUM_SUIT_STATES = 6 * 16 * 16
+
+
+def _suit_state(stack: int, stored: Set[int], crits: Set[int]) -> int:
+    return stack + 6 * (sum(1 << (rank - 2) for rank in stored) + 16 * sum(1 << (rank - 2) for rank in crits))
+
+
+def _build_transition_tables():
+    """
+    Tabulates the effect of drawing a card on the state of its suit, mirroring PaceAndHandSizeSweep.step.
+    Transitions are indexed by 10 * state + 2 * (rank - 1) + (1 if the card is artificially critical else 0).
+    """
+    next_state = np.zeros(10 * _NUM_SUIT_STATES, dtype=np.int16)
+    score_delta = np.zeros(10 * _NUM_SUIT_STATES, dtype=np.int8)
+    stored_delta = np.zeros(10 * _NUM_SUIT_STATES, dtype=np.int8)
+    crits_delta = np.zeros(10 * _NUM_SUIT_STATES, dtype=np.int8)
+    squeezed_state = np.zeros(_NUM_SUIT_STATES, dtype=np.int16)
+    for state in range(_NUM_SUIT_STATES):
+        stack = state % 6
+        stored = {rank for rank in range(2, 6) if (state // 6) & (1 << (rank - 2))}
+        crits = {rank for rank in range(2, 6) if (state // 96) & (1 << (rank - 2))}
+        squeezed_state[state] = _suit_state(stack, crits, crits)
+        for rank in range(1, 6):
+            for artificial_crit in [0, 1]:
+                transition = 10 * state + 2 * (rank - 1) + artificial_crit
+                new_stack, new_stored, new_crits = stack, stored.copy(), crits.copy()
+                if rank == stack + 1:
+                    new_stack = rank
+                    while new_stack + 1 in new_stored:
+                        new_stack += 1
+                        new_stored.remove(new_stack)
+                        new_crits.discard(new_stack)
+                elif rank > stack + 1:
+                    if rank in stored or rank == 5 or artificial_crit:
+                        new_crits.add(rank)
+                    new_stored.add(rank)
+                next_state[transition] = _suit_state(new_stack, new_stored, new_crits)
+                score_delta[transition] = new_stack - stack
+                stored_delta[transition] = len(new_stored) - len(stored)
+                crits_delta[transition] = len(new_crits) - len(crits)
+    return next_state, score_delta, stored_delta, crits_delta, squeezed_state
+
+
+_NEXT_STATE, _SCORE_DELTA, _STORED_DELTA, _CRITS_DELTA, _SQUEEZED_STATE = _build_transition_tables()
+
+# Number of decks processed at once by the sweep, chosen such that its working set stays in cache
+_SWEEP_CHUNK_SIZE = 8192
+
+# Sentinel for unreachable states in the top/bottom deck analysis
+_UNREACHABLE = 1000
+
+
+@dataclass
+class _SweepColumns:
+    """
+    Outcome of analyze_pace_and_hand_size for a batch of decks, one entry per row.
+    Indices are card indices in the deck, -1 stands for 'not found'.
+    """
+    hand_size_index: np.ndarray
+    pace_index: np.ndarray
+    pace_value: np.ndarray
+    pace_after_squeeze: np.ndarray
+    min_pace: np.ndarray
+    min_pace_index: np.ndarray
+    max_stored_crits: np.ndarray
+    max_stored_crits_index: np.ndarray
+    max_stored_cards: np.ndarray
+    max_stored_cards_index: np.ndarray
+    # Only stored if all pace cuts are requested: pace and whether we squeezed yet, after each card drawn
+    paces: Optional[np.ndarray] = None
+    squeezed: Optional[np.ndarray] = None
+
+    def infeasibility_reasons(self, row: int, deck_size: int) -> List[InfeasibilityReason]:
+        """
+        Reconstructs the reasons in the order analyze_pace_and_hand_size reports them
+        """
+        if self.paces is None:
+            cuts = [] if self.pace_index[row] < 0 else [int(self.pace_index[row])]
+        else:
+            cuts = np.flatnonzero(self.paces[row] <= 0).tolist()
+        hand_size_index = int(self.hand_size_index[row])
+
+        reasons = []
+        hand_size_reported = hand_size_index < 0
+        for card_index in cuts:
+            if not hand_size_reported and hand_size_index <= card_index:
+                reasons.append(InfeasibilityReason(InfeasibilityType.HandSize, hand_size_index))
+                hand_size_reported = True
+            if self.paces is None:
+                value = int(self.pace_value[row])
+                after_squeeze = self.pace_after_squeeze[row]
+            else:
+                value = int(self.paces[row, card_index])
+                after_squeeze = self.squeezed[row, card_index]
+            reasons.append(InfeasibilityReason(
+                InfeasibilityType.PaceAfterSqueeze if after_squeeze else InfeasibilityType.Pace,
+                deck_size - card_index - 1,
+                value
+            ))
+        if not hand_size_reported:
+            reasons.append(InfeasibilityReason(InfeasibilityType.HandSize, hand_size_index))
+        return reasons
+
+
+def _sweep(
+        suits: np.ndarray,
+        card_keys: np.ndarray,
+        num_players: int,
+        hand_size: int,
+        num_suits: int,
+        do_squeeze: bool,
+        list_all_pace_cuts: bool
+) -> _SweepColumns:
+    """
+    Runs the sweep of analyze_pace_and_hand_size on all decks simultaneously.
+    Drawing a card is a single lookup in the transition tables for the state of its suit,
+    the number of stored cards and crits after each card are recorded and evaluated at the end.
+    :param card_keys: 2 * (rank - 1) + (1 if the card is artificially critical else 0) for each card of the decks
+    """
+    num_decks, deck_size = suits.shape
+    total_hand_size = num_players * hand_size
+    pace_offset = deck_size - 1 + num_players - 5 * num_suits
+    card_indices = np.arange(deck_size)
+
+    # We store everything indexed by card first, so that the decks of each step are contiguous in memory
+    scores = np.zeros((deck_size, num_decks), dtype=np.int16)
+    num_stored_cards = np.zeros((deck_size, num_decks), dtype=np.int16)
+    num_stored_crits = np.zeros((deck_size, num_decks), dtype=np.int16)
+    for start in range(0, num_decks, _SWEEP_CHUNK_SIZE):
+        chunk = slice(start, min(start + _SWEEP_CHUNK_SIZE, num_decks))
+        row_offsets = np.arange(chunk.stop - chunk.start, dtype=np.int32)[:, np.newaxis] * num_suits
+        positions = np.ascontiguousarray((row_offsets + suits[chunk]).T)
+        suit_states = np.zeros((chunk.stop - chunk.start) * num_suits, dtype=np.int16)
+        score = np.zeros(chunk.stop - chunk.start, dtype=np.int16)
+        stored_cards = np.zeros(chunk.stop - chunk.start, dtype=np.int16)
+        stored_crits = np.zeros(chunk.stop - chunk.start, dtype=np.int16)
+        keys = np.ascontiguousarray(card_keys[chunk].T, dtype=np.int32)
+
+        for card_index in range(deck_size):
+            suit_positions = positions[card_index]
+            transitions = 10 * suit_states[suit_positions] + keys[card_index]
+            suit_states[suit_positions] = _NEXT_STATE[transitions]
+            score += _SCORE_DELTA[transitions]
+            stored_cards += _STORED_DELTA[transitions]
+            stored_crits += _CRITS_DELTA[transitions]
+
+            # In case we can only keep the critical cards exactly, get rid of all others
+            if do_squeeze:
+                squeeze = np.flatnonzero(stored_crits == total_hand_size - 1)
+                if len(squeeze) != 0:
+                    squeeze_positions = (row_offsets[squeeze] + np.arange(num_suits)).reshape(-1)
+                    suit_states[squeeze_positions] = _SQUEEZED_STATE[suit_states[squeeze_positions]]
+                    stored_cards[squeeze] = stored_crits[squeeze]
+
+            scores[card_index, chunk] = score
+            num_stored_cards[card_index, chunk] = stored_cards
+            num_stored_crits[card_index, chunk] = stored_crits
+
+    # Reductions along the first axis are fast as long as we avoid argmin and argmax
+    card_indices = card_indices.astype(np.int16)[:, np.newaxis]
+
+    def first_index(mask: np.ndarray, default: int = -1) -> np.ndarray:
+        index = np.where(mask, card_indices, deck_size).min(axis=0)
+        return np.where(index < deck_size, index, default).astype(np.int16)
+
+    rows = np.arange(num_decks)
+    paces = pace_offset - card_indices + scores
+    pace_index = first_index(paces <= 0)
+    # Since the number of crits increases by at most one per card, the first squeeze happens when it first
+    # reaches our hand size, and we stay in squeezed state from then on
+    if do_squeeze:
+        first_squeeze = first_index(num_stored_crits == total_hand_size - 1, deck_size)
+    else:
+        first_squeeze = np.full(num_decks, deck_size, dtype=np.int16)
+
+    # Statistics are updated on strict improvements only, so they refer to the first occurrence
+    min_pace = paces.min(axis=0)
+    max_stored_crits = num_stored_crits.max(axis=0)
+    max_stored_cards = num_stored_cards.max(axis=0)
+    result = _SweepColumns(
+        hand_size_index=first_index(num_stored_crits > total_hand_size - 1),
+        pace_index=pace_index,
+        pace_value=paces[pace_index, rows],
+        pace_after_squeeze=(pace_index >= 0) & (first_squeeze <= pace_index),
+        min_pace=min_pace,
+        min_pace_index=first_index(paces == min_pace),
+        max_stored_crits=max_stored_crits,
+        max_stored_crits_index=first_index(num_stored_crits == max_stored_crits),
+        max_stored_cards=max_stored_cards,
+        max_stored_cards_index=first_index(num_stored_cards == max_stored_cards),
+    )
+    if list_all_pace_cuts:
+        result.paces = paces.T
+        result.squeezed = (card_indices >= first_squeeze).T
+    return result
+
+
+def _bottom_non_fives(ranks: np.ndarray, num_suits: int) -> np.ndarray:
+    """
+    Vectorized version of deck_analyzer.bottom_non_fives.
+    :return: (N, 3) array of the deck indices of the last three non-fives of each deck, in deck order
+    """
+    deck_size = ranks.shape[1]
+    # There is only one five per suit, so we only need to look at the bottom of the deck
+    window = min(deck_size, 3 + num_suits)
+    non_fives_from_bottom = np.cumsum(ranks[:, :deck_size - window - 1:-1] != 5, axis=1)
+    return np.stack([
+        deck_size - 1 - np.argmax(non_fives_from_bottom >= num_cards, axis=1) for num_cards in [3, 2, 1]
+    ], axis=1)
+
+
+def _top_bottom_deck_loss(
+        codes: np.ndarray,
+        ranks: np.ndarray,
+        num_players: int,
+        hand_size: int
+) -> np.ndarray:
+    """
+    Vectorized version of deck_analyzer.check_for_top_bottom_deck_loss.
+    Instead of enumerating all choices of holders, we compute the minimum number of turns over all choices
+    by a dynamic program over the ranks whose state is the player that played the last card (or 'free choice').
+    :return: Index of the suit that makes the deck infeasible, -1 if none
+    """
+    num_decks, deck_size = codes.shape
+    num_dealt_cards = num_players * hand_size
+    dealt = codes[:, :num_dealt_cards]
+    player_bits = np.left_shift(1, np.arange(num_dealt_cards) // hand_size)
+    # Costs of moving from the player of the last play to the next player playing
+    players = np.arange(num_players)
+    turn_costs = (players[np.newaxis, :] - players[:, np.newaxis] - 1) % num_players + 1
+
+    result = np.full(num_decks, -1, dtype=np.int16)
+    bottom = codes[:, :deck_size - 5:-1]
+    for offset in range(bottom.shape[1]):
+        # Scan the deck in reverse order, counting how often we found this card already
+        copies = (bottom[:, :offset + 1] == bottom[:, offset, np.newaxis]).sum(axis=1)
+        rank = ranks[:, deck_size - 1 - offset]
+        candidates = np.flatnonzero((result < 0) & ((copies >= 3) | ((rank != 1) & (copies >= 2))))
+        if len(candidates) == 0:
+            continue
+
+        suit = bottom[candidates, offset] // 5
+        max_rank_starting_extra_round = rank[candidates] + offset - 1
+
+        # turns[:, p] is the minimum number of turns if player p played last, last column is for free choice
+        turns = np.full((len(candidates), num_players + 1), _UNREACHABLE, dtype=np.int32)
+        # Rank 0 never occurs, so it is a free choice and costs one turn if included
+        turns[:, num_players] = max_rank_starting_extra_round <= 0
+        for cur_rank in range(1, 6):
+            active = cur_rank >= max_rank_starting_extra_round
+            holders = dealt[candidates] == (5 * suit + cur_rank - 1)[:, np.newaxis]
+            num_holders = holders.sum(axis=1)
+            holder_bits = np.bitwise_or.reduce(np.where(holders, player_bits, 0), axis=1)
+            # Where we have free choice anyway, the next card can be played by whoever is next
+            free_choice = (num_holders == 0) | ((cur_rank != 5) & (num_holders < 2))
+
+            after_free_choice = np.empty_like(turns)
+            after_free_choice[:, num_players] = turns[:, num_players] + 1
+            after_free_choice[:, :num_players] = np.roll(turns[:, :num_players], 1, axis=1) + 1
+
+            after_holder = np.minimum(
+                (turns[:, :num_players, np.newaxis] + turn_costs[np.newaxis]).min(axis=1),
+                turns[:, num_players, np.newaxis] + 1
+            )
+            holds = (np.right_shift(holder_bits[:, np.newaxis], players) & 1) == 1
+            after_holder = np.where(holds, after_holder, _UNREACHABLE)
+            after_holder = np.concatenate(
+                [after_holder, np.full((len(candidates), 1), _UNREACHABLE, dtype=np.int32)], axis=1
+            )
+
+            turns = np.where(
+                active[:, np.newaxis],
+                np.where(free_choice[:, np.newaxis], after_free_choice, after_holder),
+                turns
+            )
+            turns = np.minimum(turns, _UNREACHABLE)
+
+        infeasible = turns.min(axis=1) > num_players + 1
+        result[candidates[infeasible]] = suit[infeasible]
+    return result
+
+
+@dataclass
+class BatchAnalysisResult:
+    """
+    Outcome of analyze_batch, one entry per deck of the batch.
+    infeasibility_reasons(row) and analysis_result(row) give exactly what deck_analyzer.analyze reports for that deck.
+    """
+    deck_size: int
+    num_players: int
+    sweep: _SweepColumns
+    # Sweep without squeeze, only run on decks where pace ran out after a squeeze. Row i corresponds to clean_rows[i]
+    clean_sweep: _SweepColumns
+    clean_rows: np.ndarray
+    # Deck indices and codes of the last three non-fives of each deck
+    bottom_non_fives: np.ndarray
+    bottom_non_five_cards: np.ndarray
+    bottom_top_deck_suit: np.ndarray
+    crit_at_bottom: np.ndarray
+
+    @property
+    def min_pace(self) -> np.ndarray:
+        return self.sweep.min_pace
+
+    @property
+    def max_stored_crits(self) -> np.ndarray:
+        return self.sweep.max_stored_crits
+
+    @property
+    def max_stored_cards(self) -> np.ndarray:
+        return self.sweep.max_stored_cards
+
+    @property
+    def double_bottom_2(self) -> np.ndarray:
+        if self.num_players != 2:
+            return np.zeros(len(self.crit_at_bottom), dtype=bool)
+        (third, second, last) = self.bottom_non_five_cards.T
+        return (last == second) & (last % 5 == 1)
+
+    @property
+    def triple_bottom_1(self) -> np.ndarray:
+        if self.num_players != 2:
+            return np.zeros(len(self.crit_at_bottom), dtype=bool)
+        (third, second, last) = self.bottom_non_five_cards.T
+        return (last == second) & (second == third) & (third % 5 == 0)
+
+    @property
+    def infeasible(self) -> np.ndarray:
+        """
+        Mask of decks where some reason for infeasibility was found
+        """
+        return (self.sweep.hand_size_index >= 0) | (self.sweep.pace_index >= 0) | (self.bottom_top_deck_suit >= 0) \
+            | self.double_bottom_2 | self.triple_bottom_1 | self.crit_at_bottom
+
+    def __len__(self):
+        return len(self.crit_at_bottom)
+
+    def infeasibility_reasons(self, row: int) -> List[InfeasibilityReason]:
+        reasons = self.sweep.infeasibility_reasons(row, self.deck_size)
+        if any(reason.type == InfeasibilityType.PaceAfterSqueeze for reason in reasons):
+            clean_row = int(np.searchsorted(self.clean_rows, row))
+            for reason in self.clean_sweep.infeasibility_reasons(clean_row, self.deck_size):
+                _add_reason(reasons, reason)
+
+        if self.bottom_top_deck_suit[row] >= 0:
+            _add_reason(reasons, InfeasibilityReason(InfeasibilityType.BottomTopDeck, int(self.bottom_top_deck_suit[row])))
+
+        (third, second, last) = (int(index) for index in self.bottom_non_fives[row])
+        if self.double_bottom_2[row]:
+            _add_reason(reasons, InfeasibilityReason(InfeasibilityType.Pace, second - 1))
+            _add_reason(reasons, InfeasibilityReason(InfeasibilityType.DoubleBottom2With5s, second - 1))
+        if self.triple_bottom_1[row]:
+            _add_reason(reasons, InfeasibilityReason(InfeasibilityType.Pace, third - 1))
+            _add_reason(reasons, InfeasibilityReason(InfeasibilityType.TripleBottom1With5s, second - 1))
+
+        if self.crit_at_bottom[row]:
+            _add_reason(reasons, InfeasibilityReason(InfeasibilityType.CritAtBottom, self.deck_size - 1))
+        return reasons
+
+    def analysis_result(self, row: int) -> AnalysisResult:
+        sweep = self.sweep
+        return AnalysisResult(
+            infeasibility_reasons=self.infeasibility_reasons(row),
+            min_pace=ValueWithIndex(int(sweep.min_pace[row]), int(sweep.min_pace_index[row]), True),
+            max_stored_crits=ValueWithIndex(
+                int(sweep.max_stored_crits[row]), int(sweep.max_stored_crits_index[row]), False
+            ),
+            max_stored_cards=ValueWithIndex(
+                int(sweep.max_stored_cards[row]), int(sweep.max_stored_cards_index[row]), False
+            )
+        )
+
+
+def analyze_batch(
+        decks: np.ndarray,
+        num_players: int,
+        num_suits: Optional[int] = None,
+        hand_size: Optional[int] = None,
+        list_all_pace_cuts: bool = False
+) -> BatchAnalysisResult:
+    """
+    Runs deck_analyzer.analyze on all decks of the batch at once.
+    The sweep of the pace and hand size analysis is inherently sequential in the deck,
+    so we loop over the card positions and vectorize over the decks instead.
+    :param decks: (N, deck_size) array of card codes, see card_code
+    :param num_suits: Number of suits of the variant, determined from the decks if not given
+    """
+    decks = np.asarray(decks)
+    codes = decks.astype(np.int16)
+    num_decks, deck_size = codes.shape
+    suits = codes // 5
+    ranks = codes % 5 + 1
+    if num_suits is None:
+        num_suits = int(suits.max()) + 1
+    hand_size = hand_size or constants.HAND_SIZES[num_players]
+    num_dark_suits = (deck_size - 10 * num_suits) // (-5)
+    rows = np.arange(num_decks)
+
+    # Positions of the last three non-fives, and the codes of these cards
+    bottom_non_fives = _bottom_non_fives(ranks, num_suits)
+    (third, second, last) = (codes[rows, bottom_non_fives[:, i]] for i in range(3))
+
+    # Cards that we mark critical artificially, see deck_analyzer.artificial_crits
+    artificial_crits = np.zeros(codes.shape, dtype=bool)
+
+    def mark_critical(mask: np.ndarray, cards: np.ndarray):
+        artificial_crits[...] |= mask[:, np.newaxis] & (codes == cards[:, np.newaxis])
+
+    if num_players == 2:
+        mark_critical(second % 5 == 1, second)
+        mark_critical((last == second) & (second % 5 == 2), third)
+    elif num_players == 3:
+        mark_critical((last == second) & (second % 5 == 1), third)
+    mark_critical(ranks[:, -1] != 5, codes[:, -1])
+    card_keys = 2 * (ranks - 1) + artificial_crits
+
+    sweep = _sweep(suits, card_keys, num_players, hand_size, num_suits, True, list_all_pace_cuts)
+
+    # In case pace ran out after a squeeze from hand size, we also want the reasons of a clean pace analysis
+    if list_all_pace_cuts:
+        clean_rows = np.flatnonzero((sweep.squeezed & (sweep.paces <= 0)).any(axis=1))
+    else:
+        clean_rows = np.flatnonzero(sweep.pace_after_squeeze)
+    clean_sweep = _sweep(
+        suits[clean_rows], card_keys[clean_rows], num_players, hand_size, num_suits, False, list_all_pace_cuts
+    )
+
+    return BatchAnalysisResult(
+        deck_size=deck_size,
+        num_players=num_players,
+        sweep=sweep,
+        clean_sweep=clean_sweep,
+        clean_rows=clean_rows,
+        bottom_non_fives=bottom_non_fives,
+        bottom_non_five_cards=np.stack([third, second, last], axis=1),
+        bottom_top_deck_suit=_top_bottom_deck_loss(codes, ranks, num_players, hand_size),
+        crit_at_bottom=(ranks[:, -1] != 5) & (suits[:, -1] >= num_suits - num_dark_suits)
+    )
+
+
+def analyze_seeds(
+        seeds: List[Tuple[str, int, List[int], List[int]]],
+        list_all_pace_cuts: bool = False
+) -> List[Tuple[str, int, int, int]]:
+    """
+    Analyzes the decks of the given seeds, grouped into batches of equal player count.
+    :param seeds: Tuples (seed, num_players, suit indices, ranks) as returned by aggregating the decks table
+    :return: Rows (seed, reason, index, value) for the infeasibility_reasons table
+    """
+    seeds_by_num_players = {}
+    for (seed, num_players, suits, ranks) in seeds:
+        seeds_by_num_players.setdefault((num_players, len(suits)), []).append((seed, suits, ranks))
+
+    rows = []
+    for ((num_players, _), batch) in seeds_by_num_players.items():
+        suits = np.array([suits for (_, suits, _) in batch], dtype=np.int8)
+        ranks = np.array([ranks for (_, _, ranks) in batch], dtype=np.int8)
+        result = analyze_batch(5 * suits + ranks - 1, num_players, list_all_pace_cuts=list_all_pace_cuts)
+        for row in np.flatnonzero(result.infeasible):
+            seed = batch[row][0]
+            for reason in result.infeasibility_reasons(row):
+                rows.append((
+                    seed,
+                    reason.type.value,
+                    0 if reason.index is None else reason.index,
+                    0 if reason.value is None else reason.value
+                ))
+    return rows
@@ -1,19 +1,21 @@
 import collections
+import concurrent.futures
 import dataclasses
 from enum import Enum
-from typing import List, Any, Optional, Tuple, Set
+from typing import List, Optional, Tuple, Set, Dict
 from dataclasses import dataclass
 
 import alive_progress
+import psycopg2.extras
 
 import hanabi.hanab_game
 from hanabi import database
 from hanabi import logger
 from hanabi import hanab_game
 from hanabi.hanab_game import DeckCard
-from hanabi.live import compress
 
 from hanabi.database import games_db_interface
+from hanabi.database import sharding
 
 
 class InfeasibilityType(Enum):
@@ -28,6 +30,10 @@ class InfeasibilityType(Enum):
     DoubleBottomTopDeck    = 30  # Card distribution in two suits in starting hands + near end of deck is impossible to win.
     CritAtBottom           = 40
 
+    # only found in games in progress
+    CritDiscarded          = 41  # All copies of a card that is still needed are gone. idx denotes suit index, value the rank
+    Strikes                = 42  # Game has been lost by strikes
+
     # Default reason when we have nothing else
     SAT                    = 50
     Manual                 = 60
@@ -47,6 +53,8 @@ class InfeasibilityReason:
                 return "Out of hand size after drawing card {}".format(self.value)
             case InfeasibilityType.CritAtBottom:
                 return "Critical non-5 at bottom"
+            case InfeasibilityType.CritDiscarded:
+                return "All copies of {} discarded".format(DeckCard(self.index, self.value))
             case _:
                 return "{} ({})".format(self.type, self.value)
 
@@ -57,19 +65,59 @@ class InfeasibilityReason:
         return (self.type, self.index, self.value).__hash__()
 
 
-def generate_all_choices(l: List[List[Any]]):
-    if len(l) == 0:
-        yield []
-        return
-    head, *tail = l
-    for option in head:
-        for back in generate_all_choices(tail):
-            yield [option] + back
+def min_turns_to_finish_suit(
+        positions_by_rank: List[List[Optional[int]]],
+        start_rank: int,
+        num_players: int
+) -> int:
+    """
+    Computes the minimum number of turns needed to play the cards of ranks start_rank to 5 of a suit in order,
+    where each rank can be played by any of the players listed in positions_by_rank (None stands for free choice).
+    This is a dynamic program over the ranks whose state is the player that played the last card.
+    """
+    # Maps the player that played the last card (None if we had free choice so far) to the minimum number of turns
+    turns = {None: 0}
+    for rank in range(start_rank, 6):
+        next_turns = {}
+        for cur_player, num_turns in turns.items():
+            for position in set(positions_by_rank[rank]):
+                if cur_player is None or position is None:
+                    next_num_turns = num_turns + 1
+                else:
+                    # Note the -1 and +1 to output things in range [1,5] instead of [0,4]
+                    next_num_turns = num_turns + (position - cur_player - 1) % num_players + 1
+
+                if position is not None:
+                    next_player = position
+                elif cur_player is not None:
+                    next_player = (cur_player + 1) % num_players
+                else:
+                    next_player = None
+
+                if next_player not in next_turns or next_num_turns < next_turns[next_player]:
+                    next_turns[next_player] = next_num_turns
+        turns = next_turns
+    return min(turns.values())
+
+
+def starting_hand_holders(instance: hanab_game.HanabiInstance) -> Dict[DeckCard, List[int]]:
+    """
+    Maps each card in the starting hands to the list of players holding it (with multiplicity, in ascending order)
+    """
+    holders = {}
+    for card_index in range(instance.num_dealt_cards):
+        card = instance.deck[card_index]
+        holders.setdefault(card, []).append(card_index // instance.hand_size)
+    return holders
 
 
 # Returns index of the suit that makes deck infeasible, or None if it does not exist
-def check_for_top_bottom_deck_loss(instance: hanab_game.HanabiInstance) -> Optional[int]:
-    hands = [instance.deck[p * instance.hand_size : (p+1) * instance.hand_size] for p in range(instance.num_players)]
+def check_for_top_bottom_deck_loss(
+        instance: hanab_game.HanabiInstance,
+        holders: Optional[Dict[DeckCard, List[int]]] = None
+) -> Optional[int]:
+    if holders is None:
+        holders = starting_hand_holders(instance)
 
     # scan the deck in reverse order if any card is forced to be late
     found = {}
@@ -86,11 +134,7 @@ def check_for_top_bottom_deck_loss(instance: hanab_game.HanabiInstance) -> Optio
             # Next, need to figure out what positions of cards of the same suit are fixed
             positions_by_rank = [[] for _ in range(6)]
             for rank in range(max_rank_starting_extra_round, 6):
-                for player, hand in enumerate(hands):
-                    card_test = DeckCard(card.suitIndex, rank)
-                    for card_hand in hand:
-                        if card_test == card_hand:
-                            positions_by_rank[rank].append(player)
+                positions_by_rank[rank] += holders.get(DeckCard(card.suitIndex, rank), [])
 
             # clean up where we have free choice anyway
             for rank, positions in enumerate(positions_by_rank):
@@ -99,25 +143,11 @@ def check_for_top_bottom_deck_loss(instance: hanab_game.HanabiInstance) -> Optio
                 if len(positions) == 0:
                     positions.append(None)
 
-            # Now, iterate through all choices in starting hands (None stands for free choice of a card) and check them
-            assignment_found = False
-            for assignment in generate_all_choices(positions_by_rank):
-                cur_player = None
-                num_turns = 0
-                for rank in range(max_rank_starting_extra_round, 6):
-                    if cur_player is None or assignment[rank] is None:
-                        num_turns += 1
-                    else:
-                        # Note the -1 and +1 to output things in range [1,5] instead of [0,4]
-                        num_turns += (assignment[rank] - cur_player - 1) % instance.num_players + 1
-
-                    if assignment[rank] is not None:
-                        cur_player = assignment[rank]
-                    elif cur_player is not None:
-                        cur_player = (cur_player + 1) % instance.num_players
-
-                if num_turns <= instance.num_players + 1:
-                    assignment_found = True
+            # Now, check whether some choice of holders in starting hands (None stands for free choice of a card)
+            # allows us to play the remaining cards of the suit in time
+            assignment_found = min_turns_to_finish_suit(
+                positions_by_rank, max_rank_starting_extra_round, instance.num_players
+            ) <= instance.num_players + 1
 
             # If no assignment worked out, the deck is infeasible because of this suit
             if not assignment_found:
@@ -127,9 +157,28 @@ def check_for_top_bottom_deck_loss(instance: hanab_game.HanabiInstance) -> Optio
     return None
 
 
-def analyze_2p_bottom_loss(instance: hanab_game.HanabiInstance) -> List[InfeasibilityReason]:
+def bottom_non_fives(instance: hanab_game.HanabiInstance, num_cards: int = 3) -> List[DeckCard]:
+    """
+    Returns the last num_cards cards of the deck that are not fives, in deck order.
+    Only scans the deck from the bottom as far as needed.
+    """
+    cards = []
+    for card in reversed(instance.deck):
+        if card.rank != 5:
+            cards.append(card)
+            if len(cards) == num_cards:
+                break
+    cards.reverse()
+    return cards
+
+
+def analyze_2p_bottom_loss(
+        instance: hanab_game.HanabiInstance,
+        filtered_deck: Optional[List[DeckCard]] = None
+) -> List[InfeasibilityReason]:
     reasons = []
-    filtered_deck = [card for card in instance.deck if card.rank != 5]
+    if filtered_deck is None:
+        filtered_deck = bottom_non_fives(instance)
     if instance.num_players == 2:
         if filtered_deck[-1] == filtered_deck[-2] and filtered_deck[-1].rank == 2:
             reasons.append(InfeasibilityReason(InfeasibilityType.Pace, filtered_deck[-2].deck_index - 1))
@@ -141,6 +190,34 @@ def analyze_2p_bottom_loss(instance: hanab_game.HanabiInstance) -> List[Infeasib
     return reasons
 
 
+def artificial_crits(instance: hanab_game.HanabiInstance, filtered_deck: Optional[List[DeckCard]] = None) -> Set[DeckCard]:
+    """
+    Investigate BDRs. This catches special cases of Pace losses in 2p, as well as mark some cards critical because
+    their second copies cannot be used.
+    :param filtered_deck: The last three non-fives of the deck, if already known
+    """
+    crits = set()
+    if filtered_deck is None:
+        filtered_deck = bottom_non_fives(instance)
+    if instance.num_players == 2:
+        # In 2-player, the second-last card cannot be played if it is a 2
+        if filtered_deck[-2].rank == 2:
+            crits.add(filtered_deck[-2])
+
+        # In 2-player, in case there is double bottom 3 of the same suit, the card immediately before cannot be played:
+        # After playing that one and drawing the first 3, exactly 3,4,5 of the bottom suit have to be played
+        if filtered_deck[-1] == filtered_deck[-2] and filtered_deck[-2].rank == 3:
+            crits.add(filtered_deck[-3])
+    elif instance.num_players == 3:
+        if filtered_deck[-1] == filtered_deck[-2] and filtered_deck[-2].rank == 2:
+            crits.add(filtered_deck[-3])
+
+    # Last card in the deck can never be played unless it is a five.
+    if instance.deck[-1].rank != 5:
+        crits.add(instance.deck[-1])
+    return crits
+
+
 @dataclass
 class ValueWithIndex:
     value: int
@@ -176,8 +253,130 @@ class AnalysisResult:
         }
 
 
+class PaceAndHandSizeSweep:
+    """
+    State of a sweep through the deck as described in analyze_pace_and_hand_size.
+    Cards are fed one at a time, so that several sweeps can run side by side in a single pass over the deck.
+    Cards are stored by their keys suit_index * 8 + rank to avoid creating and hashing DeckCard objects.
+    """
+    def __init__(
+            self,
+            instance: hanab_game.HanabiInstance,
+            artificial_crits: Set[DeckCard],
+            do_squeeze: bool = True,
+            list_all_pace_cuts: bool = False,
+            split_off_clean_sweep: bool = False
+    ):
+        self.instance = instance
+        self.artificial_crits = {8 * card.suitIndex + card.rank for card in artificial_crits}
+        self.do_squeeze = do_squeeze
+        self.list_all_pace_cuts = list_all_pace_cuts
+        self.result = AnalysisResult()
+
+        self.stacks = [0] * instance.num_suits
+        self.score = 0
+        # we will ensure that stored_crits is a subset of stored_cards
+        self.stored_cards = set()
+        self.stored_crits = set()
+
+        self.pace_found = False
+        self.hand_size_found = False
+        self.squeeze = False
+        self.hand_size = instance.num_players * instance.hand_size
+        self.pace_offset = instance.deck_size - 1 + instance.num_players - instance.max_score
+
+        # If requested, a sweep without squeeze is split off the moment we squeeze for the first time
+        self.split_off_clean_sweep = split_off_clean_sweep
+        self.clean_sweep: Optional[PaceAndHandSizeSweep] = None
+
+    def copy_without_squeeze(self):
+        """
+        Returns a sweep in the same state that does not squeeze from now on.
+        The returned sweep only collects reasons found after this point.
+        """
+        sweep = PaceAndHandSizeSweep(self.instance, set(), False, self.list_all_pace_cuts)
+        sweep.artificial_crits = self.artificial_crits
+        sweep.stacks = self.stacks.copy()
+        sweep.score = self.score
+        sweep.stored_cards = self.stored_cards.copy()
+        sweep.stored_crits = self.stored_crits.copy()
+        sweep.pace_found = self.pace_found
+        sweep.hand_size_found = self.hand_size_found
+        sweep.squeeze = self.squeeze
+        return sweep
+
+    def step(self, card_index: int, card: DeckCard, update_statistics: bool = True, check: bool = True):
+        suit_index = card.suitIndex
+        rank = card.rank
+        stacks = self.stacks
+        if rank == stacks[suit_index] + 1:
+            # card is playable
+            stacks[suit_index] += 1
+            self.score += 1
+            # check for further playables that we stored
+            for check_key in range(8 * suit_index + rank + 1, 8 * suit_index + 6):
+                if check_key in self.stored_cards:
+                    stacks[suit_index] += 1
+                    self.score += 1
+                    self.stored_cards.remove(check_key)
+                    self.stored_crits.discard(check_key)
+                else:
+                    break
+        elif rank > stacks[suit_index] + 1:
+            # need to store card
+            key = 8 * suit_index + rank
+            if key in self.stored_cards or rank == 5 or key in self.artificial_crits:
+                self.stored_crits.add(key)
+            self.stored_cards.add(key)
+        # else: card is trash
+
+        # In case we can only keep the critical cards exactly, get rid of all others
+        if self.do_squeeze and len(self.stored_crits) == self.hand_size - 1:
+            if self.split_off_clean_sweep and self.clean_sweep is None:
+                self.clean_sweep = self.copy_without_squeeze()
+                self.clean_sweep.check(card_index, update_statistics=False)
+            # Note the very important copy here (!)
+            self.stored_cards = self.stored_crits.copy()
+            self.squeeze = True
+
+        if check:
+            self.check(card_index, update_statistics)
+
+    def check(self, card_index: int, update_statistics: bool = True):
+        instance = self.instance
+        reasons = self.result.infeasibility_reasons
+        hand_size_left_for_crits = self.hand_size - len(self.stored_crits) - 1
+
+        # Use a bool flag to only mark this reason once
+        if hand_size_left_for_crits < 0 and not self.hand_size_found:
+            reasons.append(InfeasibilityReason(InfeasibilityType.HandSize, card_index))
+            self.hand_size_found = True
+
+        # This is the number of remaining plays ((deck_size - card_index - 1) + num_players)
+        # minus the number of needed plays (max_score - score)
+        cur_pace = self.pace_offset - card_index + self.score
+        if cur_pace <= 0 and (self.list_all_pace_cuts or (not self.pace_found)):
+            if self.squeeze:
+                # We checked single-suit pace losses beforehand (which can only occur in 2p)
+                # The value we store is the number of cards still left in the deck
+                reasons.append(InfeasibilityReason(InfeasibilityType.PaceAfterSqueeze, instance.deck_size - card_index - 1, cur_pace))
+            else:
+                reasons.append(InfeasibilityReason(InfeasibilityType.Pace, instance.deck_size - card_index - 1, cur_pace))
+
+            self.pace_found = True
+
+        if update_statistics:
+            # Comparing here first saves the function calls for the (common) case of no change
+            result = self.result
+            if cur_pace < result.min_pace.value:
+                result.min_pace.update(cur_pace, card_index)
+            if len(self.stored_cards) > result.max_stored_cards.value:
+                result.max_stored_cards.update(len(self.stored_cards), card_index)
+            if len(self.stored_crits) > result.max_stored_crits.value:
+                result.max_stored_crits.update(len(self.stored_crits), card_index)
+
+
 def analyze_pace_and_hand_size(instance: hanab_game.HanabiInstance, do_squeeze: bool = True, list_all_pace_cuts: bool = False) -> AnalysisResult:
-    reasons = AnalysisResult()
     # we will sweep through the deck and pretend that
     # - we keep all non-trash cards in our hands
     # - we instantly play all playable cards as soon as we have them
@@ -196,151 +395,313 @@ def analyze_pace_and_hand_size(instance: hanab_game.HanabiInstance, do_squeeze:
     # for crit-cards, the usual hand card limit applies.
     # This allows us to detect some seeds where there are simply too many unplayable cards to hold at some point
     # that also can't be discarded
-
-    stacks = [0] * instance.num_suits
-
-    # we will ensure that stored_crits is a subset of stored_cards
-    stored_cards = set()
-    stored_crits = set()
-
-    pace_found = False
-    hand_size_found = False
-    squeeze = False
-    artificial_crits = set()
-
-
-    # Investigate BDRs. This catches special cases of Pace losses in 2p, as well as mark some cards critical because
-    # their second copies cannot be used.
-    filtered_deck = [card for card in instance.deck if card.rank != 5]
-    if instance.num_players == 2:
-        # In 2-player, the second-last card cannot be played if it is a 2
-        if filtered_deck[-2].rank == 2:
-            artificial_crits.add(filtered_deck[-2])
-
-        # In 2-player, in case there is double bottom 3 of the same suit, the card immediately before cannot be played:
-        # After playing that one and drawing the first 3, exactly 3,4,5 of the bottom suit have to be played
-        if filtered_deck[-1] == filtered_deck[-2] and filtered_deck[-2].rank == 3:
-            artificial_crits.add(filtered_deck[-3])
-    elif instance.num_players == 3:
-        if filtered_deck[-1] == filtered_deck[-2] and filtered_deck[-2].rank == 2:
-            artificial_crits.add(filtered_deck[-3])
-
-    # Last card in the deck can never be played unless it is a five.
-    if instance.deck[-1].rank != 5:
-        artificial_crits.add(instance.deck[-1])
-
+    sweep = PaceAndHandSizeSweep(instance, artificial_crits(instance), do_squeeze, list_all_pace_cuts)
     for (card_index, card) in enumerate(instance.deck):
-        if card.rank == stacks[card.suitIndex] + 1:
-            # card is playable
-            stacks[card.suitIndex] += 1
-            # check for further playables that we stored
-            for check_rank in range(card.rank + 1, 6):
-                check_card = hanab_game.DeckCard(card.suitIndex, check_rank)
-                if check_card in stored_cards:
-                    stacks[card.suitIndex] += 1
-                    stored_cards.remove(check_card)
-                    if check_card in stored_crits:
-                        stored_crits.remove(check_card)
-                else:
-                    break
-        elif card.rank <= stacks[card.suitIndex]:
-            pass  # card is trash
-        elif card.rank > stacks[card.suitIndex] + 1:
-            # need to store card
-            if card in stored_cards or card.rank == 5 or card in artificial_crits:
-                stored_crits.add(card)
-            stored_cards.add(card)
-
-        hand_size_left_for_crits = instance.num_players * instance.hand_size - len(stored_crits) - 1
+        sweep.step(card_index, card)
+    return sweep.result
 
-        # In case we can only keep the critical cards exactly, get rid of all others
-        if hand_size_left_for_crits == 0 and do_squeeze:
-            # Note the very important copy here (!)
-            stored_cards = stored_crits.copy()
-            squeeze = True
 
-        # Use a bool flag to only mark this reason once
-        if hand_size_left_for_crits < 0 and not hand_size_found:
-            reasons.infeasibility_reasons.append(InfeasibilityReason(InfeasibilityType.HandSize, card_index))
-            hand_size_found = True
-
-        max_remaining_plays = (instance.deck_size - card_index - 1) + instance.num_players
-        needed_plays = instance.max_score - sum(stacks)
-        cur_pace = max_remaining_plays - needed_plays
-        if cur_pace <= 0 and (list_all_pace_cuts or (not pace_found)):
-            if squeeze:
-                # We checked single-suit pace losses beforehand (which can only occur in 2p)
-                # The value we store is the number of cards still left in the deck
-                reasons.infeasibility_reasons.append(InfeasibilityReason(InfeasibilityType.PaceAfterSqueeze, instance.deck_size - card_index - 1, cur_pace))
-            else:
-                reasons.infeasibility_reasons.append(InfeasibilityReason(InfeasibilityType.Pace, instance.deck_size - card_index - 1, cur_pace))
+def _add_reason(reasons: List[InfeasibilityReason], reason: InfeasibilityReason):
+    if reason not in reasons:
+        reasons.append(reason)
 
-            pace_found = True
 
-#        if card_index != instance.deck_size - 1:
-        reasons.min_pace.update(cur_pace, card_index)
-        reasons.max_stored_cards.update(len(stored_cards), card_index)
-        reasons.max_stored_crits.update(len(stored_crits), card_index)
+def analyze(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool = False) -> AnalysisResult:
+    """
+    Runs all checks for infeasibility in a single pass over the deck.
+    The pace and hand size analysis with squeeze is accompanied by one without squeeze,
+    which is split off the moment the first squeeze happens and is only relevant in case pace runs out after that.
+    Cards of the starting hands are collected along the way for the top/bottom deck check,
+    which then only has to look at the last cards of the deck.
+    """
+    filtered_deck = bottom_non_fives(instance)
+    sweep = PaceAndHandSizeSweep(
+        instance, artificial_crits(instance, filtered_deck), True, list_all_pace_cuts, split_off_clean_sweep=True
+    )
+    holders = {}
+    num_dealt_cards = instance.num_dealt_cards
 
-    return reasons
+    for (card_index, card) in enumerate(instance.deck):
+        if card_index < num_dealt_cards:
+            holders.setdefault(card, []).append(card_index // instance.hand_size)
 
+        clean_sweep = sweep.clean_sweep
+        sweep.step(card_index, card)
+        if clean_sweep is not None:
+            clean_sweep.step(card_index, card, update_statistics=False)
 
-def analyze(instance: hanab_game.HanabiInstance, list_all_pace_cuts: bool = False) -> AnalysisResult:
-    # Check for pace and hand size problems:
-    result = analyze_pace_and_hand_size(instance, do_squeeze=True, list_all_pace_cuts=list_all_pace_cuts)
-    # In case pace ran out after a squeeze from hand size, we want to run a clean pace analysis again
-    if any(map(lambda r: r.type == InfeasibilityType.PaceAfterSqueeze, result.infeasibility_reasons)):
-        result.infeasibility_reasons += analyze_pace_and_hand_size(instance, False, list_all_pace_cuts).infeasibility_reasons
+    result = sweep.result
+    reasons = result.infeasibility_reasons
+    # In case pace ran out after a squeeze from hand size, we also want the reasons of a clean pace analysis
+    if any(reason.type == InfeasibilityType.PaceAfterSqueeze for reason in reasons):
+        for reason in sweep.clean_sweep.result.infeasibility_reasons:
+            _add_reason(reasons, reason)
 
     # Top/bottom deck losses in a single suit.
-    top_bottom_deck_loss = check_for_top_bottom_deck_loss(instance)
+    top_bottom_deck_loss = check_for_top_bottom_deck_loss(instance, holders)
     if top_bottom_deck_loss is not None:
-        result.infeasibility_reasons.append(InfeasibilityReason(InfeasibilityType.BottomTopDeck, top_bottom_deck_loss))
+        _add_reason(reasons, InfeasibilityReason(InfeasibilityType.BottomTopDeck, top_bottom_deck_loss))
 
     # Special cases of pace loss, categorization for 2p only
     if instance.num_players == 2:
-        result.infeasibility_reasons += analyze_2p_bottom_loss(instance)
+        for reason in analyze_2p_bottom_loss(instance, filtered_deck):
+            _add_reason(reasons, reason)
 
     # check for critical non-fives at the bottom of the deck
     bottom_card = instance.deck[-1]
     if bottom_card.rank != 5 and bottom_card.suitIndex in instance.dark_suits:
-        result.infeasibility_reasons.append(InfeasibilityReason(
+        _add_reason(reasons, InfeasibilityReason(
             InfeasibilityType.CritAtBottom,
             instance.deck_size - 1
         ))
 
-    # cleanup reasons to unique
-    result.infeasibility_reasons = list(set(result.infeasibility_reasons))
     return result
 
 
-def run_on_database(variant_id, list_all_pace_cuts: bool = False):
+def analyze_state(game: hanab_game.GameState, list_all_pace_cuts: bool = False) -> AnalysisResult:
+    """
+    Runs the checks of analyze on a game in progress, so that lost states can be detected without SAT.
+    The sweep starts from the current stacks, with all cards in hands drawn (and played instantly if possible).
+    Cards whose other copies are all in the trash count as critical.
+    Checks based on the bottom of the deck are only run as long as the cards involved have not been drawn,
+    the top/bottom deck check is only run on fresh games since it depends on the starting hands.
+    """
+    instance = game.instance
+    if len(game.actions) == 0:
+        return analyze(instance, list_all_pace_cuts)
+
+    result = AnalysisResult()
+    reasons = result.infeasibility_reasons
+    if game.is_won():
+        return result
+    if game.strikes >= instance.num_strikes:
+        reasons.append(InfeasibilityReason(InfeasibilityType.Strikes, value=game.strikes))
+        return result
+
+    # Cards that are still needed and of which only one copy is left are critical
+    copies_left = collections.Counter(instance.deck)
+    copies_left.subtract(game.trash)
+    last_copies = set()
+    for (card, num_copies) in copies_left.items():
+        if card.rank > game.stacks[card.suitIndex]:
+            if num_copies == 0:
+                reasons.append(InfeasibilityReason(InfeasibilityType.CritDiscarded, card.suitIndex, card.rank))
+            elif num_copies == 1:
+                last_copies.add(card)
+    if len(reasons) != 0:
+        return result
+
+    if game.progress == instance.deck_size:
+        # In the extra round, every remaining turn can play at most one card
+        cur_pace = game.remaining_extra_turns - (instance.max_score - game.score)
+        if cur_pace < 0:
+            reasons.append(InfeasibilityReason(InfeasibilityType.Pace, 0, cur_pace))
+        return result
+
+    filtered_deck = bottom_non_fives(instance)
+    bottom_undrawn = game.progress <= filtered_deck[0].deck_index
+    crits = last_copies
+    if bottom_undrawn:
+        crits |= artificial_crits(instance, filtered_deck)
+    elif game.progress < instance.deck_size and instance.deck[-1].rank != 5:
+        crits.add(instance.deck[-1])
+
+    sweep = PaceAndHandSizeSweep(instance, crits, True, list_all_pace_cuts)
+    sweep.stacks = game.stacks.copy()
+    sweep.score = sum(game.stacks)
+    for card in sorted((card for hand in game.hands for card in hand), key=lambda card: card.deck_index):
+        sweep.step(card.deck_index, card, check=False)
+
+    sweep.check(game.progress - 1)
+    for card_index in range(game.progress, instance.deck_size):
+        sweep.step(card_index, instance.deck[card_index])
+    result = sweep.result
+    reasons = result.infeasibility_reasons
+
+    if bottom_undrawn and instance.num_players == 2:
+        for reason in analyze_2p_bottom_loss(instance, filtered_deck):
+            # These only apply if the cards at the bottom are still needed
+            if filtered_deck[-1].rank > game.stacks[filtered_deck[-1].suitIndex]:
+                _add_reason(reasons, reason)
+
+    bottom_card = instance.deck[-1]
+    if bottom_card.rank != 5 and bottom_card.suitIndex in instance.dark_suits:
+        _add_reason(reasons, InfeasibilityReason(InfeasibilityType.CritAtBottom, instance.deck_size - 1))
+
+    return result
+
+
+def score_distributions(num_suits: int, score: int):
+    """
+    Generates all possible stacks (with ranks at most 5) with the given total score
+    """
+    if num_suits == 0:
+        if score == 0:
+            yield []
+        return
+    for stack in range(min(5, score), max(0, score - 5 * (num_suits - 1)) - 1, -1):
+        for stacks in score_distributions(num_suits - 1, score - stack):
+            yield [stack] + stacks
+
+
+def reaches_stacks(instance: hanab_game.HanabiInstance, stacks: List[int]) -> bool:
+    """
+    Checks whether the pace and hand size analysis allows to finish the game with the given stacks.
+    All cards above the target stack of their suit are treated as trash, so fewer cards are critical
+    and fewer plays are needed than for the maximum score.
+    Artificial crits are not used, since they only apply when all suits have to be completed.
+    """
+    sweep = PaceAndHandSizeSweep(instance, set())
+    # Remaining plays minus needed plays, as for the maximum score
+    sweep.pace_offset = instance.deck_size - 1 + instance.num_players - sum(stacks)
+    reasons = sweep.result.infeasibility_reasons
+    for (card_index, card) in enumerate(instance.deck):
+        if card.rank > stacks[card.suitIndex]:
+            sweep.check(card_index, update_statistics=False)
+        else:
+            sweep.step(card_index, card, update_statistics=False)
+        if len(reasons) != 0:
+            return False
+    return True
+
+
+# Number of stack distributions checked by score_upper_bound before settling for the current bound
+MAX_DISTRIBUTIONS_CHECKED = 500
+
+
+def score_upper_bound(instance: hanab_game.HanabiInstance, max_checks: int = MAX_DISTRIBUTIONS_CHECKED) -> int:
+    """
+    Computes an upper bound on the score that can be achieved on the instance.
+    If analyze finds the instance infeasible, we first bound the score by pace alone:
+    Aiming for a lower score cannot make more cards available early, so each point of minimum pace
+    missing for the maximum score costs one point of score.
+    Then, descending from this bound, we check all distributions of the score over the suits with reaches_stacks
+    until one of them is not ruled out. If this takes more than max_checks checks, the current score is returned.
+    """
+    if len(analyze(instance).infeasibility_reasons) == 0:
+        return instance.max_score
+
+    pace_result = analyze_pace_and_hand_size(instance, do_squeeze=False)
+    bound = min(instance.max_score - 1, instance.max_score - 1 + pace_result.min_pace.value)
+    num_checks = 0
+    for score in range(bound, 0, -1):
+        for stacks in score_distributions(instance.num_suits, score):
+            if num_checks == max_checks:
+                return score
+            num_checks += 1
+            if reaches_stacks(instance, stacks):
+                return score
+    return 0
+
+
+# Number of seeds read, analyzed and written back at once when analyzing the database
+ANALYSIS_BATCH_SIZE = 5000
+
+
+def _store_analysis_results(variant_id: int, shard: sharding.Shard, reason_rows: List[Tuple[str, int, int, int]], last_seed: str):
+    """
+    Stores the reasons found for a batch of seeds and advances the progress of the variant in one transaction,
+    so that an interrupted run can be resumed after the last committed batch.
+    """
+    psycopg2.extras.execute_values(
+        database.cur,
+        "INSERT INTO infeasibility_reasons (seed, reason, index, value) "
+        "VALUES %s "
+        "ON CONFLICT (seed, reason, index) DO NOTHING",
+        reason_rows,
+        page_size=1000
+    )
+    psycopg2.extras.execute_values(
+        database.cur,
+        "UPDATE seeds SET feasible = false "
+        "FROM (VALUES %s) AS infeasible (seed) "
+        "WHERE seeds.seed = infeasible.seed",
+        [(seed,) for seed in dict.fromkeys(seed for (seed, _, _, _) in reason_rows)],
+        page_size=1000
+    )
     database.cur.execute(
-        "SELECT seed, num_players, deck FROM seeds WHERE variant_id = (%s) ORDER BY (num_players, seed)",
-        (variant_id,)
+        "INSERT INTO deck_analysis_progress (variant_id, shard, num_shards, last_seed) "
+        "VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (variant_id, shard, num_shards) DO UPDATE "
+        "SET last_seed = EXCLUDED.last_seed",
+        (variant_id, shard.index, shard.count, last_seed)
     )
-    res = database.cur.fetchall()
-    logger.verbose("Checking {} seeds of variant {} for infeasibility".format(len(res), variant_id))
-    with alive_progress.alive_bar(total=len(res), title='Check for infeasibility reasons in var {}'.format(variant_id)) as bar:
-        for (seed, num_players, deck_str) in res:
-            deck = compress.decompress_deck(deck_str)
-            result = analyze(hanab_game.HanabiInstance(deck, num_players), list_all_pace_cuts=list_all_pace_cuts)
-            for reason in result.infeasibility_reasons:
-                database.cur.execute(
-                    "INSERT INTO score_upper_bounds (seed, score_upper_bound, reason) "
-                    "VALUES (%s,%s,%s) "
-                    "ON CONFLICT (seed, reason) DO UPDATE "
-                    "SET score_upper_bound = EXCLUDED.score_upper_bound",
-                    (seed, reason.score_upper_bound, reason.type.value)
-                )
-                database.cur.execute(
-                    "UPDATE seeds SET feasible = (%s) WHERE seed = (%s)",
-                    (False, seed)
-                )
-            bar()
     database.conn.commit()
 
 
+def run_on_database(variant_id, list_all_pace_cuts: bool = False, num_threads: int = 4, restart: bool = False, shard: sharding.Shard = sharding.ALL_SEEDS):
+    """
+    Analyzes all seeds of the given variant and stores the infeasibility reasons found.
+    Decks are streamed from the database in order of their seeds and analyzed in batches by a process pool,
+    results are written back batch by batch in the same order.
+    The last seed written is stored in deck_analysis_progress, and later runs continue from there unless restarting.
+    If only a shard of the seeds is analyzed, progress is tracked separately for that shard.
+    """
+    # Imported here, since the batch analyzer builds on this module
+    from hanabi.solvers import batch_deck_analyzer
+
+    if restart:
+        database.cur.execute(
+            "DELETE FROM deck_analysis_progress WHERE variant_id = (%s) AND shard = (%s) AND num_shards = (%s)",
+            (variant_id, shard.index, shard.count)
+        )
+        database.conn.commit()
+    database.cur.execute(
+        "SELECT last_seed FROM deck_analysis_progress WHERE variant_id = (%s) AND shard = (%s) AND num_shards = (%s)",
+        (variant_id, shard.index, shard.count)
+    )
+    progress = database.cur.fetchone()
+    last_seed = "" if progress is None else progress[0]
+
+    database.cur.execute(
+        "SELECT COUNT(*) FROM seeds WHERE variant_id = (%s) AND seed > (%s) AND {}".format(shard.sql_condition('seed')),
+        (variant_id, last_seed)
+    )
+    (num_seeds,) = database.cur.fetchone()
+    if progress is not None:
+        logger.info("Resuming analysis of variant {} (shard {}) after seed {}".format(variant_id, shard, last_seed))
+    logger.verbose("Checking {} seeds of variant {} (shard {}) for infeasibility".format(num_seeds, variant_id, shard))
+
+    # We commit after each batch, so the server-side cursor has to survive commits
+    with database.conn.cursor(name='deck_analyzer_seeds', withhold=True) as seeds_cur, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=num_threads) as executor, \
+            alive_progress.alive_bar(
+                total=num_seeds, title='Check for infeasibility reasons in var {}'.format(variant_id)
+            ) as bar:
+        seeds_cur.itersize = ANALYSIS_BATCH_SIZE
+        seeds_cur.execute(
+            "SELECT seeds.seed, num_players, "
+            "array_agg(suit_index ORDER BY deck_index ASC), array_agg(rank ORDER BY deck_index ASC) "
+            "FROM seeds "
+            "INNER JOIN decks ON seeds.seed = decks.seed "
+            "WHERE variant_id = (%s) "
+            "AND seeds.seed > (%s) "
+            "AND {} "
+            "GROUP BY seeds.seed "
+            "ORDER BY seeds.seed".format(shard.sql_condition()),
+            (variant_id, last_seed)
+        )
+
+        # Batches in flight, in the order they have been read, so that progress only advances over stored results
+        pending = collections.deque()
+
+        def store_oldest_batch():
+            (future, batch_last_seed, batch_size) = pending.popleft()
+            _store_analysis_results(variant_id, shard, future.result(), batch_last_seed)
+            bar(batch_size)
+
+        while True:
+            seeds = seeds_cur.fetchmany(ANALYSIS_BATCH_SIZE)
+            if len(seeds) == 0:
+                break
+            future = executor.submit(batch_deck_analyzer.analyze_seeds, seeds, list_all_pace_cuts)
+            pending.append((future, seeds[-1][0], len(seeds)))
+            if len(pending) >= 2 * num_threads:
+                store_oldest_batch()
+        while len(pending) > 0:
+            store_oldest_batch()
+
+
 def main():
     seed = "p5v0sporcupines-underclass-phantasmagorical"
     seed = 'p5c1s98804'
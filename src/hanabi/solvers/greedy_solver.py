@@ -1,11 +1,17 @@
 #! /bin/python3
 import collections
+import dataclasses
+import json
 import sys
 
+from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import Optional, List, Dict
+
+import platformdirs
 
 from hanabi import logger
+from hanabi import constants
 from hanabi import hanab_game
 from hanabi.live import compress
 from hanabi import database
@@ -136,9 +142,91 @@ class CheatingStrategy:
         exit(0)
 
 
+@dataclass
+class GreedyWeights:
+    """
+    Parameters of the greedy strategy, the defaults are the original hand-picked values.
+    Plays with highest weight are preferred, discards with lowest weight.
+    """
+    # playable card without copy in another hand, depending on whether somebody holds the connecting card
+    unique_connected_play: float = 6
+    unique_play: float = 1
+    # playable card whose copy is held by somebody else, depending on whether our copy is needed for the connection
+    needed_copy_play: float = 4
+    unneeded_copy_play: float = 0.5
+    # dispensable card, depending on distance to next copy in deck and its rank
+    next_copy_distance: float = 1
+    dispensable_rank: float = 2
+
+    def to_vector(self) -> List[float]:
+        return [getattr(self, field.name) for field in dataclasses.fields(self)]
+
+    @staticmethod
+    def from_vector(vector: List[float]):
+        return GreedyWeights(*vector)
+
+
+def greedy_weights_file() -> str:
+    return platformdirs.user_data_dir(constants.APP_NAME, ensure_exists=True) + '/greedy_weights.json'
+
+
+def greedy_weights_key(instance: hanab_game.HanabiInstance) -> str:
+    """
+    Weights are tuned and used per number of players and number of (dark) suits,
+    so weights tuned on one kind of deck are never applied to decks of another kind.
+    """
+    return "{}p-{}s-{}d".format(instance.num_players, instance.num_suits, instance.num_dark_suits)
+
+
+# Cache of weights read from the weights file, we only read this once per process
+_greedy_weights: Optional[Dict[str, GreedyWeights]] = None
+
+
+def load_greedy_weights(instance: hanab_game.HanabiInstance) -> GreedyWeights:
+    """
+    Returns the weights tuned for instances like the given one, falls back to the defaults if there are none.
+    """
+    global _greedy_weights
+    if _greedy_weights is None:
+        _greedy_weights = {}
+        try:
+            with open(greedy_weights_file(), "r") as f:
+                for key, entry in json.load(f).items():
+                    _greedy_weights[key] = GreedyWeights.from_vector(entry['weights'])
+        except FileNotFoundError:
+            pass
+    return _greedy_weights.get(greedy_weights_key(instance), GreedyWeights())
+
+
+def store_greedy_weights(
+        instance: hanab_game.HanabiInstance, variant_id: int, weights: GreedyWeights, num_won: int, sample_size: int
+):
+    """
+    Stores weights for all instances like the given one, remembering the variant they were tuned on
+    """
+    global _greedy_weights
+    try:
+        with open(greedy_weights_file(), "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    key = greedy_weights_key(instance)
+    data[key] = {
+        'weights': weights.to_vector(),
+        'variant_id': variant_id,
+        'num_won': num_won,
+        'sample_size': sample_size
+    }
+    with open(greedy_weights_file(), "w") as f:
+        json.dump(data, f, indent=2)
+    _greedy_weights = None
+    logger.verbose("Stored greedy weights {} for {} in {}".format(weights, key, greedy_weights_file()))
+
+
 class GreedyStrategy():
-    def __init__(self, game_state: hanab_game.GameState):
+    def __init__(self, game_state: hanab_game.GameState, weights: Optional[GreedyWeights] = None):
         self.game_state = game_state
+        self.weights = weights or GreedyWeights()
 
         self.earliest_draw_times = []
         for s in range(0, game_state.instance.num_suits):
@@ -191,32 +279,37 @@ class GreedyStrategy():
 
                     if len(copy_holders) == 0:
                         # card is unique, imortancy is based lexicographically on whether somebody has the conn. card and the rank
-                        state.weight = (6 if len(connecting_holders) > 0 else 1) * (6 - state.card.rank)
+                        if len(connecting_holders) > 0:
+                            state.weight = self.weights.unique_connected_play * (6 - state.card.rank)
+                        else:
+                            state.weight = self.weights.unique_play * (6 - state.card.rank)
                     else:
                         # copy is available somewhere else
                         if len(connecting_holders) == 0:
                             # card is not urgent
-                            state.weight = 0.5 * (6 - state.card.rank)
+                            state.weight = self.weights.unneeded_copy_play * (6 - state.card.rank)
                         else:
                             # there is a copy and there is a connecting card. check if they are out of order
                             turns_to_copy = min(map(lambda holder: player_distance(player, holder), copy_holders))
                             turns_to_conn = max(map(lambda holder: player_distance(player, holder), connecting_holders))
                             if turns_to_copy < turns_to_conn:
                                 # our copy is not neccessary for connecting card to be able to play
-                                state.weight = 0.5 * (6 - state.card.rank)
+                                state.weight = self.weights.unneeded_copy_play * (6 - state.card.rank)
                             else:
                                 # our copy is important, scale it little less than if it were unique
-                                state.weight = 4 * (6 - state.card.rank)
+                                state.weight = self.weights.needed_copy_play * (6 - state.card.rank)
                 elif state.card_type == CardType.Dispensable:
                     try:
                         # TODO: consider duplicate in hand
                         copy_holders = list(self.game_state.holding_players(state.card))
                         copy_holders.remove(player)
-                        nextCopy = self.game_state.deck[self.game_state.progress:].index(card)
-                    except:
+                        nextCopy = self.game_state.deck[self.game_state.progress:].index(state.card)
+                    except ValueError:
+                        # no copy left in the deck
                         nextCopy = 1
                     #                    state.weight = self.suit_badness[state.card.suitIndex] * nextCopy + 2 * (5 - state.card.rank)
-                    state.weight = nextCopy + 2 * (5 - state.card.rank)
+                    state.weight = self.weights.next_copy_distance * nextCopy \
+                        + self.weights.dispensable_rank * (5 - state.card.rank)
 
         cur_hand = hand_states[self.game_state.turn]
         plays = [cstate for cstate in cur_hand if cstate.card_type == CardType.Playable]
@@ -0,0 +1,136 @@
+import concurrent.futures
+import math
+import random
+from typing import List, Tuple
+
+import alive_progress
+
+from hanabi import logger
+from hanabi import database
+from hanabi import hanab_game
+from hanabi.solvers import greedy_solver
+
+
+# Corpus of decks of the worker process, set once by the initializer so that decks are only transferred once
+_corpus: List[List[Tuple[int, int]]] = []
+_corpus_num_players: int = 0
+
+
+def _init_worker(corpus: List[List[Tuple[int, int]]], num_players: int):
+    global _corpus, _corpus_num_players
+    _corpus = corpus
+    _corpus_num_players = num_players
+
+
+def _evaluate_chunk(weights_vector: List[float], start: int, end: int) -> Tuple[int, int]:
+    """
+    Plays the decks with indices in [start, end) of the corpus with the greedy strategy.
+    :return: Number of games won and total score of all games
+    """
+    weights = greedy_solver.GreedyWeights.from_vector(weights_vector)
+    num_won = 0
+    total_score = 0
+    for cards in _corpus[start:end]:
+        deck = [hanab_game.DeckCard(suit_index, rank) for (suit_index, rank) in cards]
+        game = hanab_game.GameState(hanab_game.HanabiInstance(deck, _corpus_num_players))
+        strat = greedy_solver.GreedyStrategy(game, weights)
+        while not game.is_over():
+            strat.make_move()
+        if game.is_won():
+            num_won += 1
+        total_score += game.score
+    return num_won, total_score
+
+
+def load_corpus(variant_id: int, num_players: int, seed_class: int, sample_size: int) -> List[List[Tuple[int, int]]]:
+    """
+    Loads a fixed sample of seeds from the database. Seeds that are known to be infeasible are ignored,
+    since the greedy strategy cannot win them anyway.
+    """
+    database.cur.execute(
+        "SELECT array_agg(suit_index ORDER BY deck_index ASC), array_agg(rank ORDER BY deck_index ASC) "
+        "FROM seeds "
+        "INNER JOIN decks ON seeds.seed = decks.seed "
+        "WHERE variant_id = (%s) "
+        "AND class = (%s) "
+        "AND num_players = (%s) "
+        "AND feasible IS NOT FALSE "
+        "GROUP BY seeds.seed ORDER BY seeds.seed "
+        "LIMIT (%s)",
+        (variant_id, seed_class, num_players, sample_size)
+    )
+    return [list(zip(suits, ranks)) for (suits, ranks) in database.cur.fetchall()]
+
+
+def _perturb(vector: List[float], step_size: float, rng: random.Random) -> List[float]:
+    # Only the relative size of the weights matters, so we perturb multiplicatively
+    return [w * math.exp(rng.gauss(0, step_size)) for w in vector]
+
+
+def tune_greedy_weights(
+        variant_id: int,
+        num_players: int,
+        seed_class: int = 0,
+        sample_size: int = 1000,
+        iterations: int = 50,
+        num_threads: int = 4,
+        rng_seed: int = 0
+) -> greedy_solver.GreedyWeights:
+    """
+    Tunes the weights of the greedy strategy for the given number of players by a (1+λ) evolution strategy
+    with step size adaptation, where λ = num_threads.
+    Candidates are compared by the number of won games on a fixed corpus of seeds, ties are broken by total score.
+    If the best configuration improves on the currently stored one, it is stored and from then on used by the solver
+    for instances with the same number of players and (dark) suits as the variant.
+    """
+    corpus = load_corpus(variant_id, num_players, seed_class, sample_size)
+    if len(corpus) == 0:
+        logger.error("No seeds found to tune greedy weights on.")
+        return greedy_solver.GreedyWeights()
+    # All decks of the variant have the same suits, so any of them determines which stored weights we tune
+    instance = hanab_game.HanabiInstance(
+        [hanab_game.DeckCard(suit_index, rank) for (suit_index, rank) in corpus[0]], num_players
+    )
+    logger.info("Tuning greedy weights for {} players on {} seeds of variant {}".format(
+        num_players, len(corpus), variant_id)
+    )
+
+    chunk_size = math.ceil(len(corpus) / num_threads)
+    rng = random.Random(rng_seed)
+    step_size = 0.3
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_threads, initializer=_init_worker, initargs=(corpus, num_players)
+    ) as executor:
+        def evaluate(vectors: List[List[float]]) -> List[Tuple[int, int]]:
+            fs = [
+                [executor.submit(_evaluate_chunk, vector, start, start + chunk_size)
+                 for start in range(0, len(corpus), chunk_size)]
+                for vector in vectors
+            ]
+            return [tuple(map(sum, zip(*(f.result() for f in candidate_fs)))) for candidate_fs in fs]
+
+        initial = greedy_solver.load_greedy_weights(instance).to_vector()
+        best = initial
+        [best_value] = evaluate([best])
+        initial_value = best_value
+        logger.verbose("Initial weights {} win {} games".format(best, best_value[0]))
+
+        with alive_progress.alive_bar(iterations, title='Tuning greedy weights ({}p)'.format(num_players)) as bar:
+            for _ in range(iterations):
+                candidates = [_perturb(best, step_size, rng) for _ in range(num_threads)]
+                values = evaluate(candidates)
+                value, candidate = max(zip(values, candidates), key=lambda t: t[0])
+                if value > best_value:
+                    best, best_value = candidate, value
+                    step_size *= 1.5
+                    logger.verbose("Improved weights {} win {} games".format(best, best_value[0]))
+                else:
+                    step_size *= 0.9
+                bar()
+
+    weights = greedy_solver.GreedyWeights.from_vector(best)
+    logger.info("Best weights win {} of {} games (previously {})".format(best_value[0], len(corpus), initial_value[0]))
+    if best_value > initial_value:
+        greedy_solver.store_greedy_weights(instance, variant_id, weights, best_value[0], len(corpus))
+    return weights